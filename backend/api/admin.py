@@ -17,8 +17,8 @@ class UserAdmin(BaseUserAdmin):
 @admin.register(Image)
 class ImageAdmin(admin.ModelAdmin):
     list_display = ['id', 'title', 'user', 'width', 'height', 'shot_at', 'uploaded_at']
-    list_filter = ['uploaded_at', 'shot_at']
-    search_fields = ['title', 'description', 'location']
+    list_filter = ['uploaded_at', 'shot_at', 'region', 'orientation']
+    search_fields = ['title', 'description', 'location', 'camera_model', 'lens_model']
     raw_id_fields = ['user']
     readonly_fields = ['uploaded_at', 'width', 'height']
 
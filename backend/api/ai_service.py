@@ -7,6 +7,8 @@ from PIL import Image
 import io
 import json
 
+from .imaging import bounded_draft, open_image
+
 
 # 配置Gemini API
 genai.configure(api_key=settings.GEMINI_API_KEY)
@@ -27,8 +29,8 @@ def analyze_image_with_ai(image_path):
         }
     """
     try:
-        # 加载图片
-        img = Image.open(image_path)
+        # 加载图片（缩放解码即可，模型不需要原始分辨率）
+        img = bounded_draft(open_image(image_path), (2048, 2048))
         
         # 转换为RGB模式（如果需要）
         if img.mode != 'RGB':
@@ -0,0 +1,47 @@
+"""
+缓存工具
+按用户维护图库版本号，图库内容变化时递增版本号，
+使依赖图库内容的缓存（筛选面板统计等）自动失效
+"""
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+
+
+def _version_key(user_id):
+    return f'library_version:{user_id}'
+
+
+def get_library_version(user_id):
+    """获取用户图库当前版本号"""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # 以当前时间作为初始版本，避免缓存被清空后与旧版本号重复
+        cache.add(key, int(time.time() * 1000), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_library_version(user_id):
+    """用户图库内容发生变化时调用"""
+    key = _version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, int(time.time() * 1000), timeout=None)
+
+
+def make_library_cache_key(prefix, user_id, params=None):
+    """
+    生成与用户图库版本绑定的缓存键
+    params: 影响结果的查询参数（dict），顺序无关
+    """
+    version = get_library_version(user_id)
+    digest = ''
+    if params:
+        query = urlencode(sorted((key, str(value)) for key, value in params.items()))
+        digest = hashlib.md5(query.encode('utf-8')).hexdigest()
+    return f'{prefix}:{user_id}:{version}:{digest}'
@@ -0,0 +1,161 @@
+"""
+主色提取与颜色筛选
+在缩略图像素上运行小规模 k-means 得到主色，并将主色量化到固定调色板，
+以位掩码形式存放在图片表的索引列上。按颜色筛选时把所选颜色展开为包含它们的全部掩码，
+以 IN 条件查询，可以使用 (user, color_mask) 索引，不需要逐行计算位运算。
+"""
+import colorsys
+from functools import lru_cache
+
+import numpy as np
+from PIL import Image as PILImage
+
+
+# 固定调色板，顺序即位掩码中的位序号，只能在末尾追加
+PALETTE = [
+    ('red', '红色'),
+    ('orange', '橙色'),
+    ('yellow', '黄色'),
+    ('green', '绿色'),
+    ('cyan', '青色'),
+    ('blue', '蓝色'),
+    ('purple', '紫色'),
+    ('pink', '粉色'),
+    ('brown', '棕色'),
+    ('white', '白色'),
+    ('gray', '灰色'),
+    ('black', '黑色'),
+]
+PALETTE_BITS = {name: 1 << index for index, (name, _) in enumerate(PALETTE)}
+PALETTE_ALL = (1 << len(PALETTE)) - 1
+
+# k-means 参数
+SAMPLE_SIZE = 64
+CLUSTER_COUNT = 5
+MAX_ITERATIONS = 10
+# 占比低于该值的主色不计入调色板掩码
+MIN_MASK_SHARE = 0.1
+# 占比低于该值的聚类不作为主色返回
+MIN_COLOR_SHARE = 0.02
+
+LUMA = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
+
+def extract_dominant_colors(image_file, k=CLUSTER_COUNT):
+    """
+    提取图片主色，建议传入缩略图以减少解码开销
+    返回: [((r, g, b), share), ...]，按占比降序；失败时返回 None
+    """
+    try:
+        img = PILImage.open(image_file)
+        img.draft('RGB', (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+        img = img.convert('RGB').resize((SAMPLE_SIZE, SAMPLE_SIZE), PILImage.Resampling.BILINEAR)
+        pixels = np.asarray(img, dtype=np.float32).reshape(-1, 3)
+
+        # 初始中心取亮度排序后的等分位点，结果稳定可复现
+        order = np.argsort(pixels @ LUMA)
+        centers = pixels[order[(np.arange(k) * 2 + 1) * len(pixels) // (2 * k)]]
+
+        for _ in range(MAX_ITERATIONS):
+            distances = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2)
+            labels = distances.argmin(axis=1)
+            counts = np.bincount(labels, minlength=k)
+            sums = np.stack(
+                [np.bincount(labels, weights=pixels[:, channel], minlength=k) for channel in range(3)],
+                axis=1
+            )
+            updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+            if np.abs(updated - centers).max() < 1.0:
+                centers = updated
+                break
+            centers = updated
+
+        labels = ((pixels[:, None, :] - centers[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+        shares = np.bincount(labels, minlength=k) / len(pixels)
+        colors = [
+            (tuple(int(round(value)) for value in centers[index]), float(shares[index]))
+            for index in np.argsort(-shares)
+            if shares[index] >= MIN_COLOR_SHARE
+        ]
+        return colors
+
+    except Exception as e:
+        print(f"提取主色失败: {str(e)}")
+        return None
+
+
+def classify_color(rgb):
+    """将 RGB 颜色归入调色板中的一个颜色"""
+    h, s, v = colorsys.rgb_to_hsv(*(channel / 255 for channel in rgb))
+    hue = h * 360
+    if v < 0.2:
+        return 'black'
+    if s < 0.15 or (s < 0.25 and v < 0.4):
+        return 'white' if v > 0.85 else 'gray'
+    if 15 <= hue < 45 and v < 0.6:
+        return 'brown'
+    if hue < 15 or hue >= 345:
+        return 'red'
+    if hue < 40:
+        return 'orange'
+    if hue < 70:
+        return 'yellow'
+    if hue < 165:
+        return 'green'
+    if hue < 195:
+        return 'cyan'
+    if hue < 260:
+        return 'blue'
+    if hue < 290:
+        return 'purple'
+    return 'pink'
+
+
+def palette_mask(colors, min_share=MIN_MASK_SHARE):
+    """根据主色计算调色板位掩码"""
+    mask = 0
+    for rgb, share in colors:
+        if share >= min_share:
+            mask |= PALETTE_BITS[classify_color(rgb)]
+    return mask
+
+
+def mask_to_names(mask):
+    """位掩码转换为调色板颜色名列表"""
+    if not mask:
+        return []
+    return [name for name, bit in PALETTE_BITS.items() if mask & bit]
+
+
+def parse_color_filter(value):
+    """
+    解析 color 查询参数（逗号分隔的调色板颜色名，忽略未知颜色）
+    返回: 位掩码，没有有效颜色时返回 0
+    """
+    mask = 0
+    for name in value.split(','):
+        mask |= PALETTE_BITS.get(name.strip().lower(), 0)
+    return mask
+
+
+@lru_cache(maxsize=256)
+def superset_masks(mask):
+    """
+    包含 mask 中全部颜色的掩码（按颜色筛选时用于 IN 条件）
+    每张图片最多 CLUSTER_COUNT 个主色，位数更多的掩码不会出现，不列出
+    """
+    rest = PALETTE_ALL & ~mask
+    masks = []
+    extra = rest
+    while True:
+        value = mask | extra
+        if value.bit_count() <= CLUSTER_COUNT:
+            masks.append(value)
+        if not extra:
+            break
+        extra = (extra - 1) & rest
+    return tuple(sorted(masks))
+
+
+def to_hex(rgb):
+    return '#{:02x}{:02x}{:02x}'.format(*rgb)
@@ -0,0 +1,498 @@
+"""
+非破坏性图片编辑
+编辑操作以步骤列表的形式保存在图片记录上（edit_stack），edit_index 表示当前生效的步骤数，
+原图文件始终保持不变。编辑后的图片（渲染结果）按需从原图生成，并按
+（生效步骤的哈希, 渲染规格）缓存在 renditions/ab/cd/<图片ID>/ 目录下，撤销/重做只需移动 edit_index。
+
+单个编辑步骤:
+{
+    'crop': {'left': int, 'top': int, 'right': int, 'bottom': int},  # 相对于上一步结果的坐标
+    'rotate': int,        # 顺时针旋转角度：90、180、270
+    'brightness': float,  # 0.0-2.0，1.0 为不变
+    'contrast': float,    # 0.0-2.0
+    'saturation': float,  # 0.0-2.0
+}
+同一步骤内按 裁剪 -> 旋转 -> 亮度 -> 对比度 -> 饱和度 的顺序执行。
+"""
+import hashlib
+import json
+import os
+import posixpath
+import shutil
+import subprocess
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image as PILImage
+from PIL import ImageEnhance
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+
+from .imaging import bounded_draft, display_size, flatten, measure, open_image, resize, transpose
+from .storage import delete_file, local_path, shard_dir
+from .utils import (
+    THUMBNAIL_FIELDS, get_thumbnail_spec, render_thumbnail, create_thumbnail, save_thumbnail
+)
+
+
+# 色调调整与 PIL ImageEnhance 的对应关系（apply_adjustments 实现相同的计算）
+ADJUSTMENTS = {
+    'brightness': ImageEnhance.Brightness,
+    'contrast': ImageEnhance.Contrast,
+    'saturation': ImageEnhance.Color,
+}
+ADJUSTMENT_RANGE = (0.0, 2.0)
+# 色调调整按水平条带处理，每条带的像素数
+STRIP_PIXELS = 1 << 20
+# 灰度权重（与 PIL 的 L 模式转换一致）
+LUMA = (0.299, 0.587, 0.114)
+ROTATIONS = {
+    90: PILImage.Transpose.ROTATE_270,
+    180: PILImage.Transpose.ROTATE_180,
+    270: PILImage.Transpose.ROTATE_90,
+}
+
+# 渲染规格 -> 最长边像素（None 表示原尺寸）
+RENDITIONS = {
+    'full': None,
+    'large': 2048,
+}
+RENDITION_QUALITY = 92
+RENDITION_ROOT = 'renditions'
+
+# 只包含这些操作的编辑步骤可以在 JPEG 的 DCT 系数上无损完成（jpegtran）
+LOSSLESS_OPERATIONS = {'crop', 'rotate'}
+LOSSLESS_TIMEOUT = 30
+
+# 编辑预览代理图的最长边像素
+PROXY_SIZE = 1024
+PREVIEW_FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+}
+PREVIEW_QUALITY = 80
+
+# 撤销/重做时需要写回的字段
+EDIT_FIELDS = ['edit_stack', 'edit_index', 'edit_hash', 'width', 'height']
+# 批量编辑时需要写回的字段（编辑状态 + 缩略图）
+BATCH_EDIT_FIELDS = EDIT_FIELDS + THUMBNAIL_FIELDS
+
+
+def normalize_operations(operations, size, allow_noop=False):
+    """
+    校验并规范化单个编辑步骤
+    size: 上一步结果的 (宽, 高)，用于检查裁剪范围
+    allow_noop: 是否允许不改变图片的操作（滑块回到初始值后预览或保存）
+    校验失败时抛出 ValueError
+    """
+    if allow_noop and not operations:
+        return {}
+    if not isinstance(operations, dict) or not operations:
+        raise ValueError('请提供编辑操作')
+    unknown = set(operations) - {'crop', 'rotate'} - set(ADJUSTMENTS)
+    if unknown:
+        raise ValueError(f'不支持的编辑操作: {", ".join(sorted(unknown))}')
+
+    result = {}
+    if 'crop' in operations:
+        try:
+            crop = {key: int(round(float(operations['crop'][key]))) for key in ('left', 'top', 'right', 'bottom')}
+        except (KeyError, TypeError, ValueError):
+            raise ValueError('裁剪参数无效')
+        width, height = size
+        if not (0 <= crop['left'] < crop['right'] <= width and 0 <= crop['top'] < crop['bottom'] <= height):
+            raise ValueError('裁剪区域超出图片范围')
+        result['crop'] = crop
+
+    if 'rotate' in operations:
+        try:
+            rotate = int(operations['rotate']) % 360
+        except (TypeError, ValueError):
+            raise ValueError('旋转角度无效')
+        if rotate and rotate not in ROTATIONS:
+            raise ValueError('旋转角度只能是90的倍数')
+        if rotate:
+            result['rotate'] = rotate
+
+    for name in ADJUSTMENTS:
+        if name not in operations:
+            continue
+        try:
+            value = float(operations[name])
+        except (TypeError, ValueError):
+            raise ValueError(f'{name} 参数无效')
+        if not ADJUSTMENT_RANGE[0] <= value <= ADJUSTMENT_RANGE[1]:
+            raise ValueError(f'{name} 超出范围 {ADJUSTMENT_RANGE[0]}-{ADJUSTMENT_RANGE[1]}')
+        if value != 1.0:
+            result[name] = value
+
+    if not result and not allow_noop:
+        raise ValueError('编辑操作不会改变图片')
+    return result
+
+
+def applied_edits(image):
+    """当前生效的编辑步骤"""
+    return (image.edit_stack or [])[:image.edit_index]
+
+
+def stack_hash(stack):
+    """编辑步骤的哈希值，没有编辑时返回 None"""
+    if not stack:
+        return None
+    return hashlib.sha1(json.dumps(stack, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def original_size(path):
+    """原图按EXIF方向旋转后的尺寸（只读取文件头）"""
+    with open_image(path) as img:
+        return display_size(img)
+
+
+def edited_size(size, stack):
+    """根据编辑步骤计算结果尺寸（不解码图片）"""
+    width, height = size
+    for operations in stack:
+        if 'crop' in operations:
+            crop = operations['crop']
+            width, height = crop['right'] - crop['left'], crop['bottom'] - crop['top']
+        if operations.get('rotate') in (90, 270):
+            width, height = height, width
+    return width, height
+
+
+def apply_operations(img, operations, scale=1.0):
+    """
+    执行单个编辑步骤
+    scale: 图片相对于原尺寸的缩放比例（在缩小的代理图上渲染时裁剪坐标需要同比缩放）
+    """
+    if 'crop' in operations:
+        crop = operations['crop']
+        box = [int(round(crop[key] * scale)) for key in ('left', 'top', 'right', 'bottom')]
+        box[2] = min(max(box[2], box[0] + 1), img.width)
+        box[3] = min(max(box[3], box[1] + 1), img.height)
+        img = img.crop(box)
+
+    if operations.get('rotate'):
+        img = img.transpose(ROTATIONS[operations['rotate']])
+
+    if any(name in operations for name in ADJUSTMENTS):
+        img = apply_adjustments(
+            img,
+            operations.get('brightness', 1.0),
+            operations.get('contrast', 1.0),
+            operations.get('saturation', 1.0),
+        )
+    return img
+
+
+def _strips(img):
+    """按水平条带切分图片，返回每个条带的区域"""
+    rows = max(1, STRIP_PIXELS // img.width)
+    for top in range(0, img.height, rows):
+        yield (0, top, img.width, min(img.height, top + rows))
+
+
+def _tone_table(img, brightness, contrast):
+    """
+    亮度与对比度合并为一张查找表（按 PIL 的逐步计算，每一步截断为 0-255 的整数）
+    对比度以亮度调整后的平均灰度为中心，按条带统计灰度直方图，不需要额外的整图缓冲
+    """
+    # 与 PIL 的 blend 一样使用单精度计算，避免取整边界上的差异
+    values = np.clip(np.floor(np.arange(256, dtype=np.float32) * np.float32(brightness)), 0, 255)
+    if contrast != 1.0:
+        table = values.astype(np.uint8).tolist() * len(img.getbands())
+        histogram = np.zeros(256)
+        for box in _strips(img):
+            piece = img.crop(box)
+            if brightness != 1.0:
+                piece = piece.point(table)
+            histogram += piece.convert('L').histogram()
+        mean = np.float32(np.floor(histogram @ np.arange(256) / max(1, histogram.sum()) + 0.5))
+        values = np.clip(np.floor(mean + np.float32(contrast) * (values - mean)), 0, 255)
+    return values.astype(np.uint8).tolist() * len(img.getbands())
+
+
+def _saturation_matrix(saturation):
+    """饱和度：与灰度按比例混合，即 RGB 的线性变换"""
+    matrix = []
+    for channel in range(3):
+        row = [(1 - saturation) * weight for weight in LUMA]
+        row[channel] += saturation
+        matrix.extend(row + [0])
+    return tuple(matrix)
+
+
+def apply_adjustments(img, brightness=1.0, contrast=1.0, saturation=1.0):
+    """
+    一次完成亮度、对比度、饱和度调整，结果与依次执行 ImageEnhance 的
+    Brightness -> Contrast -> Color 一致（误差在 ±1 以内）
+    亮度和对比度合并为一张查找表，饱和度转换为颜色矩阵，按条带处理，
+    峰值内存只比输入和输出图片多一个条带
+    """
+    table = None
+    if brightness != 1.0 or contrast != 1.0:
+        table = _tone_table(img, brightness, contrast)
+    if saturation == 1.0 or img.mode != 'RGB':
+        return img.point(table) if table else img.copy()
+
+    matrix = _saturation_matrix(saturation)
+    output = PILImage.new(img.mode, img.size)
+    for box in _strips(img):
+        piece = img.crop(box)
+        if table:
+            piece = piece.point(table)
+        output.paste(piece.convert('RGB', matrix), box[:2])
+    return output
+
+
+def render_edits(path, stack, scale=1.0):
+    """
+    从原图渲染编辑结果
+    scale < 1 时先利用 JPEG 的 DCT 缩放解码（draft）得到缩小的代理图，再在代理图上执行编辑；
+    原尺寸解码超出内存预算时同样缩小，编辑按实际解码的比例执行
+    """
+    with measure('render_edits'):
+        img = open_image(path)
+        original_width = img.width
+        size = (max(1, round(img.width * scale)), max(1, round(img.height * scale)))
+        bounded_draft(img, size)
+        if img.width > size[0]:
+            img = resize(img, size)
+        scale = img.width / original_width
+        img = flatten(transpose(img))
+        for operations in stack:
+            img = apply_operations(img, operations, scale)
+        return img
+
+
+def _jpegtran(data, args):
+    """调用 jpegtran 处理 JPEG 数据，失败时返回 None（保留 EXIF、ICC 等全部标记段，方向已确认无需旋转）"""
+    try:
+        result = subprocess.run(
+            [shutil.which('jpegtran'), '-copy', 'all', '-optimize', *args],
+            input=data, capture_output=True, timeout=LOSSLESS_TIMEOUT
+        )
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    return result.stdout if result.returncode == 0 and result.stdout else None
+
+
+def lossless_render(path, stack):
+    """
+    无损渲染只包含裁剪/旋转的编辑：直接变换 JPEG 的 DCT 块，不解码、不重新编码
+    要求原图为无 EXIF 旋转的 JPEG，裁剪的左上角对齐 MCU 块，旋转时图片尺寸是 MCU 的整数倍
+    条件不满足（或未安装 jpegtran）时返回 None，由调用方回退到解码渲染
+    """
+    if not stack or not shutil.which('jpegtran'):
+        return None
+    if any(set(operations) - LOSSLESS_OPERATIONS for operations in stack):
+        return None
+
+    with open_image(path) as img:
+        if img.format != 'JPEG' or img.getexif().get(0x0112, 1) != 1:
+            return None
+        # MCU 尺寸由最大的采样因子决定（4:2:0 为 16x16，4:4:4 为 8x8）
+        layers = getattr(img, 'layer', None) or [(None, 1, 1, None)]
+        mcu = (8 * max(layer[1] for layer in layers), 8 * max(layer[2] for layer in layers))
+        width, height = img.size
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    for operations in stack:
+        if 'crop' in operations:
+            crop = operations['crop']
+            if crop['left'] % mcu[0] or crop['top'] % mcu[1]:
+                return None
+            width, height = crop['right'] - crop['left'], crop['bottom'] - crop['top']
+            data = _jpegtran(data, ['-crop', f"{width}x{height}+{crop['left']}+{crop['top']}"])
+            if data is None:
+                return None
+
+        if operations.get('rotate'):
+            # -perfect: 边缘存在不完整的 MCU 块时失败，而不是丢弃边缘像素
+            data = _jpegtran(data, ['-perfect', '-rotate', str(operations['rotate'])])
+            if data is None:
+                return None
+            if operations['rotate'] in (90, 270):
+                width, height = height, width
+                mcu = (mcu[1], mcu[0])
+
+    # 校验结果尺寸，防止不同版本 jpegtran 的行为差异
+    with PILImage.open(BytesIO(data)) as result:
+        if result.size != (width, height):
+            return None
+    return data
+
+
+def rendition_dir(image_id):
+    """图片渲染缓存的目录（按图片ID分散到子目录：renditions/ab/cd/<图片ID>/）"""
+    return posixpath.join(RENDITION_ROOT, shard_dir(str(image_id)), str(image_id))
+
+
+def rendition_name(image, rendition):
+    return posixpath.join(rendition_dir(image.id), f'{image.edit_hash}_{rendition}.jpg')
+
+
+def get_rendition(image, rendition='full'):
+    """
+    获取当前编辑结果的渲染文件（缓存未命中时从原图渲染并保存）
+    原尺寸渲染优先尝试无损变换，包含色调调整或裁剪未对齐时才解码并重新编码
+    返回: 存储中的文件名
+    """
+    name = rendition_name(image, rendition)
+    if default_storage.exists(name):
+        return name
+
+    stack = applied_edits(image)
+    max_side = RENDITIONS[rendition]
+    path = local_path(image.file_path.name)
+    if not max_side:
+        data = lossless_render(path, stack)
+        if data:
+            return default_storage.save(name, ContentFile(data))
+
+    scale = 1.0
+    if max_side:
+        width, height = edited_size(original_size(path), stack)
+        scale = min(1.0, max_side / max(width, height))
+
+    img = render_edits(path, stack, scale)
+    output = BytesIO()
+    img.save(output, format='JPEG', quality=RENDITION_QUALITY)
+    return default_storage.save(name, ContentFile(output.getvalue()))
+
+
+def build_thumbnail(image):
+    """根据原图和当前生效的编辑步骤生成缩略图"""
+    stack = applied_edits(image)
+    try:
+        path = local_path(image.file_path.name)
+    except FileNotFoundError:
+        print(f"生成缩略图失败: 原图不存在 {image.file_path.name}")
+        return None
+    if not stack:
+        return create_thumbnail(path)
+
+    try:
+        spec = get_thumbnail_spec()
+        target_width, target_height = spec['size']
+        width, height = edited_size(original_size(path), stack)
+        # 代理图保留缩略图两倍的分辨率，避免裁剪后的区域不足
+        scale = min(1.0, 2 * max(target_width / width, target_height / height))
+        return render_thumbnail(render_edits(path, stack, scale), spec)
+
+    except Exception as e:
+        print(f"生成缩略图失败: {str(e)}")
+        return None
+
+
+def set_edit_state(image, stack, index):
+    """设置编辑步骤与当前位置，并更新编辑结果尺寸（不保存）"""
+    image.edit_stack = stack
+    image.edit_index = index
+    image.edit_hash = stack_hash(stack[:index])
+    image.width, image.height = edited_size(original_size(local_path(image.file_path.name)), stack[:index])
+
+
+def batch_edit_image(job):
+    """
+    在工作进程中为单张图片追加编辑步骤并重新生成缩略图（不访问数据库）
+    job: (图片, 编辑步骤)
+    返回: (图片ID, 状态, 数据)，状态为 'edited' 时数据为 (更新后的图片, 被替换的旧缩略图)，
+          为 'error' 时数据为错误信息
+    """
+    image, operations = job
+    try:
+        stack = applied_edits(image)
+        current_size = edited_size(original_size(local_path(image.file_path.name)), stack)
+        stack = stack + [normalize_operations(operations, current_size)]
+        set_edit_state(image, stack, len(stack))
+
+        old_thumbnail = image.thumbnail_path.name
+        thumbnail = build_thumbnail(image)
+        if not thumbnail:
+            return image.id, 'error', '生成缩略图失败'
+        save_thumbnail(image, f"thumb_{os.path.basename(image.file_path.name)}", thumbnail)
+        stale = old_thumbnail if old_thumbnail and old_thumbnail != image.thumbnail_path.name else None
+        return image.id, 'edited', (image, stale)
+
+    except ValueError as e:
+        return image.id, 'error', str(e)
+    except Exception as e:
+        print(f"批量编辑图片失败: {str(e)}")
+        return image.id, 'error', '编辑图片失败'
+
+
+def delete_renditions(image):
+    """删除图片的全部渲染缓存"""
+    directory = rendition_dir(image.id)
+    try:
+        _, files = default_storage.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in files:
+        delete_file(posixpath.join(directory, name))
+
+
+class ProxyCache:
+    """进程内 LRU 缓存：已解码的预览代理图"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+proxy_cache = ProxyCache(getattr(settings, 'EDIT_PREVIEW_CACHE_SIZE', 16))
+
+
+def get_proxy(image):
+    """
+    获取当前编辑状态的预览代理图（编辑结果的最长边约 PROXY_SIZE）
+    按 (图片ID, 原图文件名, 原图修改时间, 编辑哈希) 缓存，原图被原地替换时重新生成
+    返回: (代理图, 相对原图的缩放比例)
+    """
+    name = image.file_path.name
+    key = (image.id, name, default_storage.get_modified_time(name).timestamp(), image.edit_hash)
+    entry = proxy_cache.get(key)
+    if entry is None:
+        path = local_path(name)
+        stack = applied_edits(image)
+        # 按编辑结果（裁剪后）的尺寸计算缩放比例，裁剪较多时预览不会过小
+        scale = min(1.0, PROXY_SIZE / max(edited_size(original_size(path), stack)))
+        proxy = render_edits(path, stack, scale)
+        proxy.load()
+        entry = (proxy, scale)
+        proxy_cache.put(key, entry)
+    return entry
+
+
+def render_preview(image, operations, format='jpeg'):
+    """
+    在代理图上执行编辑步骤（不修改图片记录）
+    返回: (编码后的图片数据, Content-Type)
+    """
+    proxy, scale = get_proxy(image)
+    img = apply_operations(proxy, operations, scale) if operations else proxy
+    pil_format, content_type = PREVIEW_FORMATS[format]
+    output = BytesIO()
+    img.save(output, format=pil_format, quality=PREVIEW_QUALITY)
+    return output.getvalue(), content_type
@@ -0,0 +1,218 @@
+"""
+地理位置工具
+Geohash 编码/解码、边界框覆盖以及距离计算
+"""
+import math
+
+
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+EARTH_RADIUS_KM = 6371.0088
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """将经纬度编码为 geohash 字符串"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # geohash 从经度位开始交替
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def geohash_bounds(geohash):
+    """
+    解码 geohash 对应的格子范围
+    返回: (min_lat, min_lon, max_lat, max_lon)
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def cell_size(precision):
+    """指定精度下单个 geohash 格子的 (纬度跨度, 经度跨度)"""
+    total_bits = precision * 5
+    lon_bits = (total_bits + 1) // 2
+    lat_bits = total_bits // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def _cells_in_range(min_lat, min_lon, max_lat, max_lon, precision):
+    lat_step, lon_step = cell_size(precision)
+    lat_start = math.floor((min_lat + 90.0) / lat_step)
+    lat_end = min(math.floor((max_lat + 90.0) / lat_step), int(180.0 / lat_step) - 1)
+    lon_start = math.floor((min_lon + 180.0) / lon_step)
+    lon_end = min(math.floor((max_lon + 180.0) / lon_step), int(360.0 / lon_step) - 1)
+    return lat_start, lat_end, lon_start, lon_end
+
+
+def split_bbox(min_lat, min_lon, max_lat, max_lon):
+    """跨越180度经线的边界框拆分为两个"""
+    if min_lon <= max_lon:
+        return [(min_lat, min_lon, max_lat, max_lon)]
+    return [(min_lat, min_lon, max_lat, 180.0), (min_lat, -180.0, max_lat, max_lon)]
+
+
+def cell_intersects_bbox(geohash, min_lat, min_lon, max_lat, max_lon):
+    """geohash 格子与边界框是否相交（跨越180度经线的边界框会被拆分）"""
+    cell_min_lat, cell_min_lon, cell_max_lat, cell_max_lon = geohash_bounds(geohash)
+    return any(
+        cell_min_lat <= box_max_lat and box_min_lat <= cell_max_lat
+        and cell_min_lon <= box_max_lon and box_min_lon <= cell_max_lon
+        for box_min_lat, box_min_lon, box_max_lat, box_max_lon in split_bbox(min_lat, min_lon, max_lat, max_lon)
+    )
+
+
+def geohash_cover(min_lat, min_lon, max_lat, max_lon, max_cells=16):
+    """
+    计算覆盖边界框的 geohash 前缀集合
+    选择格子数不超过 max_cells 的最高精度；范围过大无法覆盖时返回空列表（表示不做前缀过滤）
+    """
+    boxes = split_bbox(min_lat, min_lon, max_lat, max_lon)
+    best = []
+    for precision in range(1, GEOHASH_PRECISION + 1):
+        total = 0
+        for box in boxes:
+            lat_start, lat_end, lon_start, lon_end = _cells_in_range(*box, precision)
+            total += (lat_end - lat_start + 1) * (lon_end - lon_start + 1)
+        if total > max_cells:
+            break
+
+        cells = []
+        lat_step, lon_step = cell_size(precision)
+        for box in boxes:
+            lat_start, lat_end, lon_start, lon_end = _cells_in_range(*box, precision)
+            for lat_index in range(lat_start, lat_end + 1):
+                for lon_index in range(lon_start, lon_end + 1):
+                    center_lat = -90.0 + (lat_index + 0.5) * lat_step
+                    center_lon = -180.0 + (lon_index + 0.5) * lon_step
+                    cells.append(geohash_encode(center_lat, center_lon, precision))
+        best = sorted(set(cells))
+    return best
+
+
+# 地图缩放级别 -> 聚合使用的 geohash 精度
+ZOOM_PRECISION = [
+    (2, 1), (4, 2), (6, 3), (9, 4), (11, 5), (14, 6), (16, 7),
+]
+MAX_CLUSTER_PRECISION = 8
+# 支持的地图缩放级别范围
+MIN_ZOOM = 0
+MAX_ZOOM = 20
+
+
+def zoom_to_precision(zoom):
+    """根据地图缩放级别选择聚合格子的 geohash 精度"""
+    for max_zoom, precision in ZOOM_PRECISION:
+        if zoom <= max_zoom:
+            return precision
+    return MAX_CLUSTER_PRECISION
+
+
+def radius_bbox(lat, lon, radius_km):
+    """
+    计算圆形范围的外接边界框
+    返回: (min_lat, min_lon, max_lat, max_lon)
+    """
+    lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+    min_lat = max(lat - lat_delta, -90.0)
+    max_lat = min(lat + lat_delta, 90.0)
+    # 接近极点时经度范围覆盖全部
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, -180.0, max_lat, 180.0
+    lon_delta = math.degrees(radius_km / (EARTH_RADIUS_KM * math.cos(math.radians(lat))))
+    if lon_delta >= 180.0:
+        return min_lat, -180.0, max_lat, 180.0
+    min_lon = lon - lon_delta
+    max_lon = lon + lon_delta
+    if min_lon < -180.0:
+        min_lon += 360.0
+    if max_lon > 180.0:
+        max_lon -= 360.0
+    return min_lat, min_lon, max_lat, max_lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """两点间球面距离（公里）"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def parse_location(location):
+    """
+    解析旧版 location 字符串 "lat, lon"
+    返回: (lat, lon)，无法解析时返回 None
+    """
+    if not location:
+        return None
+    parts = location.split(',')
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+    return lat, lon
+
+
+def parse_bbox(value):
+    """
+    解析 bbox 参数 "min_lon,min_lat,max_lon,max_lat"（min_lon 大于 max_lon 表示跨越180度经线）
+    返回: (min_lat, min_lon, max_lat, max_lon)，格式或范围无效时抛出 ValueError
+    """
+    parts = value.split(',')
+    if len(parts) != 4:
+        raise ValueError('bbox 格式应为 min_lon,min_lat,max_lon,max_lat')
+    try:
+        min_lon, min_lat, max_lon, max_lat = [float(part) for part in parts]
+    except ValueError:
+        raise ValueError('bbox 坐标无效')
+    if not all(math.isfinite(v) for v in (min_lon, min_lat, max_lon, max_lat)):
+        raise ValueError('bbox 坐标无效')
+    if not (-90.0 <= min_lat <= max_lat <= 90.0 and -180.0 <= min_lon <= 180.0 and -180.0 <= max_lon <= 180.0):
+        raise ValueError('bbox 坐标超出范围')
+    return min_lat, min_lon, max_lat, max_lon
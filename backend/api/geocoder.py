@@ -0,0 +1,267 @@
+"""
+离线逆地理编码
+基于随项目分发的国家边界数据（api/data/countries.json.gz，Natural Earth 1:110m，
+补充了该精度下缺失的城市国家和微型国家）做点面判断，
+可通过 REVERSE_GEOCODER_ADMIN_DATA 配置同格式的省/州级边界数据。
+边界数据在首次调用时加载，每个进程只加载一次。
+"""
+import gzip
+import json
+import math
+import os
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+
+
+COUNTRY_DATA = os.path.join(os.path.dirname(__file__), 'data', 'countries.json.gz')
+
+_MISSING = object()
+_SNAP = object()
+
+
+class BoundaryIndex:
+    """
+    边界多边形集合及其网格空间索引
+    网格按 cell_degrees 划分经纬度；没有任何边穿过的格子内结果处处相同，
+    第一次查询后缓存该格子的结果，之后同格子内的查询直接命中缓存。
+    snap_degrees 大于0时，落在所有多边形之外但距边界不超过该距离的点
+    （低精度海岸线附近的沿海城市）归入最近的多边形；只吸附到海岸线，
+    两个要素共用的陆地边界不参与吸附，避免把边界附近的点归入邻国
+    """
+
+    def __init__(self, features, cell_degrees=1.0, snap_degrees=0.0):
+        self.cell_degrees = cell_degrees
+        self.snap_degrees = snap_degrees
+        self.features = []
+        # 每个多边形: (要素下标, (min_lon, min_lat, max_lon, max_lat), [环, ...], 外环中陆地边界的边下标)
+        self.polygons = []
+        # 格子 -> 与格子相交的多边形下标
+        self.grid = defaultdict(list)
+        # 有边界线穿过的格子
+        self.boundary_cells = set()
+        # 无边界线穿过的格子 -> 查询结果
+        self.cell_cache = {}
+
+        edge_features = self._edge_features(features)
+        for feature in features:
+            feature_index = len(self.features)
+            self.features.append({k: v for k, v in feature.items() if k != 'polygons'})
+            for rings in feature['polygons']:
+                rings = [
+                    ([point[0] for point in ring], [point[1] for point in ring])
+                    for ring in rings if len(ring) >= 3
+                ]
+                if not rings:
+                    continue
+                xs, ys = rings[0]
+                bbox = (min(xs), min(ys), max(xs), max(ys))
+                land_edges = {
+                    i for i in range(len(xs))
+                    if len(edge_features[self._edge(xs, ys, i)]) > 1
+                }
+                polygon_index = len(self.polygons)
+                self.polygons.append((feature_index, bbox, rings, land_edges))
+                for cell in self._cells_in_bbox(*bbox):
+                    self.grid[cell].append(polygon_index)
+                for xs, ys in rings:
+                    for i in range(len(xs)):
+                        j = i - 1
+                        self.boundary_cells.update(self._cells_in_bbox(
+                            min(xs[i], xs[j]), min(ys[i], ys[j]),
+                            max(xs[i], xs[j]), max(ys[i], ys[j])
+                        ))
+
+    @staticmethod
+    def _edge(xs, ys, i):
+        """环中第 i 条边（与前一个点相连），与方向无关"""
+        return frozenset(((xs[i - 1], ys[i - 1]), (xs[i], ys[i])))
+
+    @classmethod
+    def _edge_features(cls, features):
+        """每条边所属的要素下标集合（属于多个要素的边是陆地边界）"""
+        edge_features = defaultdict(set)
+        for feature_index, feature in enumerate(features):
+            for rings in feature['polygons']:
+                if len(rings[0]) < 3:
+                    continue
+                xs, ys = [point[0] for point in rings[0]], [point[1] for point in rings[0]]
+                for i in range(len(xs)):
+                    edge_features[cls._edge(xs, ys, i)].add(feature_index)
+        return edge_features
+
+    def _cell(self, lat, lon):
+        return (
+            math.floor(min(max(lat, -90.0), 89.999999) / self.cell_degrees),
+            math.floor(min(max(lon, -180.0), 179.999999) / self.cell_degrees),
+        )
+
+    def _cells_in_bbox(self, min_lon, min_lat, max_lon, max_lat):
+        lat_start, lon_start = self._cell(min_lat, min_lon)
+        lat_end, lon_end = self._cell(max_lat, max_lon)
+        for lat_index in range(lat_start, lat_end + 1):
+            for lon_index in range(lon_start, lon_end + 1):
+                yield lat_index, lon_index
+
+    @staticmethod
+    def _in_ring(lon, lat, xs, ys):
+        """射线法判断点是否在环内"""
+        inside = False
+        j = len(xs) - 1
+        for i in range(len(xs)):
+            yi, yj = ys[i], ys[j]
+            if (yi > lat) != (yj > lat):
+                x_cross = xs[i] + (lat - yi) * (xs[j] - xs[i]) / (yj - yi)
+                if lon < x_cross:
+                    inside = not inside
+            j = i
+        return inside
+
+    def _locate(self, lat, lon, cell):
+        for polygon_index in self.grid.get(cell, ()):
+            feature_index, (min_lon, min_lat, max_lon, max_lat), rings, _ = self.polygons[polygon_index]
+            if not (min_lon <= lon <= max_lon and min_lat <= lat <= max_lat):
+                continue
+            outer_xs, outer_ys = rings[0]
+            if not self._in_ring(lon, lat, outer_xs, outer_ys):
+                continue
+            if any(self._in_ring(lon, lat, xs, ys) for xs, ys in rings[1:]):
+                continue
+            return self.features[feature_index]
+        return None
+
+    def lookup(self, lat, lon):
+        """返回包含该点的要素属性，不在任何多边形内时返回 None"""
+        cell = self._cell(lat, lon)
+        if cell in self.boundary_cells:
+            return self._locate_or_snap(lat, lon, cell)
+
+        result = self.cell_cache.get(cell, _MISSING)
+        if result is _MISSING:
+            result = self._locate(lat, lon, cell)
+            # 靠近边界的“无结果”格子需要逐点吸附，不能整体缓存为 None
+            if result is None and self._near_boundary(cell):
+                result = _SNAP
+            self.cell_cache[cell] = result
+        if result is _SNAP:
+            return self._nearest(lat, lon)
+        return result
+
+    def _near_boundary(self, cell):
+        """格子周围 snap_degrees 范围内是否有边界线"""
+        if not self.snap_degrees:
+            return False
+        lat_index, lon_index = cell
+        # 经度方向的范围按格子内最高纬度换算
+        max_lat = min(max(abs(lat_index), abs(lat_index + 1)) * self.cell_degrees + self.snap_degrees, 89.0)
+        lat_margin = math.ceil(self.snap_degrees / self.cell_degrees)
+        lon_margin = math.ceil(self.snap_degrees / math.cos(math.radians(max_lat)) / self.cell_degrees)
+        for d_lat in range(-lat_margin, lat_margin + 1):
+            for d_lon in range(-lon_margin, lon_margin + 1):
+                if (lat_index + d_lat, lon_index + d_lon) in self.boundary_cells:
+                    return True
+        return False
+
+    def _locate_or_snap(self, lat, lon, cell):
+        result = self._locate(lat, lon, cell)
+        if result is None and self.snap_degrees:
+            result = self._nearest(lat, lon)
+        return result
+
+    def _nearest(self, lat, lon):
+        """在 snap_degrees 范围内寻找距离最近的多边形"""
+        scale = max(math.cos(math.radians(lat)), 0.01)
+        best, best_distance = None, self.snap_degrees ** 2
+        candidates = set()
+        for cell in self._cells_in_bbox(
+            lon - self.snap_degrees / scale, lat - self.snap_degrees,
+            lon + self.snap_degrees / scale, lat + self.snap_degrees
+        ):
+            candidates.update(self.grid.get(cell, ()))
+        for polygon_index in candidates:
+            feature_index, _, rings, land_edges = self.polygons[polygon_index]
+            xs, ys = rings[0]
+            for i in range(len(xs)):
+                if i in land_edges:
+                    continue
+                j = i - 1
+                # 经度按纬度缩放后计算点到线段的平面距离
+                ax, ay = (xs[j] - lon) * scale, ys[j] - lat
+                bx, by = (xs[i] - lon) * scale, ys[i] - lat
+                dx, dy = bx - ax, by - ay
+                length = dx * dx + dy * dy
+                t = 0.0 if length == 0 else max(0.0, min(1.0, -(ax * dx + ay * dy) / length))
+                px, py = ax + t * dx, ay + t * dy
+                distance = px * px + py * py
+                if distance < best_distance:
+                    best, best_distance = self.features[feature_index], distance
+        return best
+
+
+def load_boundaries(path):
+    """读取边界数据文件（json 或 json.gz）"""
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)['features']
+
+
+class ReverseGeocoder:
+    """国家（及可选的省/州）逆地理编码器"""
+
+    def __init__(self, country_path=COUNTRY_DATA, admin_path=None):
+        # 1:110m 海岸线较粗，沿海城市可能落在多边形外，允许约30公里的吸附
+        self.countries = BoundaryIndex(load_boundaries(country_path), snap_degrees=0.3)
+        self.admins = BoundaryIndex(load_boundaries(admin_path), cell_degrees=0.25) if admin_path else None
+
+    def lookup(self, lat, lon):
+        """
+        返回: {
+            'country_code': str,  # ISO 3166-1 alpha-3
+            'country': str,       # 中文名
+            'country_en': str,
+            'admin': str or None  # 省/州（需要配置省级边界数据）
+        }
+        不在任何国家边界内（如海上）时返回 None
+        """
+        country = self.countries.lookup(lat, lon)
+        if country is None:
+            return None
+        admin = self.admins.lookup(lat, lon) if self.admins else None
+        return {
+            'country_code': country['code'],
+            'country': country['name_zh'],
+            'country_en': country['name'],
+            'admin': (admin.get('name_zh') or admin.get('name')) if admin else None,
+        }
+
+
+_geocoder = None
+_geocoder_lock = threading.Lock()
+
+
+def get_geocoder():
+    """获取进程内共享的逆地理编码器（首次调用时加载边界数据）"""
+    global _geocoder
+    if _geocoder is None:
+        with _geocoder_lock:
+            if _geocoder is None:
+                _geocoder = ReverseGeocoder(
+                    admin_path=getattr(settings, 'REVERSE_GEOCODER_ADMIN_DATA', None)
+                )
+    return _geocoder
+
+
+def reverse_geocode(lat, lon):
+    """单点逆地理编码"""
+    return get_geocoder().lookup(lat, lon)
+
+
+def reverse_geocode_batch(points):
+    """
+    批量逆地理编码
+    points: [(lat, lon), ...]
+    返回与输入顺序一致的结果列表；同一网格内的点共享缓存结果
+    """
+    geocoder = get_geocoder()
+    return [geocoder.lookup(lat, lon) for lat, lon in points]
@@ -0,0 +1,219 @@
+"""
+内存受限的图片解码
+解码原图的地方都通过这里打开图片：打开时先根据文件头的尺寸检查像素上限（IMAGE_MAX_PIXELS），
+解码前按内存预算（IMAGE_DECODE_BUDGET）选择缩放解码（JPEG 的 DCT 缩放），
+大图的缩放、透明背景填充按条带进行，避免整图大小的中间缓冲。
+各阶段的耗时与内存可以通过 api.imaging 日志查看，便于估算工作进程所需内存。
+"""
+import logging
+import math
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+from PIL import Image as PILImage
+from PIL import ImageOps
+from django.conf import settings
+
+try:
+    import resource
+except ImportError:  # Windows 开发环境不统计峰值内存
+    resource = None
+
+
+logger = logging.getLogger(__name__)
+
+# 各模式每像素字节数（未列出的按4字节估算）
+MODE_BYTES = {'1': 1, 'L': 1, 'P': 1, 'LA': 2, 'I;16': 2, 'RGB': 3, 'YCbCr': 3, 'LAB': 3, 'HSV': 3}
+# JPEG 支持的缩放解码比例
+JPEG_SCALES = (1, 2, 4, 8)
+# 条带处理时每个条带的像素数
+STRIP_PIXELS = 1 << 20
+ORIENTATION_TAG = 0x0112
+
+
+class ImageTooLarge(ValueError):
+    """图片像素数或解码所需内存超出限制"""
+
+
+def decoded_bytes(size, mode):
+    """按尺寸和模式估算解码后的内存占用"""
+    return size[0] * size[1] * MODE_BYTES.get(mode, 4)
+
+
+def open_image(source):
+    """
+    打开图片（只读取文件头，不解码像素）
+    像素数超过 IMAGE_MAX_PIXELS 时抛出 ImageTooLarge
+    不修改 PIL 全局的 MAX_IMAGE_PIXELS，PIL 自身的解压炸弹检查（默认上限的两倍）仍然生效
+    """
+    try:
+        img = PILImage.open(source)
+    except PILImage.DecompressionBombError:
+        raise ImageTooLarge('图片像素数超出限制')
+    if img.width * img.height > settings.IMAGE_MAX_PIXELS:
+        # 关闭图片会同时关闭传入的文件对象，只关闭由 PIL 打开的文件
+        if not hasattr(source, 'read'):
+            img.close()
+        raise ImageTooLarge(
+            f'图片像素数超出限制（{img.width}x{img.height}，最大 {settings.IMAGE_MAX_PIXELS // 1000000} 百万像素）'
+        )
+    return img
+
+
+def check_decodable(img):
+    """检查图片能否在内存预算内解码（JPEG 可缩放解码，其他格式需要整图解码）"""
+    scale = JPEG_SCALES[-1] if img.format == 'JPEG' else 1
+    size = (math.ceil(img.width / scale), math.ceil(img.height / scale))
+    if decoded_bytes(size, img.mode) > settings.IMAGE_DECODE_BUDGET:
+        raise ImageTooLarge('图片解码所需内存超出限制')
+
+
+def check_upload(file):
+    """
+    上传前根据文件头检查图片尺寸，超出限制时抛出 ImageTooLarge
+    无法识别的文件不在这里处理
+    """
+    try:
+        # 不关闭图片：关闭图片会同时关闭上传的文件
+        check_decodable(open_image(file))
+    except ImageTooLarge:
+        raise
+    except Exception:
+        pass
+    finally:
+        file.seek(0)
+
+
+def display_size(img):
+    """按 EXIF 方向旋转后的尺寸（只读取文件头）"""
+    width, height = img.size
+    if img.getexif().get(ORIENTATION_TAG, 1) in (5, 6, 7, 8):
+        return height, width
+    return width, height
+
+
+def bounded_draft(img, size=None, max_pixels=None):
+    """
+    设置缩放解码（尚未解码时调用）
+    size: 需要的最小尺寸（未旋转的像素坐标），None 表示原尺寸
+    max_pixels: 原图像素上限，默认 IMAGE_MAX_PIXELS，超出时抛出 ImageTooLarge
+    JPEG 选择不小于 size 的最大缩放比例；整图解码超出 IMAGE_DECODE_BUDGET 时继续缩小，
+    其他格式超出预算时抛出 ImageTooLarge
+    返回: 图片本身（img.size 为实际解码尺寸）
+    """
+    max_pixels = max_pixels or settings.IMAGE_MAX_PIXELS
+    if img.width * img.height > max_pixels:
+        raise ImageTooLarge('图片像素数超出限制')
+    budget = settings.IMAGE_DECODE_BUDGET
+    if img.format != 'JPEG':
+        if decoded_bytes(img.size, img.mode) > budget:
+            raise ImageTooLarge('图片解码所需内存超出限制')
+        return img
+
+    size = size or img.size
+    candidates = [
+        scale for scale in JPEG_SCALES
+        if decoded_bytes((math.ceil(img.width / scale), math.ceil(img.height / scale)), img.mode) <= budget
+    ]
+    if not candidates:
+        raise ImageTooLarge('图片解码所需内存超出限制')
+    # 满足尺寸要求的最大缩放比例；预算不允许时取预算内最接近的比例
+    fitting = [scale for scale in candidates if img.width / scale >= size[0] and img.height / scale >= size[1]]
+    scale = max(fitting) if fitting else min(candidates)
+    if scale > 1:
+        img.draft(img.mode, (math.ceil(img.width / scale), math.ceil(img.height / scale)))
+    return img
+
+
+def transpose(img):
+    """按 EXIF 方向旋转（方向正常时直接返回原图，不复制）"""
+    if img.getexif().get(ORIENTATION_TAG, 1) == 1:
+        return img
+    return ImageOps.exif_transpose(img)
+
+
+def _strips(size):
+    """按水平条带切分，返回每个条带的区域"""
+    width, height = size
+    rows = max(1, STRIP_PIXELS // max(1, width))
+    for top in range(0, height, rows):
+        yield (0, top, width, min(height, top + rows))
+
+
+def resize(img, size, resample=PILImage.Resampling.LANCZOS):
+    """
+    按条带缩放：每个输出条带只对对应的源区域重采样，避免整图的中间缓冲
+    小图直接缩放
+    """
+    size = tuple(size)
+    if img.size == size:
+        return img
+    if img.width * img.height <= STRIP_PIXELS or img.mode in ('1', 'P'):
+        return img.resize(size, resample)
+
+    ratio = img.height / size[1]
+    output = PILImage.new(img.mode, size)
+    for box in _strips(size):
+        source = (0, box[1] * ratio, img.width, box[3] * ratio)
+        output.paste(img.resize((size[0], box[3] - box[1]), resample, box=source), box[:2])
+    return output
+
+
+def flatten(img):
+    """转换为 RGB/L 模式，透明背景按条带填充为白色"""
+    if img.mode in ('RGBA', 'LA', 'P'):
+        background = PILImage.new('RGB', img.size, (255, 255, 255))
+        for box in _strips(img.size):
+            piece = img.crop(box)
+            if piece.mode == 'P':
+                piece = piece.convert('RGBA')
+            mask = piece.getchannel('A') if piece.mode in ('RGBA', 'LA') else None
+            background.paste(piece.convert('RGB'), box[:2], mask)
+        return background
+    if img.mode not in ('RGB', 'L'):
+        return img.convert('RGB')
+    return img
+
+
+def current_rss():
+    """当前常驻内存（字节），不支持时返回 None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    """进程启动以来的峰值常驻内存（字节），不支持时返回 0"""
+    if resource is None:
+        return 0
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+@contextmanager
+def measure(stage):
+    """
+    记录阶段耗时与内存（INFO 级别）
+    peak 为进程峰值常驻内存，raised 为本阶段使峰值升高的量（即本阶段所需的额外内存）
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        yield
+        return
+    start = time.perf_counter()
+    peak_before = peak_rss()
+    try:
+        yield
+    finally:
+        mb = 1024 ** 2
+        rss = current_rss()
+        peak = peak_rss()
+        logger.info(
+            '%s: %.0fms rss=%s peak=%.1fMB raised=%.1fMB',
+            stage, (time.perf_counter() - start) * 1000,
+            f'{rss / mb:.1f}MB' if rss is not None else '-', peak / mb, (peak - peak_before) / mb
+        )
@@ -0,0 +1,78 @@
+"""
+Django管理命令：为尚未提取主色的图片补算主色及颜色掩码
+使用方法: python manage.py backfill_colors [--all] [--batch-size 500]
+"""
+from django.core.management.base import BaseCommand
+from api.models import Image
+from api.utils import set_dominant_colors
+from api.colors import extract_dominant_colors
+from api.caching import bump_library_version
+from api.storage import read_file
+from io import BytesIO
+import time
+
+
+class Command(BaseCommand):
+    help = '根据缩略图提取图片主色'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='重新计算所有图片，默认只处理尚未计算的图片',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='每批处理的图片数量',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        
+        queryset = Image.objects.exclude(thumbnail_path='')
+        if not options['all']:
+            queryset = queryset.filter(color_mask__isnull=True)
+        queryset = queryset.only('id', 'user_id', 'thumbnail_path').order_by('id')
+        
+        total = queryset.count()
+        self.stdout.write(f'找到 {total} 张待处理图片')
+        
+        processed = 0
+        error_count = 0
+        last_id = 0
+        start = time.monotonic()
+        
+        while True:
+            images = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not images:
+                break
+            last_id = images[-1].id
+            
+            updated = []
+            for image in images:
+                try:
+                    colors = extract_dominant_colors(BytesIO(read_file(image.thumbnail_path.name)))
+                except FileNotFoundError:
+                    colors = None
+                if colors is None:
+                    error_count += 1
+                    continue
+                set_dominant_colors(image, colors)
+                updated.append(image)
+            Image.objects.bulk_update(updated, ['dominant_colors', 'color_mask'])
+            
+            for user_id in {image.user_id for image in updated}:
+                bump_library_version(user_id)
+            
+            processed += len(images)
+            self.stdout.write(f'已处理 {processed}/{total}')
+        
+        elapsed = time.monotonic() - start
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'处理完成！'))
+        self.stdout.write(f'成功: {processed - error_count}')
+        self.stdout.write(f'失败: {error_count}')
+        if elapsed > 0:
+            self.stdout.write(f'速度: {processed / elapsed:.0f} 张/秒')
@@ -0,0 +1,73 @@
+"""
+Django管理命令：用离线逆地理编码回填图片的国家和地区
+使用方法: python manage.py backfill_regions [--all] [--batch-size 2000]
+"""
+from django.core.management.base import BaseCommand
+from api.models import Image
+from api.geocoder import reverse_geocode_batch
+from api.utils import set_region
+from api.caching import bump_library_version
+import time
+
+
+class Command(BaseCommand):
+    help = '根据图片坐标回填国家和地区'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='重新计算所有带坐标的图片，默认只处理尚未识别国家的图片',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=2000,
+            help='每批处理的图片数量',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        
+        queryset = Image.objects.filter(latitude__isnull=False, longitude__isnull=False)
+        if not options['all']:
+            queryset = queryset.filter(country_code__isnull=True)
+        queryset = queryset.only('id', 'user_id', 'latitude', 'longitude').order_by('id')
+        
+        total = queryset.count()
+        self.stdout.write(f'找到 {total} 张待处理图片')
+        
+        processed = 0
+        located = 0
+        last_id = 0
+        start = time.monotonic()
+        
+        # 按主键分批，避免一次加载全部行
+        while True:
+            images = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not images:
+                break
+            last_id = images[-1].id
+            
+            results = reverse_geocode_batch(
+                [(float(image.latitude), float(image.longitude)) for image in images]
+            )
+            for image, geocoded in zip(images, results):
+                set_region(image, geocoded)
+                if geocoded:
+                    located += 1
+            Image.objects.bulk_update(images, ['region', 'country_code', 'admin_region'])
+            
+            for user_id in {image.user_id for image in images}:
+                bump_library_version(user_id)
+            
+            processed += len(images)
+            self.stdout.write(f'已处理 {processed}/{total}')
+        
+        elapsed = time.monotonic() - start
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'处理完成！'))
+        self.stdout.write(f'识别成功: {located}')
+        self.stdout.write(f'未识别: {processed - located}')
+        if elapsed > 0:
+            self.stdout.write(f'速度: {processed / elapsed:.0f} 张/秒')
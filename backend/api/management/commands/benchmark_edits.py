@@ -0,0 +1,110 @@
+"""
+Django管理命令：色调调整性能测试
+使用方法: python manage.py benchmark_edits [--sizes 12 24 48] [--repeat 3]
+对比依次执行 ImageEnhance（Brightness -> Contrast -> Color）与 apply_adjustments
+在不同像素数下的耗时和峰值内存。每个用例在独立的子进程中运行，
+峰值内存取子进程最大常驻内存（ru_maxrss）相对于生成测试图片之后的增量。
+"""
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from api.editing import ADJUSTMENTS, apply_adjustments
+from PIL import Image as PILImage
+import numpy as np
+import resource
+import sys
+import time
+
+
+# 测试使用的调整参数
+SETTINGS = {'brightness': 1.15, 'contrast': 1.2, 'saturation': 1.3}
+
+
+def enhance_sequential(img):
+    for name, enhancer in ADJUSTMENTS.items():
+        img = enhancer(img).enhance(SETTINGS[name])
+    return img
+
+
+def enhance_fused(img):
+    return apply_adjustments(img, **SETTINGS)
+
+
+METHODS = {
+    'ImageEnhance': enhance_sequential,
+    'apply_adjustments': enhance_fused,
+}
+
+
+def make_image(megapixels):
+    """生成 4:3 的测试图片（平滑渐变叠加噪声，接近照片的像素分布）"""
+    width = int((megapixels * 1e6 * 4 / 3) ** 0.5)
+    height = int(megapixels * 1e6 / width)
+    img = PILImage.linear_gradient('L').resize((width, height))
+    noise = PILImage.effect_noise((width, height), 40)
+    return PILImage.merge('RGB', (img, noise, img.transpose(PILImage.Transpose.FLIP_LEFT_RIGHT)))
+
+
+def max_rss_bytes():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_case(case):
+    """在子进程中运行单个用例，返回 (耗时秒数列表, 峰值内存增量字节)"""
+    method, megapixels, repeat = case
+    img = make_image(megapixels)
+    img.load()
+    baseline = max_rss_bytes()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = METHODS[method](img)
+        timings.append(time.perf_counter() - start)
+        del result
+    return timings, max_rss_bytes() - baseline
+
+
+def max_difference(megapixels):
+    """两种实现输出的最大像素差"""
+    img = make_image(megapixels)
+    expected = np.asarray(enhance_sequential(img), dtype=np.int16)
+    actual = np.asarray(enhance_fused(img), dtype=np.int16)
+    return int(np.abs(expected - actual).max())
+
+
+class Command(BaseCommand):
+    help = '色调调整性能测试（耗时与峰值内存）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes',
+            type=float,
+            nargs='+',
+            default=[12, 24, 48],
+            help='测试图片的像素数（百万像素）',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=3,
+            help='每个用例重复次数（取最短耗时）',
+        )
+
+    def handle(self, *args, **options):
+        if options['repeat'] <= 0:
+            raise CommandError('--repeat 必须大于0')
+
+        self.stdout.write(f'调整参数: {SETTINGS}')
+        self.stdout.write(f'输出最大像素差（2MP）: {max_difference(2)}')
+        self.stdout.write('')
+        self.stdout.write(f'{"像素数":>8}  {"实现":<18}{"耗时":>10}{"峰值内存":>12}')
+
+        for megapixels in options['sizes']:
+            for method in METHODS:
+                # 每个用例使用新的子进程，峰值内存互不影响
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    timings, peak = executor.submit(run_case, (method, megapixels, options['repeat'])).result()
+                self.stdout.write(
+                    f'{megapixels:>6g}MP  {method:<18}{min(timings) * 1000:>8.0f}ms{peak / 1024 ** 2:>10.0f}MB'
+                )
@@ -0,0 +1,77 @@
+"""
+Django管理命令：重建视觉相似检索的特征索引
+使用方法: python manage.py rebuild_visual_index [--user 1] [--workers 4]
+"""
+from concurrent.futures import ProcessPoolExecutor
+from django.core.management.base import BaseCommand
+from api.models import Image
+from api.storage import read_file
+from api.visual import DIMENSIONS, compute_descriptor, write_index
+from io import BytesIO
+import numpy as np
+import os
+import time
+
+
+def describe(name):
+    """在工作进程中从存储读取缩略图并计算特征向量，缩略图不存在时返回 None"""
+    try:
+        return compute_descriptor(BytesIO(read_file(name)))
+    except FileNotFoundError:
+        return None
+
+
+class Command(BaseCommand):
+    help = '根据缩略图并行计算视觉特征，重建每个用户的特征索引'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='只重建指定用户ID的索引',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='并行计算特征的进程数',
+        )
+
+    def handle(self, *args, **options):
+        user_ids = Image.objects.order_by().values_list('user_id', flat=True).distinct()
+        if options['user']:
+            user_ids = [options['user']]
+        
+        total = 0
+        error_count = 0
+        start = time.monotonic()
+        
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            for user_id in user_ids:
+                rows = list(
+                    Image.objects.filter(user_id=user_id).exclude(thumbnail_path='')
+                    .order_by('id').values_list('id', 'thumbnail_path')
+                )
+                names = [name for _, name in rows]
+                vectors = executor.map(describe, names, chunksize=32)
+                
+                ids = []
+                matrix = []
+                for (image_id, _), vector in zip(rows, vectors):
+                    if vector is None:
+                        error_count += 1
+                        continue
+                    ids.append(image_id)
+                    matrix.append(vector)
+                
+                write_index(user_id, ids, np.asarray(matrix).reshape(len(ids), DIMENSIONS))
+                total += len(rows)
+                self.stdout.write(f'用户 {user_id}: 已索引 {len(ids)}/{len(rows)} 张图片')
+        
+        elapsed = time.monotonic() - start
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'处理完成！'))
+        self.stdout.write(f'成功: {total - error_count}')
+        self.stdout.write(f'失败: {error_count}')
+        if elapsed > 0:
+            self.stdout.write(f'速度: {total / elapsed:.0f} 张/秒')
@@ -1,11 +1,72 @@
 """
 Django管理命令：重新生成所有图片的缩略图
-使用方法: python manage.py regenerate_thumbnails
+使用方法: python manage.py regenerate_thumbnails [--force] [--workers 4] [--batch-size 200]
+                                               [--since 2025-01-01] [--user 1] [--restart]
+         python manage.py regenerate_thumbnails --outdated --throttle 5 --watch 600
+按ID分批处理，多进程并行生成缩略图，每批结束后批量写回数据库并记录断点；
+中断后使用相同参数再次运行会从断点继续。
+缩略图规格（settings.THUMBNAIL_SPEC）变更后，--outdated 只处理规格过期的缩略图，
+新缩略图写回数据库之后才删除旧文件，重新生成期间旧缩略图照常提供访问。
+每批在一个事务内锁定记录、一次查询核对后批量写回，只更新缩略图与编辑状态仍与读取时一致的记录；生成期间被编辑的图片跳过并删除新生成的文件，
+由编辑操作生成的缩略图为准。
 """
-from django.core.management.base import BaseCommand
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
 from api.models import Image
-from api.utils import create_thumbnail
+from api.utils import THUMBNAIL_FIELDS, create_placeholder, save_thumbnail, thumbnail_spec_hash
+from api.editing import build_thumbnail
+from api.caching import bump_library_version
+from api.storage import delete_file, read_file
+from PIL import Image as PILImage
+from io import BytesIO
+import json
 import os
+import time
+
+
+def regenerate(job):
+    """
+    在工作进程中处理单张图片（不访问数据库）
+    返回: (图片ID, 状态, 需要写回的字段值或错误信息)
+    状态: 'updated' 重新生成缩略图, 'placeholder' 只补生成占位图, 'skipped' 跳过, 'error' 失败
+    """
+    image_id, file_name, thumbnail_name, thumbnail_spec, placeholder, edit_stack, edit_index, force = job
+    image = Image(
+        id=image_id, file_path=file_name, thumbnail_path=thumbnail_name,
+        thumbnail_spec=thumbnail_spec, placeholder=placeholder,
+        edit_stack=edit_stack, edit_index=edit_index
+    )
+    try:
+        # 检查原图是否存在
+        if not default_storage.exists(image.file_path.name):
+            return image_id, 'error', f'原图不存在: {image.file_path.name}'
+
+        thumbnail_exists = bool(image.thumbnail_path) and default_storage.exists(image.thumbnail_path.name)
+
+        # 如果不是强制模式，且缩略图已存在且规格未过期，则跳过（缺少占位图时只根据现有缩略图补生成占位图）
+        if not force and thumbnail_exists and thumbnail_spec == thumbnail_spec_hash():
+            if image.placeholder:
+                return image_id, 'skipped', None
+            with PILImage.open(BytesIO(read_file(image.thumbnail_path.name))) as thumb:
+                return image_id, 'placeholder', {'placeholder': create_placeholder(thumb)}
+
+        # 生成新的缩略图（包含当前生效的编辑）
+        thumbnail = build_thumbnail(image)
+        if not thumbnail:
+            return image_id, 'error', '生成缩略图失败'
+
+        # 保存新缩略图（文件名随机生成，不会覆盖旧文件），旧缩略图在数据库更新后再删除
+        save_thumbnail(image, f"thumb_{os.path.basename(image.file_path.name)}", thumbnail)
+        values = {field: getattr(image, field) for field in THUMBNAIL_FIELDS}
+        values['thumbnail_path'] = image.thumbnail_path.name
+        stale = thumbnail_name if thumbnail_exists and thumbnail_name != image.thumbnail_path.name else None
+        return image_id, 'updated', (values, stale)
+
+    except Exception as e:
+        return image_id, 'error', str(e)
 
 
 class Command(BaseCommand):
@@ -17,64 +78,213 @@ class Command(BaseCommand):
             action='store_true',
             help='强制重新生成所有缩略图，即使已存在',
         )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=os.cpu_count() or 1,
+            help='并行生成缩略图的进程数',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=200,
+            help='每批处理的图片数量（每批结束后写回数据库并记录断点）',
+        )
+        parser.add_argument(
+            '--since',
+            help='只处理该日期（YYYY-MM-DD）及之后上传的图片',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='只处理指定用户ID的图片',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=os.path.join(settings.BASE_DIR, '.regenerate_thumbnails.json'),
+            help='断点文件路径',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='忽略已有断点，从头开始',
+        )
+        parser.add_argument(
+            '--outdated',
+            action='store_true',
+            help='只处理规格与当前 THUMBNAIL_SPEC 不一致的缩略图（按索引查询，不检查其余图片的文件）',
+        )
+        parser.add_argument(
+            '--throttle',
+            type=float,
+            default=0,
+            help='每秒最多处理的图片数量，用于后台平滑地重新生成，0 表示不限速',
+        )
+        parser.add_argument(
+            '--watch',
+            type=int,
+            default=0,
+            help='处理完成后每隔指定秒数再次检查（后台常驻运行），0 表示只运行一次',
+        )
+
+    def write_back(self, by_id, results):
+        """
+        一个事务内写回本批结果：锁定本批记录，一次查询读取当前的缩略图与编辑状态，
+        只把仍与读取时一致的记录按字段分组批量更新（生成期间图片可能被编辑、撤销或重新上传缩略图）
+        results: [(图片ID, 字段值, 旧缩略图)]
+        返回: (已写回的结果, 冲突的结果)
+        """
+        if not results:
+            return [], []
+        written = []
+        conflicts = []
+        groups = {}
+        with transaction.atomic():
+            current = {
+                image_id: (thumbnail_name, edit_hash)
+                for image_id, thumbnail_name, edit_hash in Image.objects.select_for_update().filter(
+                    id__in=[image_id for image_id, values, stale in results]
+                ).values_list('id', 'thumbnail_path', 'edit_hash')
+            }
+            for item in results:
+                image_id, values, stale = item
+                image = by_id[image_id]
+                if current.get(image_id) != (image.thumbnail_path.name, image.edit_hash):
+                    conflicts.append(item)
+                    continue
+                groups.setdefault(tuple(values), []).append(Image(id=image_id, **values))
+                written.append(item)
+            for fields, rows in groups.items():
+                Image.objects.bulk_update(rows, fields)
+        return written, conflicts
 
     def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size 必须大于0')
+
+        while True:
+            self.run(options)
+            if not options['watch']:
+                break
+            time.sleep(options['watch'])
+
+    def run(self, options):
         force = options['force']
-        
-        images = Image.objects.all()
-        total = images.count()
-        
+        batch_size = options['batch_size']
+        throttle = options['throttle']
+
+        queryset = Image.objects.all()
+        if options['outdated']:
+            queryset = queryset.exclude(thumbnail_spec=thumbnail_spec_hash())
+        if options['since']:
+            queryset = queryset.filter(uploaded_at__date__gte=options['since'])
+        if options['user']:
+            queryset = queryset.filter(user_id=options['user'])
+        queryset = queryset.only(
+            'id', 'user_id', 'file_path', 'thumbnail_path', 'thumbnail_spec', 'placeholder',
+            'edit_stack', 'edit_index', 'edit_hash'
+        ).order_by('id')
+
+        # 断点只对相同的筛选条件有效
+        run_key = {
+            'force': force, 'outdated': options['outdated'],
+            'since': options['since'], 'user': options['user'],
+        }
+        checkpoint_path = options['checkpoint']
+        last_id = 0
+        if not options['restart'] and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, encoding='utf-8') as f:
+                checkpoint = json.load(f)
+            if checkpoint.get('options') == run_key:
+                last_id = checkpoint['last_id']
+                self.stdout.write(f'从断点继续：ID > {last_id}')
+
+        total = queryset.filter(id__gt=last_id).count()
+        if not total and options['watch']:
+            return
         self.stdout.write(f'找到 {total} 张图片')
-        
+
+        processed = 0
         success_count = 0
         skip_count = 0
         error_count = 0
-        
-        for i, image in enumerate(images, 1):
-            self.stdout.write(f'处理 {i}/{total}: {image.title}')
-            
-            # 检查原图是否存在
-            if not os.path.exists(image.file_path.path):
-                self.stdout.write(self.style.ERROR(f'  原图不存在: {image.file_path.path}'))
-                error_count += 1
-                continue
-            
-            # 如果不是强制模式，且缩略图已存在，则跳过
-            if not force and image.thumbnail_path and os.path.exists(image.thumbnail_path.path):
-                self.stdout.write(self.style.WARNING(f'  缩略图已存在，跳过'))
-                skip_count += 1
-                continue
-            
-            try:
-                # 生成新的缩略图
-                thumbnail = create_thumbnail(image.file_path.path)
-                
-                if thumbnail:
-                    # 删除旧缩略图
-                    if image.thumbnail_path:
-                        try:
-                            if os.path.exists(image.thumbnail_path.path):
-                                os.remove(image.thumbnail_path.path)
-                        except Exception as e:
-                            self.stdout.write(self.style.WARNING(f'  删除旧缩略图失败: {str(e)}'))
-                    
-                    # 保存新缩略图
-                    thumbnail_name = f"thumb_{os.path.basename(image.file_path.name)}"
-                    image.thumbnail_path.save(thumbnail_name, thumbnail, save=True)
-                    
-                    self.stdout.write(self.style.SUCCESS(f'  ✓ 缩略图已生成'))
-                    success_count += 1
-                else:
-                    self.stdout.write(self.style.ERROR(f'  生成缩略图失败'))
-                    error_count += 1
-                    
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'  错误: {str(e)}'))
-                error_count += 1
-        
+        conflict_count = 0
+        start = time.monotonic()
+
+        # 子进程不使用父进程的数据库连接
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            while True:
+                batch_start = time.monotonic()
+                images = list(queryset.filter(id__gt=last_id)[:batch_size])
+                if not images:
+                    break
+
+                jobs = [
+                    (
+                        image.id, image.file_path.name, image.thumbnail_path.name,
+                        image.thumbnail_spec, image.placeholder, image.edit_stack, image.edit_index, force
+                    )
+                    for image in images
+                ]
+                by_id = {image.id: image for image in images}
+                results = []
+                for image_id, result, values in executor.map(regenerate, jobs, chunksize=8):
+                    if result == 'error':
+                        self.stdout.write(self.style.ERROR(f'  图片 {image_id}: {values}'))
+                        error_count += 1
+                    elif result == 'skipped':
+                        skip_count += 1
+                    elif result == 'updated':
+                        results.append((image_id, *values))
+                    else:
+                        results.append((image_id, values, None))
+
+                written, conflicts = self.write_back(by_id, results)
+                # 写回时发现已被修改的图片，新生成的缩略图不再使用
+                for image_id, values, stale in conflicts:
+                    if 'thumbnail_path' in values:
+                        delete_file(values['thumbnail_path'])
+                conflict_count += len(conflicts)
+                success_count += len(written)
+                changed_users = {by_id[image_id].user_id for image_id, values, stale in written}
+                stale_files = [stale for image_id, values, stale in written if stale]
+
+                for user_id in changed_users:
+                    bump_library_version(user_id)
+
+                # 数据库已指向新缩略图，删除旧文件
+                for name in stale_files:
+                    try:
+                        delete_file(name)
+                    except Exception as e:
+                        self.stdout.write(self.style.WARNING(f'  删除旧缩略图失败: {str(e)}'))
+
+                # 本批写回后再记录断点
+                last_id = images[-1].id
+                with open(checkpoint_path, 'w', encoding='utf-8') as f:
+                    json.dump({'options': run_key, 'last_id': last_id}, f)
+
+                processed += len(images)
+                elapsed = time.monotonic() - start
+                self.stdout.write(f'已处理 {processed}/{total}（{processed / elapsed:.1f} 张/秒）')
+
+                # 限速：本批耗时不足时等待，避免规格变更后集中占满CPU
+                if throttle > 0:
+                    remaining = len(images) / throttle - (time.monotonic() - batch_start)
+                    if remaining > 0:
+                        time.sleep(remaining)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+
+        elapsed = time.monotonic() - start
         self.stdout.write('')
         self.stdout.write(self.style.SUCCESS(f'处理完成！'))
         self.stdout.write(f'成功: {success_count}')
         self.stdout.write(f'跳过: {skip_count}')
+        self.stdout.write(f'已被修改（未写回）: {conflict_count}')
         self.stdout.write(f'失败: {error_count}')
-
+        self.stdout.write(f'耗时: {elapsed:.1f} 秒')
+        if elapsed > 0:
+            self.stdout.write(f'速度: {processed / elapsed:.1f} 张/秒')
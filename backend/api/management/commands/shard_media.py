@@ -0,0 +1,147 @@
+"""
+Django管理命令：把早期按日期存放的媒体文件迁移到分散目录布局
+使用方法: python manage.py shard_media [--workers 8] [--batch-size 500] [--user 1]
+原图、缩略图（images/%Y/%m/%d/、thumbnails/%Y/%m/%d/）和头像（avatars/）迁移到 <目录>/ab/cd/<随机键>，
+缩略图保留文件名中的内容指纹，缩略图地址不变，浏览器缓存仍然有效。
+每批先并行复制文件（本地存储为硬链接），批量写回数据库后再删除旧文件，迁移期间旧地址照常访问；
+已迁移的文件会被跳过，中断后直接再次运行即可。旧的渲染缓存（renditions/<图片ID>/）直接删除，访问时重新生成。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from api.models import Image, User
+from api.storage import avatar_upload_to, copy_file, delete_file, image_upload_to, is_sharded, thumbnail_upload_to
+from api.editing import RENDITION_ROOT
+import posixpath
+import time
+
+
+# 需要迁移的文件字段及生成新文件名的函数
+IMAGE_FIELDS = {'file_path': image_upload_to, 'thumbnail_path': thumbnail_upload_to}
+USER_FIELDS = {'avatar': avatar_upload_to}
+
+
+def move(job):
+    """
+    在线程中复制单个文件到新位置（不访问数据库）
+    返回: (对象ID, 字段, 新文件名或 None, 错误信息)
+    """
+    object_id, field, name, new_name = job
+    try:
+        copy_file(name, new_name)
+        return object_id, field, new_name, None
+    except FileNotFoundError:
+        return object_id, field, None, f'文件不存在: {name}'
+    except Exception as e:
+        return object_id, field, None, str(e)
+
+
+class Command(BaseCommand):
+    help = '把媒体文件迁移到分散目录布局（<目录>/ab/cd/<随机键>）'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=8,
+            help='并行复制文件的线程数',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=500,
+            help='每批处理的记录数量（每批结束后写回数据库并删除旧文件）',
+        )
+        parser.add_argument(
+            '--user',
+            type=int,
+            help='只处理指定用户ID的图片和头像',
+        )
+
+    def handle(self, *args, **options):
+        if options['batch_size'] <= 0:
+            raise CommandError('--batch-size 必须大于0')
+
+        start = time.monotonic()
+        images = Image.objects.all()
+        users = User.objects.exclude(avatar='').exclude(avatar__isnull=True)
+        if options['user']:
+            images = images.filter(user_id=options['user'])
+            users = users.filter(id=options['user'])
+
+        with ThreadPoolExecutor(max_workers=max(1, options['workers'])) as executor:
+            image_counts = self.migrate(executor, Image, images, IMAGE_FIELDS, options['batch_size'])
+            user_counts = self.migrate(executor, User, users, USER_FIELDS, options['batch_size'])
+        removed = self.remove_legacy_renditions()
+
+        elapsed = time.monotonic() - start
+        self.stdout.write('')
+        self.stdout.write(self.style.SUCCESS(f'处理完成！'))
+        self.stdout.write(f'迁移文件: {image_counts[0] + user_counts[0]}')
+        self.stdout.write(f'失败: {image_counts[1] + user_counts[1]}')
+        self.stdout.write(f'删除旧渲染缓存: {removed}')
+        self.stdout.write(f'耗时: {elapsed:.1f} 秒')
+
+    def migrate(self, executor, model, queryset, fields, batch_size):
+        """按ID分批迁移模型的文件字段，返回 (迁移文件数, 失败数)"""
+        queryset = queryset.only('id', *fields).order_by('id')
+        total = queryset.count()
+        self.stdout.write(f'{model._meta.verbose_name}: 找到 {total} 条记录')
+
+        moved_count = 0
+        error_count = 0
+        processed = 0
+        last_id = 0
+        while True:
+            objects = list(queryset.filter(id__gt=last_id)[:batch_size])
+            if not objects:
+                break
+            last_id = objects[-1].id
+
+            jobs = []
+            for obj in objects:
+                for field, upload_to in fields.items():
+                    name = getattr(obj, field).name
+                    if name and not is_sharded(name):
+                        jobs.append((obj.id, field, name, upload_to(obj, name)))
+
+            by_id = {obj.id: obj for obj in objects}
+            updated = {}
+            stale_files = []
+            for object_id, field, new_name, error in executor.map(move, jobs):
+                if error:
+                    self.stdout.write(self.style.ERROR(f'  {model.__name__} {object_id} {field}: {error}'))
+                    error_count += 1
+                    continue
+                obj = by_id[object_id]
+                stale_files.append(getattr(obj, field).name)
+                setattr(obj, field, new_name)
+                updated[object_id] = obj
+
+            # 数据库指向新文件之后再删除旧文件
+            model.objects.bulk_update(list(updated.values()), list(fields))
+            list(executor.map(delete_file, stale_files))
+
+            moved_count += len(stale_files)
+            processed += len(objects)
+            self.stdout.write(f'已处理 {processed}/{total}（迁移 {moved_count} 个文件）')
+
+        return moved_count, error_count
+
+    def remove_legacy_renditions(self):
+        """删除旧布局的渲染缓存（renditions/<图片ID>/ 下的文件；分散目录 renditions/ab/ 下只有子目录）"""
+        try:
+            directories, _ = default_storage.listdir(RENDITION_ROOT)
+        except FileNotFoundError:
+            return 0
+
+        removed = 0
+        for directory in directories:
+            if not directory.isdigit():
+                continue
+            path = posixpath.join(RENDITION_ROOT, directory)
+            _, files = default_storage.listdir(path)
+            for name in files:
+                delete_file(posixpath.join(path, name))
+                removed += 1
+        return removed
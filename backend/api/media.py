@@ -0,0 +1,131 @@
+"""
+受保护的媒体文件访问
+媒体文件不再由 nginx 公开提供：视图完成权限检查后，
+本地存储且配置了 MEDIA_ACCEL_REDIRECT 时只返回 X-Accel-Redirect 头，由 nginx 直接发送文件（sendfile、Range 均由 nginx 处理）；
+其余情况（本地开发、对象存储）从本地文件（对象存储时为本机缓存）流式返回，并在这里处理 Range。
+两种方式都支持 ETag / If-None-Match 与 Last-Modified / If-Modified-Since。
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe
+
+from .storage import is_local, local_path
+
+
+# 内容不会变化的地址（原图、带版本参数的地址）的缓存时间
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+RANGE_PATTERN = re.compile(r'^bytes=(\d*)-(\d*)$')
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+def file_etag(stat):
+    """与 nginx 相同格式的 ETag（修改时间与大小的十六进制），X-Accel-Redirect 前后一致"""
+    return f'"{int(stat.st_mtime):x}-{stat.st_size:x}"'
+
+
+def cache_control(immutable):
+    # 媒体文件需要登录才能访问，只允许浏览器缓存
+    if immutable:
+        return f'private, max-age={IMMUTABLE_MAX_AGE}, immutable'
+    return 'private, no-cache'
+
+
+def not_modified(request, etag, mtime):
+    """根据条件请求头判断客户端缓存是否仍然有效"""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        return if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]
+    if_modified_since = parse_http_date_safe(request.headers.get('If-Modified-Since', ''))
+    return if_modified_since is not None and int(mtime) <= if_modified_since
+
+
+def parse_range(header, size):
+    """
+    解析单个字节范围（不支持多段范围，此时返回整个文件）
+    返回: (start, end) 闭区间，None 表示返回整个文件，范围无效时抛出 ValueError
+    """
+    match = RANGE_PATTERN.match(header.strip()) if header else None
+    if not match or not any(match.groups()):
+        return None
+    start, end = match.groups()
+    if start:
+        start = int(start)
+        end = min(int(end), size - 1) if end else size - 1
+    else:
+        # bytes=-N：最后 N 个字节
+        start = max(0, size - int(end))
+        end = size - 1
+    if start > end or start >= size:
+        raise ValueError('请求范围无效')
+    return start, end
+
+
+def stream_range(file, start, length):
+    try:
+        file.seek(start)
+        while length > 0:
+            chunk = file.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        file.close()
+
+
+def serve_file(request, name, immutable=False):
+    """
+    返回存储中的文件（调用方负责权限检查）
+    immutable: 地址对应的内容不会变化，可以长期缓存
+    """
+    try:
+        path = local_path(name)
+        stat = os.stat(path)
+    except FileNotFoundError:
+        raise Http404('文件不存在')
+    etag = file_etag(stat)
+    headers = {
+        'ETag': etag,
+        'Last-Modified': http_date(stat.st_mtime),
+        'Cache-Control': cache_control(immutable),
+    }
+
+    if not_modified(request, etag, stat.st_mtime):
+        response = HttpResponseNotModified()
+    elif settings.MEDIA_ACCEL_REDIRECT and is_local():
+        response = HttpResponse(content_type=mimetypes.guess_type(name)[0] or 'application/octet-stream')
+        response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_REDIRECT + quote(name)
+    else:
+        response = file_response(request, path, stat.st_size, name)
+
+    for header, value in headers.items():
+        response[header] = value
+    return response
+
+
+def file_response(request, path, size, name):
+    """本地开发使用的流式响应（支持单个字节范围）"""
+    content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+    try:
+        byte_range = parse_range(request.headers.get('Range'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            stream_range(open(path, 'rb'), start, end - start + 1), status=206, content_type=content_type
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_album_albumimage_album_images'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='favorite',
+            index=models.Index(fields=['user', '-created_at'], name='favorites_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_favorite_user_created_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='camera_make',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='相机厂商'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='camera_model',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='相机型号'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='capture_date',
+            field=models.DateField(blank=True, null=True, verbose_name='拍摄日期'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='lens_make',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='镜头厂商'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='lens_model',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='镜头型号'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='orientation',
+            field=models.CharField(blank=True, choices=[('landscape', '横向'), ('portrait', '纵向'), ('square', '方形')], max_length=10, null=True, verbose_name='构图方向'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='region',
+            field=models.CharField(blank=True, max_length=50, null=True, verbose_name='地区'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'capture_date'], name='images_user_capture_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'camera_make', 'camera_model'], name='images_user_camera_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'lens_model'], name='images_user_lens_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'region'], name='images_user_region_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'orientation'], name='images_user_orient_idx'),
+        ),
+    ]
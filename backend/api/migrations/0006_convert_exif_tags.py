@@ -0,0 +1,122 @@
+"""
+将旧版上传流程生成的EXIF标签（拍摄日期、分辨率、地区、镜头信息）
+转换为图片表上的分面字段，并清理不再被引用的EXIF标签
+标签名全局唯一，用户手动添加的同名标签与上传时生成的标签是同一个 Tag，
+因此按上传流程写入的顺序识别每张图片上传时生成的关联，只转换、删除这些关联
+"""
+import re
+from datetime import datetime
+
+from django.db import migrations
+from django.utils import timezone
+
+
+DATE_TAG = re.compile(r'^\d{4}\.\d{2}\.\d{2}$')
+RESOLUTION_TAG = re.compile(r'^\d+x\d+$')
+REGION_TAGS = {'中国', '日本', '韩国', '美国', '欧洲'}
+BATCH_SIZE = 1000
+
+
+def get_orientation(width, height):
+    if not width or not height:
+        return None
+    if width > height:
+        return 'landscape'
+    if width < height:
+        return 'portrait'
+    return 'square'
+
+
+def parse_upload_tags(names):
+    """
+    按旧版上传流程写入标签的顺序识别上传时生成的EXIF标签：
+    日期、地区或位置（可选）、镜头厂商和镜头型号（可选）、分辨率
+    镜头名称没有固定格式，只有后面紧跟分辨率标签时才认为是镜头信息；
+    之后的标签是用户手动添加的同名标签，不转换也不删除
+    返回: (上传时生成的标签数量, 分面字段)
+    """
+    facets = {}
+    if not names or not DATE_TAG.match(names[0]):
+        return 0, facets
+    facets['capture_date'] = datetime.strptime(names[0], '%Y.%m.%d').date()
+    count = 1
+
+    if count < len(names) and (names[count] in REGION_TAGS or names[count].startswith('位置:')):
+        # 坐标已保存在 location 字段中
+        if names[count] in REGION_TAGS:
+            facets['region'] = names[count]
+        count += 1
+
+    lens_names = []
+    index = count
+    while index < len(names) and len(lens_names) < 2 and not (
+        DATE_TAG.match(names[index]) or RESOLUTION_TAG.match(names[index])
+        or names[index] in REGION_TAGS or names[index].startswith('位置:')
+    ):
+        lens_names.append(names[index])
+        index += 1
+    if index < len(names) and RESOLUTION_TAG.match(names[index]):
+        if len(lens_names) == 2:
+            facets['lens_make'], facets['lens_model'] = lens_names[0][:100], lens_names[1][:100]
+        elif lens_names:
+            facets['lens_model'] = lens_names[0][:100]
+        count = index + 1
+    return count, facets
+
+
+def convert_exif_tags(apps, schema_editor):
+    Image = apps.get_model('api', 'Image')
+    ImageTag = apps.get_model('api', 'ImageTag')
+    Tag = apps.get_model('api', 'Tag')
+
+    exif_tag_ids = list(Tag.objects.filter(source='exif').values_list('id', flat=True))
+
+    last_id = 0
+    while True:
+        images = list(Image.objects.filter(id__gt=last_id).order_by('id')[:BATCH_SIZE])
+        if not images:
+            break
+        last_id = images[-1].id
+
+        # 按加入顺序取出本批图片的EXIF标签（上传时按固定顺序写入，手动添加的标签在后）
+        links = {}
+        rows = ImageTag.objects.filter(
+            image_id__in=[image.id for image in images], tag_id__in=exif_tag_ids
+        ).order_by('id').values_list('image_id', 'id', 'tag__name')
+        for image_id, link_id, name in rows:
+            links.setdefault(image_id, []).append((link_id, name))
+
+        converted_link_ids = []
+        for image in images:
+            image_links = links.get(image.id, [])
+            count, facets = parse_upload_tags([name for _, name in image_links])
+            converted_link_ids.extend(link_id for link_id, _ in image_links[:count])
+
+            if not image.capture_date and 'capture_date' in facets:
+                image.capture_date = facets['capture_date']
+            for field in ('region', 'lens_make', 'lens_model'):
+                if field in facets:
+                    setattr(image, field, facets[field])
+
+            if image.shot_at:
+                image.capture_date = timezone.localtime(image.shot_at).date()
+            image.orientation = get_orientation(image.width, image.height)
+
+        Image.objects.bulk_update(
+            images, ['capture_date', 'region', 'lens_make', 'lens_model', 'orientation']
+        )
+        # 只删除已转换为分面字段的关联，用户手动添加的标签保留
+        ImageTag.objects.filter(id__in=converted_link_ids).delete()
+
+    Tag.objects.filter(id__in=exif_tag_ids, images__isnull=True).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_image_exif_facets'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_exif_tags, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_convert_exif_tags'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='geohash',
+            field=models.CharField(blank=True, max_length=12, null=True, verbose_name='Geohash'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='latitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True, verbose_name='纬度'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='longitude',
+            field=models.DecimalField(blank=True, decimal_places=6, max_digits=9, null=True, verbose_name='经度'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'geohash'], name='images_user_geohash_idx'),
+        ),
+    ]
@@ -0,0 +1,107 @@
+"""
+根据已有的 location 字符串（"lat, lon"）回填数值坐标和 geohash
+"""
+from decimal import Decimal
+
+from django.db import migrations
+
+
+BATCH_SIZE = 1000
+GEOHASH_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+GEOHASH_PRECISION = 12
+
+
+# 以下为编写迁移时 api.geo 中函数的副本，迁移的行为不随应用代码变化
+
+
+def geohash_encode(lat, lon, precision=GEOHASH_PRECISION):
+    """将经纬度编码为 geohash 字符串"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # geohash 从经度位开始交替
+
+    while len(chars) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits <<= 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits <<= 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return ''.join(chars)
+
+
+def parse_location(location):
+    """
+    解析旧版 location 字符串 "lat, lon"
+    返回: (lat, lon)，无法解析时返回 None
+    """
+    if not location:
+        return None
+    parts = location.split(',')
+    if len(parts) != 2:
+        return None
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        return None
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        return None
+    return lat, lon
+
+
+def backfill_coordinates(apps, schema_editor):
+    Image = apps.get_model('api', 'Image')
+
+    last_id = 0
+    while True:
+        images = list(
+            Image.objects.filter(id__gt=last_id, location__isnull=False)
+            .order_by('id').only('id', 'location')[:BATCH_SIZE]
+        )
+        if not images:
+            break
+        last_id = images[-1].id
+
+        updated = []
+        for image in images:
+            coordinates = parse_location(image.location)
+            if coordinates is None:
+                continue
+            lat, lon = coordinates
+            image.latitude = Decimal(f'{lat:.6f}')
+            image.longitude = Decimal(f'{lon:.6f}')
+            image.geohash = geohash_encode(lat, lon)
+            updated.append(image)
+
+        Image.objects.bulk_update(updated, ['latitude', 'longitude', 'geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_image_coordinates'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_coordinates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_backfill_coordinates'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='admin_region',
+            field=models.CharField(blank=True, max_length=100, null=True, verbose_name='省/州'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='country_code',
+            field=models.CharField(blank=True, max_length=3, null=True, verbose_name='国家代码'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'country_code', 'admin_region'], name='images_user_country_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_image_phash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='color_mask',
+            field=models.SmallIntegerField(blank=True, null=True, verbose_name='颜色掩码'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='dominant_colors',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='主色'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['user', 'color_mask'], name='images_user_color_idx'),
+        ),
+    ]
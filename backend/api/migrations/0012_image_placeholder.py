@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_image_dominant_colors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='placeholder',
+            field=models.TextField(blank=True, null=True, verbose_name='占位图'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:15
+
+import hashlib
+import json
+
+import PIL
+from django.db import migrations, models
+
+
+# 编写迁移时 api.utils 中的规格格式与哈希算法（副本），迁移的行为不随应用代码变化
+PLACEHOLDER_SIZE = (16, 12)
+
+
+def build_thumbnail_spec(size, crop, format, quality):
+    return {
+        'size': list(size),
+        'crop': crop,
+        'format': format,
+        'quality': quality,
+        'placeholder': list(PLACEHOLDER_SIZE),
+        # 已有缩略图由当前安装的 Pillow 生成
+        'pillow': PIL.__version__,
+    }
+
+
+def spec_hash(spec):
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def mark_existing_thumbnails(apps, schema_editor):
+    """已有缩略图都是按之前固定的规格（512x384 中心裁剪，JPEG 质量85）生成的"""
+    Image = apps.get_model('api', 'Image')
+    legacy = spec_hash(build_thumbnail_spec((512, 384), 'center', 'JPEG', 85))
+    Image.objects.exclude(thumbnail_path='').update(thumbnail_spec=legacy)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_image_placeholder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='thumbnail_spec',
+            field=models.CharField(blank=True, max_length=12, null=True, verbose_name='缩略图规格'),
+        ),
+        migrations.AddIndex(
+            model_name='image',
+            index=models.Index(fields=['thumbnail_spec'], name='images_thumb_spec_idx'),
+        ),
+        migrations.RunPython(mark_existing_thumbnails, migrations.RunPython.noop),
+    ]
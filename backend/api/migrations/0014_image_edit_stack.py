@@ -0,0 +1,28 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_image_thumbnail_spec'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='edit_hash',
+            field=models.CharField(blank=True, max_length=16, null=True, verbose_name='编辑哈希'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='edit_index',
+            field=models.PositiveIntegerField(default=0, verbose_name='当前编辑位置'),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='edit_stack',
+            field=models.JSONField(blank=True, default=list, verbose_name='编辑步骤'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-19 09:40
+
+from django.core.files.storage import default_storage
+from django.db import migrations, models
+
+
+BATCH_SIZE = 1000
+
+
+def backfill_file_size(apps, schema_editor):
+    """从存储读取已有原图的大小（文件不存在时保持为0）"""
+    Image = apps.get_model('api', 'Image')
+
+    last_id = 0
+    while True:
+        images = list(Image.objects.filter(id__gt=last_id).order_by('id').only('id', 'file_path')[:BATCH_SIZE])
+        if not images:
+            break
+        last_id = images[-1].id
+
+        for image in images:
+            try:
+                image.file_size = default_storage.size(image.file_path.name)
+            except Exception:
+                image.file_size = 0
+        Image.objects.bulk_update(images, ['file_size'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_image_edit_stack'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='file_size',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='文件大小'),
+        ),
+        migrations.RunPython(backfill_file_size, migrations.RunPython.noop),
+    ]
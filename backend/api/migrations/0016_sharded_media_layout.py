@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-19 06:40
+
+import api.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_image_file_size'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='file_path',
+            field=models.ImageField(max_length=500, upload_to=api.storage.image_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='image',
+            name='thumbnail_path',
+            field=models.ImageField(max_length=500, upload_to=api.storage.thumbnail_upload_to),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='avatar',
+            field=models.ImageField(blank=True, null=True, upload_to=api.storage.avatar_upload_to, verbose_name='头像'),
+        ),
+    ]
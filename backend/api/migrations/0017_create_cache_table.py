@@ -0,0 +1,21 @@
+"""
+创建数据库缓存表（未配置 REDIS_URL 时 settings.CACHES 使用 DatabaseCache），
+只执行 migrate 即可完成部署；使用 Redis 时 createcachetable 不做任何操作
+"""
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_cache_table(apps, schema_editor):
+    call_command('createcachetable', database=schema_editor.connection.alias, verbosity=0)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_sharded_media_layout'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_cache_table, migrations.RunPython.noop),
+    ]
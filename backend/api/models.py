@@ -2,6 +2,8 @@ from django.db import models
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MinLengthValidator, EmailValidator
 
+from .storage import avatar_upload_to, image_upload_to, thumbnail_upload_to
+
 
 class User(AbstractUser):
     """用户模型"""
@@ -15,7 +17,7 @@ class User(AbstractUser):
         unique=True,
         validators=[MinLengthValidator(6, message="用户名至少需要6个字符")]
     )
-    avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name='头像')
+    avatar = models.ImageField(upload_to=avatar_upload_to, blank=True, null=True, verbose_name='头像')
     bio = models.TextField(blank=True, null=True, verbose_name='个人简介')
     created_at = models.DateTimeField(auto_now_add=True)
     
@@ -50,15 +52,55 @@ class Tag(models.Model):
 
 class Image(models.Model):
     """图片模型"""
+    ORIENTATION_CHOICES = [
+        ('landscape', '横向'),
+        ('portrait', '纵向'),
+        ('square', '方形'),
+    ]
+    
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='images')
     title = models.CharField(max_length=255, blank=True, null=True)
     description = models.TextField(blank=True, null=True)
-    file_path = models.ImageField(upload_to='images/%Y/%m/%d/', max_length=500)
-    thumbnail_path = models.ImageField(upload_to='thumbnails/%Y/%m/%d/', max_length=500)
+    # 文件按随机键分散存放（images/ab/cd/<键>.jpg，见 api/storage.py）
+    file_path = models.ImageField(upload_to=image_upload_to, max_length=500)
+    thumbnail_path = models.ImageField(upload_to=thumbnail_upload_to, max_length=500)
+    # 原图文件大小（字节），统计占用空间时不需要逐个访问存储
+    file_size = models.PositiveBigIntegerField(default=0, verbose_name='文件大小')
     width = models.IntegerField(null=True, blank=True)
     height = models.IntegerField(null=True, blank=True)
     shot_at = models.DateTimeField(null=True, blank=True)
     location = models.CharField(max_length=255, blank=True, null=True)
+    # GPS 坐标及其 geohash（用于范围查询的前缀索引）
+    latitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, verbose_name='纬度')
+    longitude = models.DecimalField(max_digits=9, decimal_places=6, null=True, blank=True, verbose_name='经度')
+    geohash = models.CharField(max_length=12, blank=True, null=True, verbose_name='Geohash')
+    # EXIF 分面字段
+    capture_date = models.DateField(null=True, blank=True, verbose_name='拍摄日期')
+    camera_make = models.CharField(max_length=100, blank=True, null=True, verbose_name='相机厂商')
+    camera_model = models.CharField(max_length=100, blank=True, null=True, verbose_name='相机型号')
+    lens_make = models.CharField(max_length=100, blank=True, null=True, verbose_name='镜头厂商')
+    lens_model = models.CharField(max_length=100, blank=True, null=True, verbose_name='镜头型号')
+    region = models.CharField(max_length=50, blank=True, null=True, verbose_name='地区')
+    country_code = models.CharField(max_length=3, blank=True, null=True, verbose_name='国家代码')
+    admin_region = models.CharField(max_length=100, blank=True, null=True, verbose_name='省/州')
+    orientation = models.CharField(max_length=10, choices=ORIENTATION_CHOICES, blank=True, null=True, verbose_name='构图方向')
+    # 感知哈希（64位 dHash）及其4个16位分段（用于近似重复检索的分段索引）
+    phash = models.BigIntegerField(null=True, blank=True, verbose_name='感知哈希')
+    phash_0 = models.IntegerField(null=True, blank=True)
+    phash_1 = models.IntegerField(null=True, blank=True)
+    phash_2 = models.IntegerField(null=True, blank=True)
+    phash_3 = models.IntegerField(null=True, blank=True)
+    # 非破坏性编辑：编辑步骤列表、当前生效的步骤数及其哈希（见 api/editing.py）
+    edit_stack = models.JSONField(default=list, blank=True, verbose_name='编辑步骤')
+    edit_index = models.PositiveIntegerField(default=0, verbose_name='当前编辑位置')
+    edit_hash = models.CharField(max_length=16, blank=True, null=True, verbose_name='编辑哈希')
+    # 生成缩略图时使用的规格哈希，与当前规格不同的缩略图会在后台重新生成
+    thumbnail_spec = models.CharField(max_length=12, blank=True, null=True, verbose_name='缩略图规格')
+    # 内联占位图（极小 JPEG 的 data URI），缩略图加载前先模糊显示
+    placeholder = models.TextField(blank=True, null=True, verbose_name='占位图')
+    # 主色（按占比降序的十六进制颜色）及其调色板位掩码（见 api/colors.py）
+    dominant_colors = models.CharField(max_length=64, blank=True, null=True, verbose_name='主色')
+    color_mask = models.SmallIntegerField(null=True, blank=True, verbose_name='颜色掩码')
     uploaded_at = models.DateTimeField(auto_now_add=True)
     tags = models.ManyToManyField(Tag, through='ImageTag', related_name='images')
     favorited_by = models.ManyToManyField(User, through='Favorite', related_name='favorite_images')
@@ -68,6 +110,21 @@ class Image(models.Model):
         verbose_name = '图片'
         verbose_name_plural = '图片'
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['user', 'capture_date'], name='images_user_capture_idx'),
+            models.Index(fields=['user', 'camera_make', 'camera_model'], name='images_user_camera_idx'),
+            models.Index(fields=['user', 'lens_model'], name='images_user_lens_idx'),
+            models.Index(fields=['user', 'region'], name='images_user_region_idx'),
+            models.Index(fields=['user', 'country_code', 'admin_region'], name='images_user_country_idx'),
+            models.Index(fields=['user', 'orientation'], name='images_user_orient_idx'),
+            models.Index(fields=['user', 'geohash'], name='images_user_geohash_idx'),
+            models.Index(fields=['user', 'phash_0'], name='images_user_phash0_idx'),
+            models.Index(fields=['user', 'phash_1'], name='images_user_phash1_idx'),
+            models.Index(fields=['user', 'phash_2'], name='images_user_phash2_idx'),
+            models.Index(fields=['user', 'phash_3'], name='images_user_phash3_idx'),
+            models.Index(fields=['user', 'color_mask'], name='images_user_color_idx'),
+            models.Index(fields=['thumbnail_spec'], name='images_thumb_spec_idx'),
+        ]
     
     def __str__(self):
         return self.title or f"图片 {self.id}"
@@ -82,6 +139,10 @@ class Favorite(models.Model):
     class Meta:
         db_table = 'favorites'
         unique_together = ['user', 'image']
+        indexes = [
+            # 收藏列表按收藏时间游标分页
+            models.Index(fields=['user', '-created_at'], name='favorites_user_created_idx'),
+        ]
         verbose_name = '收藏'
         verbose_name_plural = '收藏'
         ordering = ['-created_at']
@@ -1,8 +1,13 @@
 from rest_framework import serializers
+from django.urls import reverse
 from django.contrib.auth import authenticate
 from django.core.validators import validate_email
 from django.core.exceptions import ValidationError
 from .models import User, Image, Tag, ImageTag, Favorite, Album, AlbumImage
+from .geo import parse_location
+from .utils import set_coordinates, set_region, thumbnail_fingerprint
+from .geocoder import reverse_geocode
+from .colors import mask_to_names
 
 
 class UserRegisterSerializer(serializers.ModelSerializer):
@@ -145,6 +150,82 @@ class UserUpdateSerializer(serializers.ModelSerializer):
         return instance
 
 
+def image_file_url(image, request):
+    """图片地址（经过权限检查的接口）：经过编辑的图片指向按编辑哈希缓存的渲染结果"""
+    if not image.file_path or not request:
+        return None
+    if image.edit_hash:
+        url = reverse('image-rendition', args=[image.id])
+        return request.build_absolute_uri(f'{url}?v={image.edit_hash}')
+    return request.build_absolute_uri(reverse('image-original', args=[image.id]))
+
+
+def thumbnail_url_path(image):
+    """缩略图地址（不含域名），带内容指纹的版本参数，缩略图变化时地址随之变化"""
+    if not image.thumbnail_path:
+        return None
+    url = reverse('image-thumbnail', args=[image.id])
+    fingerprint = thumbnail_fingerprint(image.thumbnail_path.name)
+    return f'{url}?v={fingerprint}' if fingerprint else url
+
+
+def image_thumbnail_url(image, request):
+    """缩略图地址（经过权限检查的接口）"""
+    if not image.thumbnail_path or not request:
+        return None
+    return request.build_absolute_uri(thumbnail_url_path(image))
+
+
+class DynamicFieldsMixin:
+    """
+    支持按需裁剪输出字段的序列化器混入类
+    通过 fields 参数传入需要保留的字段名列表，其余字段在初始化时移除，
+    被移除字段对应的 SerializerMethodField 等也就不会再被计算
+    """
+    # 预设字段集合，例如网格视图使用的 compact
+    FIELD_PRESETS = {}
+    # 输出字段依赖的数据库列（用于 QuerySet.only）
+    FIELD_SOURCES = {}
+
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super().__init__(*args, **kwargs)
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
+
+    @classmethod
+    def resolve_fields(cls, fields_param, expand_param=None):
+        """
+        解析 fields / expand 查询参数
+        返回需要输出的字段名列表；未指定 fields 时返回 None（输出全部字段）
+        """
+        if not fields_param:
+            return None
+
+        requested = []
+        for name in fields_param.split(','):
+            name = name.strip()
+            if name in cls.FIELD_PRESETS:
+                requested.extend(cls.FIELD_PRESETS[name])
+            elif name:
+                requested.append(name)
+
+        if expand_param:
+            requested.extend(name.strip() for name in expand_param.split(',') if name.strip())
+
+        declared = set(cls.Meta.fields)
+        return [name for name in dict.fromkeys(requested) if name in declared]
+
+    @classmethod
+    def resolve_columns(cls, fields):
+        """根据输出字段计算需要查询的数据库列"""
+        columns = {'id'}
+        for field_name in fields:
+            columns.update(cls.FIELD_SOURCES.get(field_name, ()))
+        return sorted(columns)
+
+
 class TagSerializer(serializers.ModelSerializer):
     """标签序列化器"""
     class Meta:
@@ -153,7 +234,7 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ['id']
 
 
-class ImageSerializer(serializers.ModelSerializer):
+class ImageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """图片序列化器"""
     tags = TagSerializer(many=True, read_only=True)
     tag_ids = serializers.ListField(
@@ -165,29 +246,76 @@ class ImageSerializer(serializers.ModelSerializer):
     file_url = serializers.SerializerMethodField()
     thumbnail_url = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
+    latitude = serializers.FloatField(read_only=True)
+    longitude = serializers.FloatField(read_only=True)
+    dominant_colors = serializers.SerializerMethodField()
+    colors = serializers.SerializerMethodField()
     
     class Meta:
         model = Image
         fields = [
-            'id', 'user', 'title', 'description', 'file_path', 'thumbnail_path',
-            'file_url', 'thumbnail_url', 'width', 'height', 'shot_at', 
-            'location', 'uploaded_at', 'tags', 'tag_ids', 'is_favorited'
+            'id', 'user', 'title', 'description',
+            'file_url', 'thumbnail_url', 'placeholder', 'width', 'height', 'shot_at', 
+            'location', 'latitude', 'longitude', 'capture_date', 'camera_make', 'camera_model',
+            'lens_make', 'lens_model', 'region', 'country_code', 'admin_region', 'orientation',
+            'dominant_colors', 'colors', 'edit_stack', 'edit_index',
+            'uploaded_at', 'tags', 'tag_ids', 'is_favorited'
         ]
-        read_only_fields = ['id', 'user', 'uploaded_at', 'width', 'height', 'thumbnail_path']
+        read_only_fields = [
+            'id', 'user', 'uploaded_at', 'width', 'height', 'placeholder',
+            'capture_date', 'camera_make', 'camera_model', 'lens_make', 'lens_model',
+            'region', 'country_code', 'admin_region', 'orientation', 'edit_stack', 'edit_index'
+        ]
+    
+    FIELD_PRESETS = {
+        # 图库网格视图只需要缩略图和尺寸
+        'compact': ['id', 'thumbnail_url', 'placeholder', 'width', 'height', 'is_favorited'],
+    }
+    FIELD_SOURCES = {
+        'user': ['user'],
+        'title': ['title'],
+        'description': ['description'],
+        'file_url': ['file_path', 'edit_hash'],
+        'thumbnail_url': ['thumbnail_path'],
+        'placeholder': ['placeholder'],
+        'width': ['width'],
+        'height': ['height'],
+        'shot_at': ['shot_at'],
+        'location': ['location'],
+        'latitude': ['latitude'],
+        'longitude': ['longitude'],
+        'capture_date': ['capture_date'],
+        'camera_make': ['camera_make'],
+        'camera_model': ['camera_model'],
+        'lens_make': ['lens_make'],
+        'lens_model': ['lens_model'],
+        'region': ['region'],
+        'country_code': ['country_code'],
+        'admin_region': ['admin_region'],
+        'orientation': ['orientation'],
+        'dominant_colors': ['dominant_colors'],
+        'colors': ['color_mask'],
+        'edit_stack': ['edit_stack'],
+        'edit_index': ['edit_index'],
+        'uploaded_at': ['uploaded_at'],
+    }
     
     def get_file_url(self, obj):
-        request = self.context.get('request')
-        if obj.file_path and request:
-            return request.build_absolute_uri(obj.file_path.url)
-        return None
+        return image_file_url(obj, self.context.get('request'))
     
     def get_thumbnail_url(self, obj):
-        request = self.context.get('request')
-        if obj.thumbnail_path and request:
-            return request.build_absolute_uri(obj.thumbnail_path.url)
-        return None
+        return image_thumbnail_url(obj, self.context.get('request'))
+    
+    def get_dominant_colors(self, obj):
+        return obj.dominant_colors.split(',') if obj.dominant_colors else []
+    
+    def get_colors(self, obj):
+        return mask_to_names(obj.color_mask)
     
     def get_is_favorited(self, obj):
+        # 优先使用查询集中预先注解的收藏状态，避免逐条查询
+        if hasattr(obj, 'favorited_flag'):
+            return obj.favorited_flag
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return Favorite.objects.filter(user=request.user, image=obj).exists()
@@ -209,6 +337,12 @@ class ImageSerializer(serializers.ModelSerializer):
         
         for attr, value in validated_data.items():
             setattr(instance, attr, value)
+        
+        # 手动修改位置时同步数值坐标和地区
+        if 'location' in validated_data:
+            coordinates = parse_location(instance.location)
+            set_coordinates(instance, *(coordinates or (None, None)))
+            set_region(instance, reverse_geocode(*coordinates) if coordinates else None)
         instance.save()
         
         # 更新标签
@@ -228,7 +362,7 @@ class ImageUploadSerializer(serializers.ModelSerializer):
         fields = ['file', 'title', 'description']
 
 
-class AlbumImageSerializer(serializers.ModelSerializer):
+class AlbumImageSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """相册中的图片序列化器"""
     tags = TagSerializer(many=True, read_only=True)
     file_url = serializers.SerializerMethodField()
@@ -238,31 +372,30 @@ class AlbumImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = Image
         fields = [
-            'id', 'title', 'description', 'file_url', 'thumbnail_url',
+            'id', 'title', 'description', 'file_url', 'thumbnail_url', 'placeholder',
             'width', 'height', 'shot_at', 'location', 'uploaded_at',
             'tags', 'is_favorited'
         ]
     
+    FIELD_PRESETS = ImageSerializer.FIELD_PRESETS
+    FIELD_SOURCES = ImageSerializer.FIELD_SOURCES
+    
     def get_file_url(self, obj):
-        request = self.context.get('request')
-        if obj.file_path and request:
-            return request.build_absolute_uri(obj.file_path.url)
-        return None
+        return image_file_url(obj, self.context.get('request'))
     
     def get_thumbnail_url(self, obj):
-        request = self.context.get('request')
-        if obj.thumbnail_path and request:
-            return request.build_absolute_uri(obj.thumbnail_path.url)
-        return None
+        return image_thumbnail_url(obj, self.context.get('request'))
     
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'favorited_flag'):
+            return obj.favorited_flag
         request = self.context.get('request')
         if request and request.user.is_authenticated:
             return obj.favorited_by.filter(id=request.user.id).exists()
         return False
 
 
-class AlbumSerializer(serializers.ModelSerializer):
+class AlbumSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     """相册序列化器"""
     user = UserSerializer(read_only=True)
     image_count = serializers.SerializerMethodField()
@@ -281,13 +414,34 @@ class AlbumSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'user', 'created_at', 'updated_at']
     
+    FIELD_PRESETS = {
+        # 相册网格视图：预览图同样使用精简字段
+        'compact': ['id', 'name', 'image_count', 'preview_images'],
+    }
+    FIELD_SOURCES = {
+        'user': ['user'],
+        'name': ['name'],
+        'description': ['description'],
+        'created_at': ['created_at'],
+        'updated_at': ['updated_at'],
+    }
+    
     def get_image_count(self, obj):
+        # 列表接口中已通过 SQL 注解计数
+        if hasattr(obj, 'images_total'):
+            return obj.images_total
         return obj.images.count()
     
     def get_preview_images(self, obj):
-        # 获取相册前4张图片作为预览
-        images = obj.images.all()[:4]
-        return AlbumImageSerializer(images, many=True, context=self.context).data
+        # 获取相册前4张图片作为预览（列表接口中已批量加载）
+        if hasattr(obj, 'preview_list'):
+            images = obj.preview_list
+        else:
+            images = obj.images.all()[:4]
+        return AlbumImageSerializer(
+            images, many=True, context=self.context,
+            fields=self.context.get('preview_fields')
+        ).data
     
     def create(self, validated_data):
         image_ids = validated_data.pop('image_ids', [])
@@ -316,19 +470,20 @@ class AlbumSerializer(serializers.ModelSerializer):
 
 
 class AlbumDetailSerializer(serializers.ModelSerializer):
-    """相册详情序列化器"""
+    """相册详情序列化器（图片列表通过 /albums/{id}/images/ 分页获取）"""
     user = UserSerializer(read_only=True)
-    images = AlbumImageSerializer(many=True, read_only=True)
     image_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Album
         fields = [
             'id', 'user', 'name', 'description', 
-            'images', 'image_count', 'created_at', 'updated_at'
+            'image_count', 'created_at', 'updated_at'
         ]
         read_only_fields = ['id', 'user', 'created_at', 'updated_at']
     
     def get_image_count(self, obj):
+        if hasattr(obj, 'images_total'):
+            return obj.images_total
         return obj.images.count()
 
@@ -0,0 +1,112 @@
+"""
+感知哈希近似重复检测
+64位 dHash 拆分为 4 段 16 位，分段存储在图片表的索引列上（多索引哈希）。
+根据抽屉原理，汉明距离不超过 r 的两个哈希至少有一段的差异不超过 r // 4 位，
+因此只需按分段做精确匹配（或枚举 1 位翻转）即可通过索引取出候选，再精确计算距离。
+"""
+from itertools import combinations
+
+from django.db.models import Q
+
+
+HASH_BITS = 64
+CHUNK_COUNT = 4
+CHUNK_BITS = HASH_BITS // CHUNK_COUNT
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+# 分段最多枚举 1 位翻转，对应可保证召回的最大汉明距离
+MAX_RADIUS = CHUNK_COUNT * 2 - 1
+CHUNK_FIELDS = [f'phash_{i}' for i in range(CHUNK_COUNT)]
+
+
+def to_signed(value):
+    """无符号64位整数转换为有符号（数据库 BIGINT 存储）"""
+    return value - (1 << HASH_BITS) if value >= (1 << (HASH_BITS - 1)) else value
+
+
+def to_unsigned(value):
+    return value + (1 << HASH_BITS) if value < 0 else value
+
+
+def split_hash(value):
+    """将64位哈希拆分为 CHUNK_COUNT 段"""
+    value = to_unsigned(value)
+    return [(value >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(CHUNK_COUNT)]
+
+
+def hamming(a, b):
+    return bin(to_unsigned(a) ^ to_unsigned(b)).count('1')
+
+
+def chunk_variants(chunk, radius):
+    """分段在给定查询半径下需要探测的取值"""
+    values = [chunk]
+    if radius // CHUNK_COUNT >= 1:
+        values.extend(chunk ^ (1 << bit) for bit in range(CHUNK_BITS))
+    return values
+
+
+def candidate_q(phash, radius):
+    """构造按分段索引取候选图片的查询条件"""
+    condition = Q()
+    for field, chunk in zip(CHUNK_FIELDS, split_hash(phash)):
+        condition |= Q(**{f'{field}__in': chunk_variants(chunk, radius)})
+    return condition
+
+
+def find_similar(phash, candidates, radius):
+    """
+    从候选 (id, phash) 中筛选距离不超过 radius 的结果
+    返回按距离排序的 [(id, distance), ...]
+    """
+    matches = []
+    for image_id, other in candidates:
+        distance = hamming(phash, other)
+        if distance <= radius:
+            matches.append((image_id, distance))
+    matches.sort(key=lambda item: (item[1], item[0]))
+    return matches
+
+
+def find_duplicate_groups(items, radius):
+    """
+    在内存中用多索引哈希找出所有距离不超过 radius 的图片对，并合并为重复组
+    items: [(id, phash), ...]
+    返回: [[id, ...], ...]，每组至少两张图片
+    """
+    buckets = [{} for _ in range(CHUNK_COUNT)]
+    for image_id, phash in items:
+        for index, chunk in enumerate(split_hash(phash)):
+            buckets[index].setdefault(chunk, []).append(image_id)
+
+    hashes = dict(items)
+    parent = {image_id: image_id for image_id in hashes}
+
+    def find(image_id):
+        while parent[image_id] != image_id:
+            parent[image_id] = parent[parent[image_id]]
+            image_id = parent[image_id]
+        return image_id
+
+    checked = set()
+    for image_id, phash in items:
+        for index, chunk in enumerate(split_hash(phash)):
+            for value in chunk_variants(chunk, radius):
+                for other_id in buckets[index].get(value, ()):
+                    if other_id <= image_id:
+                        continue
+                    pair = (image_id, other_id)
+                    if pair in checked:
+                        continue
+                    checked.add(pair)
+                    if hamming(phash, hashes[other_id]) <= radius:
+                        parent[find(other_id)] = find(image_id)
+
+    groups = {}
+    for image_id in hashes:
+        groups.setdefault(find(image_id), []).append(image_id)
+    return [sorted(group) for group in groups.values() if len(group) > 1]
+
+
+def group_max_distance(group, hashes):
+    """组内两两之间的最大距离"""
+    return max((hamming(hashes[a], hashes[b]) for a, b in combinations(group, 2)), default=0)
@@ -0,0 +1,237 @@
+"""
+媒体文件存储
+所有媒体文件都通过 Django 存储 API（default_storage）读写，settings.MEDIA_STORAGE 可以在本地磁盘
+（FileSystemStorage）与 S3 兼容的对象存储（django-storages，开发环境使用 MinIO）之间切换，
+使用对象存储时多个无状态的后端节点不再需要共享的 NFS 卷。
+需要本地文件的处理（jpegtran、大图缩放解码、AI 分析）通过 local_path 获取路径：
+本地存储直接返回文件路径；对象存储流式下载到本机缓存目录（MEDIA_CACHE_DIR），
+按最近访问时间淘汰，热点原图只下载一次。缓存按文件名索引，删除文件时同时清除本机缓存。
+淘汰需要遍历缓存目录，只在本进程写入的数据量累计超过容量的一定比例或距上次清理较久时进行。
+
+目录布局：新文件使用随机键命名，并按键的哈希分散到两级子目录（images/ab/cd/<键>.jpg），
+单个目录的文件数不随上传量增长；文件名不会重复，保存时不检查重名（存储允许覆盖，不再逐个 exists()）。
+早期按日期存放的文件（images/%Y/%m/%d/）由 shard_media 命令迁移。
+"""
+import hashlib
+import os
+import posixpath
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage, default_storage
+
+
+# 流式读写的块大小
+CHUNK_SIZE = 1024 * 1024
+# 最近写入的缓存文件不淘汰（可能正被其他进程读取）
+CACHE_GRACE_SECONDS = 60
+# 本进程写入缓存的数据量超过容量上限的该比例，或距上次清理超过 CACHE_SWEEP_SECONDS 时才遍历缓存目录淘汰
+CACHE_SWEEP_FRACTION = 0.05
+CACHE_SWEEP_SECONDS = 300
+# 缩略图文件名中的内容指纹（见 utils.save_thumbnail），分散存放时保留；早期文件名可能带有存储追加的随机后缀
+FINGERPRINT_SUFFIX = re.compile(r'\.([0-9a-f]{12})(?:_[0-9A-Za-z]{7})?$')
+
+
+def shard_dir(key):
+    """键对应的两级子目录（ab/cd）"""
+    digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+    return posixpath.join(digest[:2], digest[2:4])
+
+
+def sharded_name(directory, suffix):
+    """新文件名：<目录>/ab/cd/<随机键><后缀>"""
+    key = uuid.uuid4().hex
+    return posixpath.join(directory, shard_dir(key), key + suffix)
+
+
+def is_sharded(name):
+    """文件是否已使用分散目录布局"""
+    parts = (name or '').split('/')
+    if len(parts) != 4:
+        return False
+    key = parts[3][:32]
+    return bool(re.fullmatch(r'[0-9a-f]{32}', key)) and posixpath.join(parts[1], parts[2]) == shard_dir(key)
+
+
+def image_upload_to(instance, filename):
+    return sharded_name('images', os.path.splitext(filename)[1].lower())
+
+
+def thumbnail_upload_to(instance, filename):
+    """保留文件名中的内容指纹：thumbnails/ab/cd/<随机键>.<指纹>.jpg"""
+    stem, extension = os.path.splitext(os.path.basename(filename))
+    match = FINGERPRINT_SUFFIX.search(stem)
+    return sharded_name('thumbnails', (f'.{match.group(1)}' if match else '') + extension.lower())
+
+
+def avatar_upload_to(instance, filename):
+    return sharded_name('avatars', os.path.splitext(filename)[1].lower())
+
+
+def is_local(storage=default_storage):
+    """存储是否为本地文件系统（文件可以直接按 path() 访问）"""
+    return isinstance(storage, FileSystemStorage)
+
+
+def cache_path(name):
+    """文件在本机缓存目录中的路径（按文件名哈希分散到子目录）"""
+    digest = hashlib.sha1(name.encode('utf-8')).hexdigest()
+    return os.path.join(settings.MEDIA_CACHE_DIR, digest[:2], digest + os.path.splitext(name)[1])
+
+
+def local_path(name):
+    """
+    获取存储中文件的本地路径
+    对象存储时从缓存返回，未命中时流式下载（文件不存在时抛出 FileNotFoundError）
+    """
+    if is_local():
+        return default_storage.path(name)
+
+    path = cache_path(name)
+    try:
+        # 只更新访问时间（用于淘汰），修改时间保持为存储中的修改时间
+        os.utime(path, (time.time(), os.stat(path).st_mtime))
+        return path
+    except FileNotFoundError:
+        pass
+
+    # 不先检查 exists()，对象存储上少一次请求
+    try:
+        modified = default_storage.get_modified_time(name).timestamp()
+        with default_storage.open(name, 'rb') as source:
+            store_cache(path, source, modified)
+    except Exception as e:
+        if is_missing(e):
+            raise FileNotFoundError(name) from e
+        raise
+    return path
+
+
+def is_missing(error):
+    """存储报告文件不存在：本地为 FileNotFoundError，S3 为状态码 404 的 ClientError"""
+    if isinstance(error, FileNotFoundError):
+        return True
+    code = getattr(error, 'response', {}).get('Error', {}).get('Code')
+    return code in ('404', 'NoSuchKey', 'NotFound')
+
+
+def cache_file(name, content):
+    """上传后把文件写入本机缓存，紧接着的 EXIF 提取、缩略图生成不需要再下载"""
+    if is_local():
+        return
+    content.seek(0)
+    store_cache(cache_path(name), content, time.time())
+    content.seek(0)
+
+
+def store_cache(path, source, modified):
+    """流式写入临时文件后原子替换，多个进程同时下载同一文件时互不影响"""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as target:
+            shutil.copyfileobj(source, target, CHUNK_SIZE)
+            size = target.tell()
+        os.utime(temp_path, (time.time(), modified))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    if sweep_due(size):
+        evict_cache()
+
+
+_sweep_lock = threading.Lock()
+_sweep_state = {'bytes': 0, 'time': time.monotonic()}
+
+
+def sweep_due(size):
+    """累计本进程写入缓存的数据量，判断是否需要遍历缓存目录淘汰"""
+    with _sweep_lock:
+        _sweep_state['bytes'] += size
+        now = time.monotonic()
+        if (
+            _sweep_state['bytes'] < settings.MEDIA_CACHE_MAX_BYTES * CACHE_SWEEP_FRACTION
+            and now - _sweep_state['time'] < CACHE_SWEEP_SECONDS
+        ):
+            return False
+        _sweep_state['bytes'] = 0
+        _sweep_state['time'] = now
+        return True
+
+
+def evict_cache():
+    """缓存总大小超过 MEDIA_CACHE_MAX_BYTES 时按最近访问时间删除"""
+    entries = []
+    total = 0
+    for root, _, files in os.walk(settings.MEDIA_CACHE_DIR):
+        for file_name in files:
+            if file_name.endswith('.part'):
+                continue
+            path = os.path.join(root, file_name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_atime, stat.st_size, path))
+            total += stat.st_size
+
+    if total <= settings.MEDIA_CACHE_MAX_BYTES:
+        return
+    now = time.time()
+    for accessed, size, path in sorted(entries):
+        if total <= settings.MEDIA_CACHE_MAX_BYTES:
+            break
+        if now - accessed < CACHE_GRACE_SECONDS:
+            continue
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+
+
+def read_file(name):
+    """读取存储中的小文件（缩略图）的全部内容"""
+    with default_storage.open(name, 'rb') as f:
+        return f.read()
+
+
+def copy_file(name, new_name):
+    """
+    复制存储中的文件（目标已存在时覆盖），源文件不存在时抛出 FileNotFoundError
+    本地存储使用硬链接，不复制数据；对象存储流式复制（大文件分片并行上传）
+    """
+    if is_local():
+        source, target = default_storage.path(name), default_storage.path(new_name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            os.link(source, target)
+        except FileNotFoundError:
+            raise
+        except OSError:
+            # 不支持硬链接的文件系统
+            shutil.copy2(source, target)
+        return
+    with default_storage.open(name, 'rb') as f:
+        default_storage.save(new_name, f)
+
+
+def delete_file(name):
+    """删除存储中的文件及本机缓存"""
+    if not name:
+        return
+    default_storage.delete(name)
+    if not is_local():
+        try:
+            os.remove(cache_path(name))
+        except FileNotFoundError:
+            pass
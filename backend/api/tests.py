@@ -1,3 +1,1650 @@
-from django.test import TestCase
+"""
+API 行为测试
+媒体文件与视觉特征索引写入每个测试类独立的临时目录
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from datetime import date, datetime, timezone
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import TestCase, TransactionTestCase, override_settings
+from PIL import Image as PILImage
+from PIL import ImageEnhance
+from rest_framework.test import APIClient
+
+from . import editing, storage, views, visual
+from .management.commands import regenerate_thumbnails
+from .caching import bump_library_version
+from .colors import (
+    CLUSTER_COUNT, PALETTE_BITS, classify_color, mask_to_names, palette_mask, parse_color_filter, superset_masks,
+)
+from .geo import geohash_bounds, geohash_encode
+from .geocoder import ReverseGeocoder
+from .imaging import ImageTooLarge, bounded_draft
+from .models import Image, Tag, User
+from .similarity import MAX_RADIUS, candidate_q, find_duplicate_groups, hamming
+from .storage import image_upload_to, is_sharded, thumbnail_upload_to
+from .utils import (
+    PLACEHOLDER_SIZE, build_thumbnail_spec, create_placeholder, set_coordinates, set_phash, spec_hash,
+    thumbnail_spec_hash,
+)
+
+
+def make_jpeg(size=(800, 600), color=(200, 30, 30), name='photo.jpg'):
+    """生成测试用的 JPEG 上传文件"""
+    buffer = io.BytesIO()
+    PILImage.new('RGB', size, color).save(buffer, 'JPEG')
+    buffer.seek(0)
+    buffer.name = name
+    return buffer
+
+
+class MediaTestCase(TestCase):
+    """媒体文件写入临时目录的测试基类，提供已登录的客户端和上传辅助方法"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.media_root = tempfile.mkdtemp()
+        cls.media_settings = override_settings(
+            MEDIA_ROOT=cls.media_root,
+            VISUAL_INDEX_ROOT=os.path.join(cls.media_root, 'visual_index'),
+        )
+        cls.media_settings.enable()
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        cls.media_settings.disable()
+        shutil.rmtree(cls.media_root, ignore_errors=True)
+
+    def setUp(self):
+        self.user = self.create_user('tester1')
+        self.client = self.login(self.user)
+
+    @staticmethod
+    def create_user(username):
+        return User.objects.create_user(username=username, email=f'{username}@example.com', password='pw123456')
+
+    @staticmethod
+    def login(user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client
+
+    def upload(self, client=None, title='', **kwargs):
+        """上传一张图片，返回图片ID"""
+        response = (client or self.client).post(
+            '/api/images/upload/', {'file': make_jpeg(**kwargs), 'title': title}, format='multipart'
+        )
+        self.assertEqual(response.status_code, 201)
+        return response.data['id']
+
+
+class SparseFieldsTests(MediaTestCase):
+    """稀疏字段集：fields / expand 参数"""
+
+    def setUp(self):
+        super().setUp()
+        self.image_id = self.upload(title='海边')
+
+    def test_full_output_without_fields(self):
+        result = self.client.get('/api/images/').data['results'][0]
+        self.assertIn('tags', result)
+        self.assertIn('user', result)
+        self.assertIn('file_url', result)
+
+    def test_compact_preset(self):
+        result = self.client.get('/api/images/?fields=compact').data['results'][0]
+        self.assertEqual(
+            set(result), {'id', 'thumbnail_url', 'placeholder', 'width', 'height', 'is_favorited'}
+        )
+        self.assertEqual((result['width'], result['height']), (800, 600))
+
+    def test_explicit_fields_and_expand(self):
+        result = self.client.get('/api/images/?fields=id,title&expand=tags').data['results'][0]
+        self.assertEqual(set(result), {'id', 'title', 'tags'})
+        self.assertEqual(result['title'], '海边')
+
+    def test_unknown_fields_are_ignored(self):
+        result = self.client.get(f'/api/images/{self.image_id}/?fields=id,file_path,nope').data
+        self.assertEqual(set(result), {'id'})
+
+    def test_is_favorited_reflects_current_user(self):
+        self.client.post(f'/api/images/{self.image_id}/favorite/')
+        result = self.client.get('/api/images/?fields=id,is_favorited').data['results'][0]
+        self.assertTrue(result['is_favorited'])
+
+    def test_album_compact_preset(self):
+        self.client.post('/api/albums/', {'name': '相册', 'image_ids': [self.image_id]}, format='json')
+        result = self.client.get('/api/albums/?fields=compact').data['results'][0]
+        self.assertEqual(set(result), {'id', 'name', 'image_count', 'preview_images'})
+        self.assertEqual(result['image_count'], 1)
+
+
+class AlbumImagesPaginationTests(MediaTestCase):
+    """相册内图片游标分页"""
+
+    def setUp(self):
+        super().setUp()
+        self.image_ids = [self.upload(title=f'图片{i}') for i in range(5)]
+        self.album_id = self.client.post('/api/albums/', {'name': '相册'}, format='json').data['id']
+        self.client.post(f'/api/albums/{self.album_id}/add_images/', {'image_ids': self.image_ids}, format='json')
+
+    def collect_pages(self, url):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return ids
+
+    def test_pages_cover_album_without_duplicates(self):
+        ids = self.collect_pages(f'/api/albums/{self.album_id}/images/?page_size=2&fields=compact')
+        self.assertEqual(sorted(ids), sorted(self.image_ids))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_retrieve_does_not_embed_every_image(self):
+        data = self.client.get(f'/api/albums/{self.album_id}/').data
+        self.assertNotIn('images', data)
+        self.assertEqual(data['image_count'], 5)
+
+    def test_removed_images_leave_the_listing(self):
+        self.client.post(
+            f'/api/albums/{self.album_id}/remove_images/', {'image_ids': self.image_ids[:2]}, format='json'
+        )
+        ids = self.collect_pages(f'/api/albums/{self.album_id}/images/')
+        self.assertEqual(sorted(ids), sorted(self.image_ids[2:]))
+
+    def test_other_users_album_is_not_found(self):
+        other = self.login(self.create_user('tester2'))
+        self.assertEqual(other.get(f'/api/albums/{self.album_id}/images/').status_code, 404)
+
+
+class AlbumViewSetTests(MediaTestCase):
+    """相册：列表预览图、相册内图片游标分页、批量添加/移除图片"""
+
+    def create_album(self, name, image_ids):
+        album_id = self.client.post('/api/albums/', {'name': name}, format='json').data['id']
+        if image_ids:
+            self.client.post(f'/api/albums/{album_id}/add_images/', {'image_ids': image_ids}, format='json')
+        return album_id
+
+    def test_preview_images_are_newest_per_album(self):
+        image_ids = [self.upload(title=f'图片{i}') for i in range(6)]
+        first = self.create_album('相册1', image_ids)
+        second = self.create_album('相册2', image_ids[:2])
+        self.create_album('空相册', [])
+
+        results = {album['id']: album for album in self.client.get('/api/albums/').data['results']}
+        self.assertEqual(len(results), 3)
+        # 每个相册最多 4 张预览图，按上传时间倒序
+        self.assertEqual([image['id'] for image in results[first]['preview_images']], image_ids[:1:-1])
+        self.assertEqual([image['id'] for image in results[second]['preview_images']], image_ids[1::-1])
+        self.assertEqual(results[first]['image_count'], 6)
+        self.assertEqual([album['preview_images'] for album in results.values() if album['name'] == '空相册'], [[]])
+
+    def test_album_list_query_count_does_not_grow_with_albums(self):
+        image_ids = [self.upload() for _ in range(3)]
+        for i in range(5):
+            self.create_album(f'相册{i}', image_ids)
+        # 分页计数、相册（含图片数）、全部预览图、预览图标签各一次查询
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/albums/')
+        self.assertEqual(len(response.data['results']), 5)
+        for album in response.data['results']:
+            self.assertEqual(len(album['preview_images']), 3)
+        # compact 模式下预览图不输出标签
+        with self.assertNumQueries(3):
+            self.client.get('/api/albums/?fields=compact')
+
+    def test_images_are_ordered_by_added_time(self):
+        image_ids = [self.upload() for _ in range(4)]
+        album_id = self.create_album('相册', image_ids[2:])
+        self.client.post(f'/api/albums/{album_id}/add_images/', {'image_ids': image_ids[:2]}, format='json')
+
+        response = self.client.get(f'/api/albums/{album_id}/images/?page_size=3&fields=id,added_at')
+        self.assertEqual([item['id'] for item in response.data['results']], [image_ids[1], image_ids[0], image_ids[3]])
+        self.assertIsNone(response.data.get('previous'))
+        response = self.client.get(response.data['next'])
+        self.assertEqual([item['id'] for item in response.data['results']], [image_ids[2]])
+        self.assertIsNone(response.data['next'])
+
+    def test_add_and_remove_counts(self):
+        image_ids = [self.upload() for _ in range(3)]
+        other_image = self.upload(client=self.login(self.create_user('tester2')))
+        album_id = self.create_album('相册', image_ids[:2])
+
+        # 已在相册中的图片与其他用户的图片跳过
+        response = self.client.post(
+            f'/api/albums/{album_id}/add_images/',
+            {'image_ids': [image_ids[1], image_ids[2], other_image, 999999]}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            (response.data['added'], response.data['added_ids'], response.data['image_count']), (1, [image_ids[2]], 3)
+        )
+
+        response = self.client.post(
+            f'/api/albums/{album_id}/remove_images/', {'image_ids': [image_ids[0], other_image]}, format='json'
+        )
+        self.assertEqual((response.data['removed'], response.data['image_count']), (1, 2))
+
+        for action in ('add_images', 'remove_images'):
+            with self.subTest(action=action):
+                response = self.client.post(f'/api/albums/{album_id}/{action}/', {'image_ids': []}, format='json')
+                self.assertEqual(response.status_code, 400)
+
+
+class FavoritesPaginationTests(MediaTestCase):
+    """收藏列表：数据库分页（按收藏时间倒序），支持图库的过滤参数"""
+
+    def setUp(self):
+        super().setUp()
+        self.image_ids = [self.upload(size=(800 + i * 100, 600)) for i in range(6)]
+        self.favorited = [self.image_ids[i] for i in (2, 0, 4, 5)]
+        for image_id in self.favorited:
+            self.client.post(f'/api/images/{image_id}/favorite/')
+
+    def test_pages_follow_favorite_order(self):
+        ids = []
+        url = '/api/images/favorites/?page_size=3&fields=id'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 3)
+            ids.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, list(reversed(self.favorited)))
+
+    def test_filters_apply_to_favorites(self):
+        response = self.client.get('/api/images/favorites/?min_width=1200&fields=id')
+        self.assertEqual(
+            sorted(item['id'] for item in response.data['results']),
+            sorted([self.image_ids[4], self.image_ids[5]])
+        )
+
+    def test_unfavorite_removes_from_listing(self):
+        self.client.post(f'/api/images/{self.favorited[0]}/unfavorite/')
+        response = self.client.get('/api/images/favorites/?fields=id')
+        self.assertNotIn(self.favorited[0], [item['id'] for item in response.data['results']])
+
+    def test_favorites_are_per_user(self):
+        other = self.login(self.create_user('tester2'))
+        self.assertEqual(other.get('/api/images/favorites/').data['results'], [])
+
+
+class GeoTestCase(MediaTestCase):
+    """准备一组带坐标的图片"""
+    POINTS = {
+        'beijing': (39.9042, 116.4074),
+        'tianjin': (39.3434, 117.3616),
+        'tokyo': (35.6762, 139.6503),
+        'fiji': (-17.7, 179.9),
+        'samoa': (-13.8, -172.1),
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.names = {}
+        for name, (lat, lon) in self.POINTS.items():
+            image = Image(user=self.user, title=name, file_path=f'images/{name}.jpg')
+            set_coordinates(image, lat, lon)
+            image.save()
+            self.names[image.id] = name
+        # 没有坐标的图片不参与地理过滤
+        Image.objects.create(user=self.user, title='unknown', file_path='images/unknown.jpg')
+
+
+class GeoFilterTests(GeoTestCase):
+    """地理过滤：bbox 边界框（含跨越180度经线）与 near/radius_km 距离过滤"""
+
+    def filtered(self, query):
+        response = self.client.get(f'/api/images/?fields=id&{query}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(self.names[item['id']] for item in response.data['results'])
+
+    def test_bbox(self):
+        self.assertEqual(self.filtered('bbox=115,39,118,41'), ['beijing', 'tianjin'])
+
+    def test_bbox_across_antimeridian(self):
+        self.assertEqual(self.filtered('bbox=170,-20,-170,-10'), ['fiji', 'samoa'])
+
+    def test_radius(self):
+        self.assertEqual(self.filtered('near=39.9,116.4&radius_km=150'), ['beijing', 'tianjin'])
+        self.assertEqual(self.filtered('near=39.9,116.4&radius_km=50'), ['beijing'])
+
+    def test_malformed_parameters_are_rejected(self):
+        for query in (
+            'bbox=abc', 'bbox=1,2,3', 'bbox=0,95,10,96', 'bbox=0,nan,10,10',
+            'near=39.9&radius_km=10', 'near=39.9,116.4&radius_km=abc', 'near=39.9,116.4&radius_km=-1',
+        ):
+            with self.subTest(query=query):
+                response = self.client.get(f'/api/images/?{query}')
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('error', response.data)
+
+
+class GeoClusterTests(GeoTestCase):
+    """地图聚合：按缩放级别的 geohash 格子分组计数"""
+
+    def clusters(self, query):
+        response = self.client.get(f'/api/images/geo_clusters/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data['clusters']
+
+    def test_counts_inside_bbox(self):
+        clusters = self.clusters('zoom=3&bbox=115,39,118,41')
+        self.assertEqual(sum(cluster['count'] for cluster in clusters), 2)
+
+    def test_cells_outside_bbox_are_dropped(self):
+        lat, lon = self.POINTS['beijing']
+        min_lat, min_lon, max_lat, max_lon = geohash_bounds(geohash_encode(lat, lon, 5))
+        # 同一瓦片中离北京最远的角落（缩放级别 14 的格子精度为 6，瓦片精度为 5）
+        image = Image(user=self.user, title='nearby', file_path='images/nearby.jpg')
+        set_coordinates(
+            image,
+            min_lat + 1e-6 if lat > (min_lat + max_lat) / 2 else max_lat - 1e-6,
+            min_lon + 1e-6 if lon > (min_lon + max_lon) / 2 else max_lon - 1e-6,
+        )
+        image.save()
+
+        bbox = f'{lon - 0.001},{lat - 0.001},{lon + 0.001},{lat + 0.001}'
+        clusters = self.clusters(f'zoom=14&bbox={bbox}')
+        self.assertEqual([cluster['geohash'] for cluster in clusters], [geohash_encode(lat, lon, 6)])
+        self.assertEqual(clusters[0]['count'], 1)
+        # 瓦片缓存命中时同样过滤
+        self.assertEqual(self.clusters(f'zoom=14&bbox={bbox}'), clusters)
+
+    def test_zoom_is_clamped(self):
+        self.assertEqual(
+            self.client.get('/api/images/geo_clusters/?zoom=99').data['precision'],
+            self.client.get('/api/images/geo_clusters/?zoom=20').data['precision'],
+        )
+        self.assertEqual(self.client.get('/api/images/geo_clusters/?zoom=99').data['zoom'], 20)
+        self.assertEqual(self.client.get('/api/images/geo_clusters/?zoom=-5').data['zoom'], 0)
+        self.assertEqual(sum(cluster['count'] for cluster in self.clusters('zoom=-5')), len(self.POINTS))
+
+    def test_malformed_parameters_are_rejected(self):
+        for query in ('zoom=abc', 'zoom=3&bbox=1,a,2,3', 'zoom=3&bbox=1,2'):
+            with self.subTest(query=query):
+                self.assertEqual(self.client.get(f'/api/images/geo_clusters/?{query}').status_code, 400)
+
+
+class EditStackTests(MediaTestCase):
+    """非破坏性编辑：编辑步骤、撤销、重做与恢复原图，原图文件保持不变"""
+
+    def setUp(self):
+        super().setUp()
+        self.image_id = self.upload(size=(800, 600))
+        self.original_name = Image.objects.get(id=self.image_id).file_path.name
+        self.original_digest = self.digest(self.original_name)
+
+    @staticmethod
+    def digest(name):
+        with default_storage.open(name, 'rb') as f:
+            return hashlib.md5(f.read()).hexdigest()
+
+    def post(self, action, operations=None):
+        data = {'operations': operations} if operations is not None else {}
+        return self.client.post(f'/api/images/{self.image_id}/{action}/', data, format='json')
+
+    def test_edit_undo_redo_revert(self):
+        response = self.post('edit', {'crop': {'left': 100, 'top': 50, 'right': 500, 'bottom': 350}})
+        self.assertEqual((response.data['width'], response.data['height'], response.data['edit_index']), (400, 300, 1))
+        response = self.post('edit', {'rotate': 90})
+        self.assertEqual((response.data['width'], response.data['height'], response.data['edit_index']), (300, 400, 2))
+
+        response = self.post('undo')
+        self.assertEqual((response.data['width'], response.data['height'], response.data['edit_index']), (400, 300, 1))
+        response = self.post('redo')
+        self.assertEqual((response.data['width'], response.data['height'], response.data['edit_index']), (300, 400, 2))
+        self.assertEqual(self.post('redo').status_code, 400)
+
+        response = self.post('revert')
+        self.assertEqual((response.data['width'], response.data['height'], response.data['edit_index']), (800, 600, 0))
+        # 恢复原图保留编辑步骤，可以重做
+        self.assertEqual(len(response.data['edit_stack']), 2)
+        self.assertEqual(self.post('undo').status_code, 400)
+        self.assertEqual(self.post('redo').data['edit_index'], 1)
+
+        image = Image.objects.get(id=self.image_id)
+        self.assertEqual(image.file_path.name, self.original_name)
+        self.assertEqual(self.digest(self.original_name), self.original_digest)
+
+    def test_edit_after_undo_discards_redo_steps(self):
+        self.post('edit', {'rotate': 90})
+        self.post('edit', {'brightness': 1.2})
+        self.post('undo')
+        response = self.post('edit', {'contrast': 1.1})
+        self.assertEqual(response.data['edit_index'], 2)
+        self.assertEqual(len(response.data['edit_stack']), 2)
+        self.assertEqual(self.post('redo').status_code, 400)
+
+    def test_revert_unedited_image_is_rejected(self):
+        self.assertEqual(self.post('revert').status_code, 400)
+
+    def test_invalid_operations_are_rejected(self):
+        crop = {'left': 0, 'top': 0, 'right': 9000, 'bottom': 10}
+        self.assertEqual(self.post('edit', {'crop': crop}).status_code, 400)
+        self.assertEqual(self.post('edit', {'unknown': 1}).status_code, 400)
+        self.assertEqual(Image.objects.get(id=self.image_id).edit_index, 0)
+
+    def test_noop_edit_returns_image_unchanged(self):
+        before = Image.objects.get(id=self.image_id)
+        for operations in ({'rotate': 0, 'brightness': 1.0}, {}):
+            with self.subTest(operations=operations):
+                response = self.post('edit', operations)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual((response.data['width'], response.data['edit_index']), (800, 0))
+        image = Image.objects.get(id=self.image_id)
+        self.assertEqual(image.edit_stack, before.edit_stack)
+        self.assertEqual(image.thumbnail_path.name, before.thumbnail_path.name)
+
+    def test_replaced_thumbnail_is_deleted(self):
+        old_thumbnail = Image.objects.get(id=self.image_id).thumbnail_path.name
+        self.post('edit', {'rotate': 90})
+        new_thumbnail = Image.objects.get(id=self.image_id).thumbnail_path.name
+        self.assertNotEqual(new_thumbnail, old_thumbnail)
+        self.assertTrue(default_storage.exists(new_thumbnail))
+        self.assertFalse(default_storage.exists(old_thumbnail))
+
+    def test_rendition_reflects_edit_state(self):
+        self.post('edit', {'rotate': 90})
+        response = self.client.get(f'/api/images/{self.image_id}/rendition/')
+        self.assertEqual(response.status_code, 200)
+        content = b''.join(response.streaming_content)
+        self.assertEqual(PILImage.open(io.BytesIO(content)).size, (600, 800))
+
+
+class InlineExecutor:
+    """在当前线程中依次执行任务的执行器（替代进程池，任务可以访问测试事务中的数据）"""
+
+    def __init__(self, max_workers=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def map(self, fn, iterable, chunksize=1):
+        return map(fn, iterable)
+
+
+@mock.patch.object(views, 'ProcessPoolExecutor', InlineExecutor)
+class BatchEditTests(MediaTestCase):
+    """批量编辑：逐张报告失败原因，并发修改过的图片不被覆盖"""
+
+    def setUp(self):
+        super().setUp()
+        self.large_id = self.upload(size=(800, 600))
+        self.small_id = self.upload(size=(300, 200))
+
+    def batch_edit(self, image_ids, operations):
+        return self.client.post(
+            '/api/images/batch_edit/?fields=id,width,height', {'image_ids': image_ids, 'operations': operations},
+            format='json'
+        )
+
+    def test_edits_all_images(self):
+        response = self.batch_edit([self.large_id, self.small_id], {'rotate': 90})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['edited'], response.data['failed']), (2, 0))
+        sizes = {item['id']: (item['width'], item['height']) for item in response.data['images']}
+        self.assertEqual(sizes, {self.large_id: (600, 800), self.small_id: (200, 300)})
+
+    def test_reports_per_image_errors(self):
+        other = self.create_user('tester2')
+        other_id = self.upload(client=self.login(other))
+        crop = {'left': 0, 'top': 0, 'right': 500, 'bottom': 100}
+        response = self.batch_edit([self.large_id, self.small_id, other_id, 999999], {'crop': crop})
+        self.assertEqual((response.data['edited'], response.data['failed']), (1, 3))
+        errors = {error['id']: error['error'] for error in response.data['errors']}
+        self.assertEqual(set(errors), {self.small_id, other_id, 999999})
+        self.assertEqual(errors[other_id], '图片不存在或没有权限')
+        self.assertEqual(Image.objects.get(id=self.small_id).edit_index, 0)
+        self.assertEqual(Image.objects.get(id=other_id).edit_index, 0)
+
+    def test_invalid_requests_are_rejected(self):
+        self.assertEqual(self.batch_edit([], {'rotate': 90}).status_code, 400)
+        self.assertEqual(self.batch_edit(['abc'], {'rotate': 90}).status_code, 400)
+        self.assertEqual(self.batch_edit([self.large_id], {'unknown': 1}).status_code, 400)
+        with self.settings(BATCH_EDIT_MAX_IMAGES=1):
+            self.assertEqual(self.batch_edit([self.large_id, self.small_id], {'rotate': 90}).status_code, 400)
+
+    def test_concurrent_edit_is_not_overwritten(self):
+        batch_edit_image = views.batch_edit_image
+
+        discarded = []
+
+        def racing(job):
+            result = batch_edit_image(job)
+            if job[0].id == self.large_id:
+                discarded.append(result[2][0].thumbnail_path.name)
+                # 批量编辑生成结果期间，图片被单独编辑
+                self.client.post(f'/api/images/{self.large_id}/edit/', {'operations': {'rotate': 180}}, format='json')
+            return result
+
+        with mock.patch.object(views, 'batch_edit_image', racing):
+            response = self.batch_edit([self.large_id, self.small_id], {'brightness': 1.2})
+        self.assertEqual((response.data['edited'], response.data['failed']), (1, 1))
+        self.assertEqual(response.data['errors'], [{'id': self.large_id, 'error': '图片已被修改，请重试'}])
+
+        image = Image.objects.get(id=self.large_id)
+        self.assertEqual([list(step) for step in image.edit_stack], [['rotate']])
+        self.assertTrue(default_storage.exists(image.thumbnail_path.name))
+        # 放弃的批量编辑结果不留下缩略图文件
+        self.assertFalse(default_storage.exists(discarded[0]))
+        self.assertEqual(Image.objects.get(id=self.small_id).edit_index, 1)
+
+
+class MediaEndpointTests(MediaTestCase):
+    """媒体文件接口：只有图片所有者可以访问，其他用户得到 404，响应不暴露存储路径"""
+
+    def setUp(self):
+        super().setUp()
+        self.image_id = self.upload()
+        self.urls = [
+            f'/api/images/{self.image_id}/original/',
+            f'/api/images/{self.image_id}/thumbnail/',
+            f'/api/images/{self.image_id}/rendition/',
+        ]
+
+    def test_owner_can_fetch_media(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response['Content-Type'], 'image/jpeg')
+                self.assertTrue(response['Cache-Control'].startswith('private'))
+
+    def test_other_user_gets_404(self):
+        other = self.login(self.create_user('tester2'))
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertEqual(other.get(url).status_code, 404)
+
+    def test_anonymous_user_is_rejected(self):
+        for url in self.urls:
+            with self.subTest(url=url):
+                self.assertIn(APIClient().get(url).status_code, (401, 403))
+
+    def test_conditional_request(self):
+        response = self.client.get(self.urls[1])
+        cached = self.client.get(self.urls[1], HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(cached.status_code, 304)
+
+    def test_versioned_thumbnail_url_is_immutable(self):
+        thumbnail_url = self.client.get(f'/api/images/{self.image_id}/').data['thumbnail_url']
+        self.assertIn('?v=', thumbnail_url)
+        self.assertIn('immutable', self.client.get(thumbnail_url)['Cache-Control'])
+
+    def test_thumbnail_url_changes_after_edit(self):
+        before = self.client.get(f'/api/images/{self.image_id}/').data['thumbnail_url']
+        response = self.client.post(
+            f'/api/images/{self.image_id}/edit/', {'operations': {'brightness': 1.3}}, format='json'
+        )
+        after = response.data['thumbnail_url']
+        self.assertNotEqual(after, before)
+        self.assertEqual(self.client.get(f'/api/images/{self.image_id}/').data['thumbnail_url'], after)
+        self.assertIn('immutable', self.client.get(after)['Cache-Control'])
+        # 旧地址的指纹与当前缩略图不一致，只能协商缓存
+        self.assertEqual(self.client.get(before)['Cache-Control'], 'private, no-cache')
+
+    def test_immutable_only_on_fingerprinted_urls(self):
+        thumbnail_url = f'/api/images/{self.image_id}/thumbnail/'
+        for url in (thumbnail_url, thumbnail_url + '?v=000000000000'):
+            with self.subTest(url=url):
+                self.assertEqual(self.client.get(url)['Cache-Control'], 'private, no-cache')
+
+        # 早期生成的缩略图文件名没有指纹，地址不带版本参数，也不长期缓存
+        image = Image.objects.get(id=self.image_id)
+        legacy = default_storage.save('thumbnails/thumb_legacy.jpg', default_storage.open(image.thumbnail_path.name))
+        Image.objects.filter(id=self.image_id).update(thumbnail_path=legacy)
+        self.assertTrue(self.client.get(f'/api/images/{self.image_id}/').data['thumbnail_url'].endswith(thumbnail_url))
+        self.assertEqual(self.client.get(thumbnail_url + '?v=anything')['Cache-Control'], 'private, no-cache')
+
+    def test_rendition_is_immutable_only_for_current_edit(self):
+        self.client.post(f'/api/images/{self.image_id}/edit/', {'operations': {'rotate': 90}}, format='json')
+        edit_hash = Image.objects.get(id=self.image_id).edit_hash
+        url = f'/api/images/{self.image_id}/rendition/'
+        self.assertIn('immutable', self.client.get(f'{url}?v={edit_hash}')['Cache-Control'])
+        self.assertEqual(self.client.get(url)['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get(f'{url}?v=stale')['Cache-Control'], 'private, no-cache')
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/')
+    def test_accel_redirect(self):
+        response = self.client.get(self.urls[0])
+        name = Image.objects.get(id=self.image_id).file_path.name
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + name)
+        self.assertEqual(response.content, b'')
+
+    def test_storage_paths_are_not_exposed(self):
+        data = self.client.get(f'/api/images/{self.image_id}/').data
+        self.assertNotIn('file_path', data)
+        self.assertNotIn('thumbnail_path', data)
+        name = Image.objects.get(id=self.image_id).file_path.name
+        self.assertNotIn(name, str(data))
+
+
+class ShardedLayoutTests(MediaTestCase):
+    """媒体文件分散目录布局（<目录>/ab/cd/<随机键>）与 shard_media 迁移命令"""
+
+    def test_upload_to_names(self):
+        name = image_upload_to(None, 'Photo.JPG')
+        self.assertTrue(name.startswith('images/'))
+        self.assertTrue(name.endswith('.jpg'))
+        self.assertTrue(is_sharded(name))
+        self.assertNotEqual(name, image_upload_to(None, 'Photo.JPG'))
+
+        thumbnail = thumbnail_upload_to(None, 'thumb_a.0123456789ab_AbC12xy.jpg')
+        self.assertTrue(is_sharded(thumbnail))
+        self.assertTrue(thumbnail.endswith('.0123456789ab.jpg'))
+        self.assertFalse(is_sharded('images/2025/01/01/a.jpg'))
+
+    def test_upload_is_sharded_without_exists_checks(self):
+        exists_method = FileSystemStorage.exists
+        with mock.patch.object(FileSystemStorage, 'exists', autospec=True, side_effect=exists_method) as exists:
+            image_id = self.upload()
+        self.assertFalse(exists.called)
+        image = Image.objects.get(id=image_id)
+        self.assertTrue(is_sharded(image.file_path.name))
+        self.assertTrue(is_sharded(image.thumbnail_path.name))
+
+    def test_shard_media_moves_legacy_files(self):
+        image_id = self.upload()
+        image = Image.objects.get(id=image_id)
+        legacy_file = default_storage.save('images/2025/01/01/p.jpg', ContentFile(image.file_path.read()))
+        legacy_thumbnail = default_storage.save(
+            'thumbnails/2025/01/01/thumb_p.0123456789ab.jpg', ContentFile(image.thumbnail_path.read())
+        )
+        Image.objects.filter(id=image_id).update(file_path=legacy_file, thumbnail_path=legacy_thumbnail)
+
+        call_command('shard_media', workers=2, batch_size=1, stdout=io.StringIO())
+
+        image = Image.objects.get(id=image_id)
+        self.assertTrue(is_sharded(image.file_path.name))
+        self.assertTrue(is_sharded(image.thumbnail_path.name))
+        self.assertTrue(image.thumbnail_path.name.endswith('.0123456789ab.jpg'))
+        self.assertTrue(default_storage.exists(image.file_path.name))
+        self.assertFalse(default_storage.exists(legacy_file))
+        self.assertFalse(default_storage.exists(legacy_thumbnail))
+        self.assertEqual(self.client.get(f'/api/images/{image_id}/original/').status_code, 200)
+
+        # 再次运行时已迁移的文件被跳过
+        call_command('shard_media', stdout=io.StringIO())
+        self.assertEqual(Image.objects.get(id=image_id).file_path.name, image.file_path.name)
+
+
+class ReverseGeocoderTests(TestCase):
+    """离线逆地理编码：城市国家不被归入邻国，海上的点没有结果"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.geocoder = ReverseGeocoder()
+
+    def country(self, lat, lon):
+        result = self.geocoder.lookup(lat, lon)
+        return result and result['country_code']
+
+    def test_city_states(self):
+        self.assertEqual(self.country(1.29, 103.85), 'SGP')
+        self.assertEqual(self.country(43.7384, 7.4246), 'MCO')
+        self.assertEqual(self.country(41.9029, 12.4534), 'VAT')
+
+    def test_neighbours(self):
+        self.assertEqual(self.country(1.4655, 103.7578), 'MYS')
+        self.assertEqual(self.country(43.70, 7.27), 'FRA')
+        self.assertEqual(self.country(41.89, 12.49), 'ITA')
+
+    def test_open_sea(self):
+        self.assertIsNone(self.country(0.0, -30.0))
+
+
+class SimilarityTests(MediaTestCase):
+    """感知哈希近似重复：分段索引取候选的召回与暴力汉明距离扫描一致，radius 限制在 MAX_RADIUS 以内"""
+
+    def setUp(self):
+        super().setUp()
+        rng = random.Random(42)
+        self.base = rng.getrandbits(64)
+        self.hashes = {}
+        # 与基准哈希相差 0~12 位的图片，以及随机哈希
+        values = [self.flip(rng, self.base, distance) for distance in range(13) for _ in range(3)]
+        values += [rng.getrandbits(64) for _ in range(20)]
+        for value in values:
+            image = Image(user=self.user, file_path='images/x.jpg')
+            set_phash(image, value)
+            image.save()
+            self.hashes[image.id] = value
+        self.query_id = next(image_id for image_id, value in self.hashes.items() if value == self.base)
+
+    @staticmethod
+    def flip(rng, value, bits):
+        for bit in rng.sample(range(64), bits):
+            value ^= 1 << bit
+        return value
+
+    def test_candidate_recall_matches_brute_force(self):
+        for radius in range(MAX_RADIUS + 1):
+            with self.subTest(radius=radius):
+                candidates = set(
+                    Image.objects.filter(candidate_q(self.base, radius)).values_list('id', flat=True)
+                )
+                expected = {
+                    image_id for image_id, value in self.hashes.items() if hamming(self.base, value) <= radius
+                }
+                self.assertTrue(expected <= candidates)
+
+    def test_duplicate_groups_match_brute_force(self):
+        items = list(self.hashes.items())
+        for radius in (0, 4, MAX_RADIUS):
+            with self.subTest(radius=radius):
+                # 暴力两两比较后按连通分量合并
+                parent = {image_id: image_id for image_id, _ in items}
+
+                def find(image_id):
+                    while parent[image_id] != image_id:
+                        image_id = parent[image_id]
+                    return image_id
+
+                for (a, hash_a), (b, hash_b) in ((x, y) for i, x in enumerate(items) for y in items[i + 1:]):
+                    if hamming(hash_a, hash_b) <= radius:
+                        parent[find(b)] = find(a)
+                expected = {}
+                for image_id, _ in items:
+                    expected.setdefault(find(image_id), []).append(image_id)
+                expected = sorted(sorted(group) for group in expected.values() if len(group) > 1)
+                self.assertEqual(sorted(find_duplicate_groups(items, radius)), expected)
+
+    def test_similar_endpoint(self):
+        response = self.client.get(f'/api/images/{self.query_id}/similar/?radius=6&fields=id')
+        self.assertEqual(response.status_code, 200)
+        expected = sorted(
+            (hamming(self.base, value), image_id) for image_id, value in self.hashes.items()
+            if image_id != self.query_id and hamming(self.base, value) <= 6
+        )
+        self.assertEqual([(item['distance'], item['id']) for item in response.data['results']], expected)
+
+    def test_radius_is_capped(self):
+        response = self.client.get(f'/api/images/{self.query_id}/similar/?radius=50')
+        self.assertEqual(response.data['radius'], MAX_RADIUS)
+        self.assertEqual(self.client.get('/api/images/duplicates/?radius=50').data['radius'], MAX_RADIUS)
+
+    def test_duplicates_endpoint(self):
+        response = self.client.get('/api/images/duplicates/?radius=4&fields=id')
+        self.assertEqual(response.status_code, 200)
+        groups = sorted(sorted(item['id'] for item in group['images']) for group in response.data['groups'])
+        self.assertEqual(groups, sorted(find_duplicate_groups(list(self.hashes.items()), 4)))
+
+    def test_invalid_radius_is_rejected(self):
+        self.assertEqual(self.client.get(f'/api/images/{self.query_id}/similar/?radius=abc').status_code, 400)
+        self.assertEqual(self.client.get('/api/images/duplicates/?radius=abc').status_code, 400)
+
+
+class VisualIndexTests(MediaTestCase):
+    """视觉特征索引：追加、原地更新、删除标记、重建与检索（直接读写不属于任何用户的索引）"""
+    INDEX_USER = 999999
+
+    def setUp(self):
+        super().setUp()
+        shutil.rmtree(os.path.join(self.media_root, 'visual_index'), ignore_errors=True)
+        visual.index_cache.entries.clear()
+        rng = np.random.default_rng(0)
+        self.vectors = {
+            image_id: visual._normalize(rng.random(visual.DIMENSIONS).astype(np.float32))
+            for image_id in range(1, 6)
+        }
+        for image_id, vector in self.vectors.items():
+            visual.update_vector(self.INDEX_USER, image_id, vector)
+
+    def search(self, vector, k=3, exclude=()):
+        return visual.load_index(self.INDEX_USER).search(vector, k, exclude)
+
+    def test_append_and_search(self):
+        index = visual.load_index(self.INDEX_USER)
+        self.assertEqual(list(index.ids), [1, 2, 3, 4, 5])
+        matches = self.search(self.vectors[3])
+        self.assertEqual(matches[0][0], 3)
+        self.assertAlmostEqual(matches[0][1], 1.0, places=2)
+        # 与暴力计算的余弦相似度排序一致（float16 存储，允许小的误差）
+        expected = sorted(self.vectors, key=lambda image_id: -float(self.vectors[image_id] @ self.vectors[3]))
+        self.assertEqual([image_id for image_id, _ in self.search(self.vectors[3], k=5)], expected)
+
+    def test_update_in_place(self):
+        visual.update_vector(self.INDEX_USER, 3, self.vectors[1])
+        index = visual.load_index(self.INDEX_USER)
+        self.assertEqual(len(index.ids), 5)
+        np.testing.assert_allclose(index.get_vector(3), self.vectors[1], atol=1e-3)
+
+    def test_remove_marks_row_deleted(self):
+        visual.remove_vector(self.INDEX_USER, 2)
+        index = visual.load_index(self.INDEX_USER)
+        self.assertEqual(list(index.ids), [1, 0, 3, 4, 5])
+        self.assertIsNone(index.get_vector(2))
+        self.assertNotIn(2, [image_id for image_id, _ in self.search(self.vectors[2], k=5)])
+        self.assertNotEqual(self.search(self.vectors[1], k=1, exclude={1})[0][0], 1)
+
+    def test_rebuild_replaces_index(self):
+        old_index = visual.load_index(self.INDEX_USER)
+        visual.write_index(self.INDEX_USER, [1, 4], np.stack([self.vectors[1], self.vectors[4]]))
+        index = visual.load_index(self.INDEX_USER)
+        self.assertEqual(list(index.ids), [1, 4])
+        # 之前加载的索引仍然指向替换前的文件，内容前后一致
+        self.assertEqual(len(old_index.ids), 5)
+        np.testing.assert_allclose(old_index.get_vector(5), self.vectors[5], atol=1e-3)
+
+        visual.update_vector(self.INDEX_USER, 9, self.vectors[5])
+        self.assertEqual(list(visual.load_index(self.INDEX_USER).ids), [1, 4, 9])
+        self.assertEqual(self.search(self.vectors[5], k=1)[0][0], 9)
+
+    def test_partial_write_is_ignored(self):
+        _, ids_path, _ = visual._paths(self.INDEX_USER)
+        with open(ids_path, 'ab') as f:
+            f.write(b'\x01\x02\x03')
+        self.assertEqual(list(visual.load_index(self.INDEX_USER).ids), [1, 2, 3, 4, 5])
+        visual.update_vector(self.INDEX_USER, 6, self.vectors[1])
+        self.assertEqual(list(visual.load_index(self.INDEX_USER).ids), [1, 2, 3, 4, 5, 6])
+
+    def test_cache_is_bounded(self):
+        cache = visual.IndexCache(2)
+        for key in ('a', 'b', 'c'):
+            cache.put(key, key)
+        self.assertIsNone(cache.get('a'))
+        cache.get('b')
+        cache.put('d', 'd')
+        self.assertEqual(list(cache.entries), ['b', 'd'])
+
+
+class VisualSimilarEndpointTests(MediaTestCase):
+    """以图搜图接口"""
+
+    def test_visual_similar(self):
+        first = self.upload(color=(200, 30, 30))
+        self.upload(color=(30, 30, 200))
+        similar = self.upload(color=(190, 40, 30))
+        response = self.client.get(f'/api/images/{first}/visual_similar/?k=1&fields=id')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([item['id'] for item in response.data['results']], [similar])
+        self.assertEqual(self.client.get(f'/api/images/{first}/visual_similar/?k=abc').status_code, 400)
+
+
+class RemoteStorageTests(MediaTestCase):
+    """非本地存储（内存存储代替对象存储）：需要本地文件的处理经本机缓存目录完成"""
+
+    def setUp(self):
+        super().setUp()
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir, ignore_errors=True)
+        remote = override_settings(
+            STORAGES={
+                'default': {'BACKEND': 'django.core.files.storage.InMemoryStorage'},
+                'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+            },
+            MEDIA_CACHE_DIR=self.cache_dir,
+        )
+        remote.enable()
+        self.addCleanup(remote.disable)
+
+    def test_upload_and_serve(self):
+        self.assertFalse(storage.is_local())
+        image_id = self.upload(size=(640, 480))
+        image = Image.objects.get(id=image_id)
+        self.assertTrue(is_sharded(image.file_path.name))
+        self.assertEqual((image.width, image.height), (640, 480))
+        for url in (f'/api/images/{image_id}/original/', f'/api/images/{image_id}/thumbnail/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(b''.join(response.streaming_content))
+
+    def test_local_path_downloads_once(self):
+        name = default_storage.save('images/a.jpg', ContentFile(b'original'))
+        with mock.patch.object(default_storage, 'exists') as exists, \
+                mock.patch.object(default_storage, 'open', wraps=default_storage.open) as opened:
+            path = storage.local_path(name)
+            self.assertEqual(storage.local_path(name), path)
+        self.assertFalse(exists.called)
+        self.assertEqual(opened.call_count, 1)
+        self.assertTrue(path.startswith(self.cache_dir))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'original')
+        self.assertEqual(os.stat(path).st_mtime, default_storage.get_modified_time(name).timestamp())
+
+        storage.delete_file(name)
+        self.assertFalse(os.path.exists(path))
+
+    def test_missing_file(self):
+        with self.assertRaises(FileNotFoundError):
+            storage.local_path('images/missing.jpg')
+        self.assertEqual(self.client.get('/api/images/999999/original/').status_code, 404)
+
+    def test_missing_error_from_s3(self):
+        error = Exception()
+        error.response = {'Error': {'Code': '404'}}
+        self.assertTrue(storage.is_missing(error))
+        error.response = {'Error': {'Code': 'AccessDenied'}}
+        self.assertFalse(storage.is_missing(error))
+
+    def test_eviction_runs_only_when_due(self):
+        storage._sweep_state.update(bytes=0, time=time.monotonic())
+        with mock.patch.object(storage, 'evict_cache') as evict:
+            with self.settings(MEDIA_CACHE_MAX_BYTES=1024 ** 3):
+                for i in range(3):
+                    storage.local_path(default_storage.save(f'images/{i}.jpg', ContentFile(b'x' * 100)))
+                self.assertFalse(evict.called)
+            with self.settings(MEDIA_CACHE_MAX_BYTES=1000):
+                storage.local_path(default_storage.save('images/big.jpg', ContentFile(b'x' * 100)))
+                self.assertEqual(evict.call_count, 1)
+
+    def test_eviction_removes_least_recently_used(self):
+        paths = []
+        for i in range(3):
+            paths.append(storage.local_path(default_storage.save(f'images/{i}.jpg', ContentFile(b'x' * 100))))
+            # 超过保护期的访问时间，越早写入越早淘汰
+            os.utime(paths[-1], (time.time() - 3600 + i, os.stat(paths[-1]).st_mtime))
+        with self.settings(MEDIA_CACHE_MAX_BYTES=150):
+            storage.evict_cache()
+        self.assertEqual([os.path.exists(path) for path in paths], [False, False, True])
+
+
+@mock.patch.object(regenerate_thumbnails, 'ProcessPoolExecutor', InlineExecutor)
+class RegenerateThumbnailsTests(MediaTestCase):
+    """重新生成缩略图命令：按ID分批、断点续传、--outdated、--watch 与并发修改检测"""
+
+    def setUp(self):
+        super().setUp()
+        self.image_ids = [self.upload(size=(320 + i, 240)) for i in range(5)]
+        self.checkpoint = os.path.join(self.media_root, 'regenerate.json')
+
+    def run_command(self, *args):
+        out = io.StringIO()
+        call_command(
+            'regenerate_thumbnails', '--checkpoint', self.checkpoint, '--workers', '1', *args, stdout=out
+        )
+        return out.getvalue()
+
+    def thumbnails(self):
+        return dict(Image.objects.order_by('id').values_list('id', 'thumbnail_path'))
+
+    def test_force_replaces_thumbnails(self):
+        before = self.thumbnails()
+        output = self.run_command('--force', '--batch-size', '2')
+        after = self.thumbnails()
+        self.assertIn('成功: 5', output)
+        for image_id in self.image_ids:
+            self.assertNotEqual(after[image_id], before[image_id])
+            self.assertTrue(default_storage.exists(after[image_id]))
+            self.assertFalse(default_storage.exists(before[image_id]))
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_resume_from_checkpoint(self):
+        regenerate = regenerate_thumbnails.regenerate
+        before = self.thumbnails()
+
+        def crashing(job):
+            if job[0] == self.image_ids[3]:
+                raise RuntimeError('中断')
+            return regenerate(job)
+
+        # 第二批中断：断点记录第一批的最后一个ID
+        with mock.patch.object(regenerate_thumbnails, 'regenerate', crashing), self.assertRaises(RuntimeError):
+            self.run_command('--force', '--batch-size', '2')
+        with open(self.checkpoint, encoding='utf-8') as f:
+            self.assertEqual(json.load(f)['last_id'], self.image_ids[1])
+        middle = self.thumbnails()
+
+        output = self.run_command('--force', '--batch-size', '2')
+        self.assertIn(f'从断点继续：ID > {self.image_ids[1]}', output)
+        self.assertIn('找到 3 张图片', output)
+        after = self.thumbnails()
+        for image_id in self.image_ids[:2]:
+            self.assertNotEqual(middle[image_id], before[image_id])
+            self.assertEqual(after[image_id], middle[image_id])
+        for image_id in self.image_ids[2:]:
+            self.assertNotEqual(after[image_id], before[image_id])
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_checkpoint_of_other_options_is_ignored(self):
+        with open(self.checkpoint, 'w', encoding='utf-8') as f:
+            json.dump({'options': {'force': False}, 'last_id': self.image_ids[-1]}, f)
+        self.assertIn('找到 5 张图片', self.run_command('--force'))
+
+        with open(self.checkpoint, 'w', encoding='utf-8') as f:
+            json.dump({
+                'options': {'force': True, 'outdated': False, 'since': None, 'user': None},
+                'last_id': self.image_ids[-1],
+            }, f)
+        self.assertIn('找到 5 张图片', self.run_command('--force', '--restart'))
+
+    def test_keyset_batches_survive_deletes(self):
+        regenerate = regenerate_thumbnails.regenerate
+        before = self.thumbnails()
+
+        def deleting(job):
+            # 处理第一批时删除已处理的记录，按偏移量分页会跳过后面的图片
+            if job[0] == self.image_ids[1]:
+                Image.objects.filter(id=self.image_ids[0]).delete()
+            return regenerate(job)
+
+        with mock.patch.object(regenerate_thumbnails, 'regenerate', deleting):
+            output = self.run_command('--force', '--batch-size', '2')
+        self.assertIn('已处理 2/5', output)
+        self.assertIn('已处理 4/5', output)
+        after = self.thumbnails()
+        self.assertEqual(set(after), set(self.image_ids[1:]))
+        for image_id in self.image_ids[2:]:
+            self.assertNotEqual(after[image_id], before[image_id])
+
+    def test_outdated_only_processes_old_specs(self):
+        outdated = self.image_ids[1:3]
+        Image.objects.filter(id__in=outdated).update(thumbnail_spec='old')
+        before = self.thumbnails()
+
+        output = self.run_command('--outdated')
+        self.assertIn('找到 2 张图片', output)
+        after = self.thumbnails()
+        for image_id in self.image_ids:
+            self.assertEqual(after[image_id] != before[image_id], image_id in outdated)
+        self.assertEqual(Image.objects.exclude(thumbnail_spec=thumbnail_spec_hash()).count(), 0)
+        # 旧缩略图在写回后删除
+        for image_id in outdated:
+            self.assertFalse(default_storage.exists(before[image_id]))
+
+    def test_watch_rechecks_after_interval(self):
+        class Stop(Exception):
+            pass
+
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 1:
+                # 两次检查之间缩略图规格过期
+                Image.objects.filter(id=self.image_ids[0]).update(thumbnail_spec='old')
+            else:
+                raise Stop
+
+        before = self.thumbnails()
+        with mock.patch.object(regenerate_thumbnails.time, 'sleep', sleep), self.assertRaises(Stop):
+            output = io.StringIO()
+            call_command(
+                'regenerate_thumbnails', '--checkpoint', self.checkpoint, '--workers', '1',
+                '--outdated', '--watch', '600', stdout=output
+            )
+        self.assertEqual(sleeps, [600, 600])
+        # 第一次检查没有过期的缩略图，不输出统计
+        self.assertEqual(output.getvalue().count('找到'), 1)
+        after = self.thumbnails()
+        self.assertNotEqual(after[self.image_ids[0]], before[self.image_ids[0]])
+        self.assertEqual(after[self.image_ids[1]], before[self.image_ids[1]])
+
+    def test_concurrent_edit_is_not_overwritten(self):
+        regenerate = regenerate_thumbnails.regenerate
+        target = self.image_ids[1]
+        discarded = []
+
+        def racing(job):
+            result = regenerate(job)
+            if job[0] == target:
+                discarded.append(result[2][0]['thumbnail_path'])
+                # 生成缩略图期间，图片被单独编辑
+                self.client.post(f'/api/images/{target}/edit/', {'operations': {'rotate': 90}}, format='json')
+            return result
+
+        before = self.thumbnails()
+        with mock.patch.object(regenerate_thumbnails, 'regenerate', racing):
+            output = self.run_command('--force')
+        self.assertIn('成功: 4', output)
+        self.assertIn('已被修改（未写回）: 1', output)
+
+        image = Image.objects.get(id=target)
+        self.assertEqual(image.edit_index, 1)
+        self.assertNotIn(image.thumbnail_path.name, (before[target], discarded[0]))
+        self.assertTrue(default_storage.exists(image.thumbnail_path.name))
+        self.assertFalse(default_storage.exists(discarded[0]))
+
+
+class ColorPaletteTests(TestCase):
+    """调色板位掩码：颜色归类、掩码换算与筛选用的掩码集合"""
+
+    def test_classify_color(self):
+        for rgb, name in (
+            ((220, 20, 20), 'red'), ((30, 60, 220), 'blue'), ((40, 180, 60), 'green'),
+            ((250, 250, 250), 'white'), ((128, 128, 128), 'gray'), ((10, 10, 10), 'black'),
+            ((120, 70, 30), 'brown'),
+        ):
+            with self.subTest(rgb=rgb):
+                self.assertEqual(classify_color(rgb), name)
+
+    def test_palette_mask(self):
+        colors = [((220, 20, 20), 0.6), ((30, 60, 220), 0.3), ((40, 180, 60), 0.05)]
+        mask = palette_mask(colors)
+        # 占比过低的主色不计入掩码
+        self.assertEqual(mask, PALETTE_BITS['red'] | PALETTE_BITS['blue'])
+        self.assertEqual(mask_to_names(mask), ['red', 'blue'])
+        self.assertEqual(mask_to_names(0), [])
+
+    def test_parse_color_filter(self):
+        self.assertEqual(parse_color_filter('Blue, red'), PALETTE_BITS['red'] | PALETTE_BITS['blue'])
+        self.assertEqual(parse_color_filter('blue,unknown'), PALETTE_BITS['blue'])
+        self.assertEqual(parse_color_filter('unknown'), 0)
+
+    def test_superset_masks(self):
+        for mask in (PALETTE_BITS['blue'], PALETTE_BITS['red'] | PALETTE_BITS['green'] | PALETTE_BITS['black']):
+            with self.subTest(mask=mask):
+                expected = [
+                    value for value in range(1 << len(PALETTE_BITS))
+                    if value & mask == mask and bin(value).count('1') <= CLUSTER_COUNT
+                ]
+                self.assertEqual(list(superset_masks(mask)), expected)
+        self.assertEqual(superset_masks((1 << (CLUSTER_COUNT + 1)) - 1), ())
+
+
+class ColorFilterTests(MediaTestCase):
+    """按主色过滤：color=blue,red 返回同时包含所列颜色的图片"""
+
+    def setUp(self):
+        super().setUp()
+        self.names = {}
+        for name, colors in (
+            ('red', ['red']),
+            ('red_blue', ['red', 'blue']),
+            ('blue_green_white', ['blue', 'green', 'white']),
+            ('none', []),
+        ):
+            image_id = self.upload(title=name)
+            mask = 0
+            for color in colors:
+                mask |= PALETTE_BITS[color]
+            Image.objects.filter(id=image_id).update(color_mask=mask)
+            self.names[image_id] = name
+        other = self.upload(client=self.login(self.create_user('tester2')))
+        Image.objects.filter(id=other).update(color_mask=PALETTE_BITS['red'])
+
+    def filtered(self, color):
+        response = self.client.get(f'/api/images/?fields=id&color={color}')
+        self.assertEqual(response.status_code, 200)
+        return sorted(self.names[item['id']] for item in response.data['results'])
+
+    def test_single_color(self):
+        self.assertEqual(self.filtered('red'), ['red', 'red_blue'])
+        self.assertEqual(self.filtered('blue'), ['blue_green_white', 'red_blue'])
+
+    def test_all_listed_colors_are_required(self):
+        self.assertEqual(self.filtered('blue,red'), ['red_blue'])
+        self.assertEqual(self.filtered('white,green,blue'), ['blue_green_white'])
+        self.assertEqual(self.filtered('red,green'), [])
+
+    def test_unknown_color_matches_nothing(self):
+        self.assertEqual(self.filtered('unknown'), [])
+
+
+def fake_jpegtran(command, input, **kwargs):
+    """按 jpegtran 的参数用 Pillow 完成裁剪/旋转（测试环境未必安装 jpegtran）"""
+    img = PILImage.open(io.BytesIO(input))
+    exif = img.info.get('exif', b'') if 'all' in command else b''
+    if '-crop' in command:
+        width, height, left, top = map(int, command[command.index('-crop') + 1].replace('x', '+').split('+'))
+        img = img.crop((left, top, left + width, top + height))
+    if '-rotate' in command:
+        # jpegtran 顺时针旋转
+        img = img.rotate(-int(command[command.index('-rotate') + 1]), expand=True)
+    output = io.BytesIO()
+    img.save(output, 'JPEG', exif=exif)
+    return subprocess.CompletedProcess(command, 0, stdout=output.getvalue(), stderr=b'')
+
+
+class LosslessRenderTests(TestCase):
+    """原尺寸渲染：只含裁剪/旋转时交给 jpegtran 无损变换，未安装或条件不满足时返回 None 由调用方解码渲染"""
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), 'photo.jpg')
+        self.addCleanup(shutil.rmtree, os.path.dirname(self.path), ignore_errors=True)
+        exif = PILImage.Exif()
+        exif[0x010F] = 'TestCamera'
+        # 默认 4:2:0 采样，MCU 为 16x16
+        PILImage.new('RGB', (320, 240), (200, 30, 30)).save(self.path, 'JPEG', exif=exif)
+        self.calls = []
+
+    def jpegtran(self, command, **kwargs):
+        self.calls.append(command)
+        return fake_jpegtran(command, **kwargs)
+
+    def render(self, stack, installed=True):
+        with mock.patch.object(editing.shutil, 'which', return_value='/usr/bin/jpegtran' if installed else None), \
+                mock.patch.object(editing.subprocess, 'run', side_effect=self.jpegtran):
+            return editing.lossless_render(self.path, stack)
+
+    def test_crop_and_rotate(self):
+        data = self.render([{'crop': {'left': 16, 'top': 32, 'right': 176, 'bottom': 160}}, {'rotate': 90}])
+        with PILImage.open(io.BytesIO(data)) as img:
+            self.assertEqual(img.size, (128, 160))
+            # 保留原图的 EXIF 标记段
+            self.assertEqual(img.getexif().get(0x010F), 'TestCamera')
+        self.assertEqual(len(self.calls), 2)
+        for command in self.calls:
+            self.assertEqual(command[1:3], ['-copy', 'all'])
+
+    def test_unsupported_stacks_fall_back(self):
+        for stack in (
+            [{'crop': {'left': 10, 'top': 0, 'right': 170, 'bottom': 160}}],
+            [{'brightness': 1.2}],
+            [],
+        ):
+            with self.subTest(stack=stack):
+                self.assertIsNone(self.render(stack))
+        self.assertEqual(self.calls, [])
+
+    def test_missing_jpegtran_falls_back(self):
+        self.assertIsNone(self.render([{'rotate': 90}], installed=False))
+        self.assertEqual(self.calls, [])
+
+    def test_failed_jpegtran_falls_back(self):
+        def failing(command, **kwargs):
+            return subprocess.CompletedProcess(command, 1, stdout=b'', stderr=b'error')
+
+        self.jpegtran = failing
+        self.assertIsNone(self.render([{'rotate': 90}]))
+
+    @unittest.skipUnless(shutil.which('jpegtran'), '未安装 jpegtran')
+    def test_real_jpegtran(self):
+        data = editing.lossless_render(self.path, [{'rotate': 270}])
+        with PILImage.open(io.BytesIO(data)) as img:
+            self.assertEqual(img.size, (240, 320))
+            self.assertEqual(img.getexif().get(0x010F), 'TestCamera')
+
+
+class LosslessRenditionFallbackTests(MediaTestCase):
+    """未安装 jpegtran 时原尺寸渲染回退到解码渲染"""
+
+    def test_full_rendition_without_jpegtran(self):
+        image_id = self.upload(size=(320, 240))
+        self.client.post(f'/api/images/{image_id}/edit/', {'operations': {'rotate': 90}}, format='json')
+        with mock.patch.object(editing.shutil, 'which', return_value=None):
+            response = self.client.get(f'/api/images/{image_id}/rendition/?size=full')
+        self.assertEqual(response.status_code, 200)
+        with PILImage.open(io.BytesIO(b''.join(response.streaming_content))) as img:
+            self.assertEqual(img.size, (240, 320))
+
+
+class FacetsTests(MediaTestCase):
+    """分面统计：各分面计数、拍摄年份直方图与按图库版本失效的缓存"""
+
+    def setUp(self):
+        super().setUp()
+        sea = Tag.objects.create(name='海边')
+        cat = Tag.objects.create(name='猫', source='ai')
+        for width, height, year, camera, region, tags in (
+            (4000, 3000, 2021, 'X100V', 'CN', [sea, cat]),
+            (3000, 4000, 2021, 'X100V', 'JP', [sea]),
+            (800, 800, 2023, 'EOS R5', None, []),
+            (6000, 4000, None, None, 'CN', [cat]),
+        ):
+            image = Image.objects.create(
+                user=self.user, file_path='images/photo.jpg', width=width, height=height,
+                shot_at=datetime(year, 6, 1, tzinfo=timezone.utc) if year else None,
+                camera_model=camera, region=region,
+            )
+            image.tags.add(*tags)
+        # 其他用户的图片不计入
+        Image.objects.create(
+            user=self.create_user('tester2'), file_path='images/other.jpg', width=100, height=100,
+            shot_at=datetime(2021, 1, 1, tzinfo=timezone.utc), camera_model='X100V', region='CN',
+        )
+
+    def facets(self, query=''):
+        response = self.client.get(f'/api/images/facets/?{query}')
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_counts(self):
+        data = self.facets()
+        self.assertEqual(data['total'], 4)
+        self.assertEqual(
+            [(tag['name'], tag['source'], tag['count']) for tag in data['tags']],
+            [('海边', 'user', 2), ('猫', 'ai', 2)]
+        )
+        self.assertEqual(data['orientations'], {'landscape': 2, 'portrait': 1, 'square': 1})
+        self.assertEqual(
+            {bucket['key']: bucket['count'] for bucket in data['resolutions']},
+            {'lt_1mp': 1, '1_4mp': 0, '4_12mp': 0, '12_24mp': 2, 'gte_24mp': 1}
+        )
+        self.assertEqual(data['cameras'], [{'value': 'X100V', 'count': 2}, {'value': 'EOS R5', 'count': 1}])
+        self.assertEqual(data['regions'], [{'value': 'CN', 'count': 2}, {'value': 'JP', 'count': 1}])
+        self.assertEqual(data['lenses'], [])
+
+    def test_shot_year_buckets(self):
+        self.assertEqual(self.facets()['shot_years'], [{'year': 2021, 'count': 2}, {'year': 2023, 'count': 1}])
+
+    def test_counts_follow_filters(self):
+        data = self.facets('region=CN')
+        self.assertEqual(data['total'], 2)
+        self.assertEqual(data['shot_years'], [{'year': 2021, 'count': 1}])
+        self.assertEqual(data['orientations'], {'landscape': 2, 'portrait': 0, 'square': 0})
+
+    def test_cache_invalidated_by_library_version(self):
+        self.assertEqual(self.facets('cached=1')['total'], 4)
+        Image.objects.create(user=self.user, file_path='images/new.jpg', width=10, height=10)
+        # 图库版本未变化时返回缓存结果，不带 cached 参数时重新统计
+        self.assertEqual(self.facets('cached=1')['total'], 4)
+        self.assertEqual(self.facets()['total'], 5)
+
+        bump_library_version(self.user.id)
+        self.assertEqual(self.facets('cached=1')['total'], 5)
+
+        # 通过接口修改图库时自动更新版本
+        self.upload()
+        self.assertEqual(self.facets('cached=1')['total'], 6)
+
+
+class PlaceholderTests(MediaTestCase):
+    """内联占位图：由缩略图生成的极小 JPEG，缺少时由 regenerate_thumbnails 根据现有缩略图补生成"""
+
+    @staticmethod
+    def decode(placeholder):
+        prefix = 'data:image/jpeg;base64,'
+        return PILImage.open(io.BytesIO(base64.b64decode(placeholder[len(prefix):])))
+
+    def test_create_placeholder(self):
+        placeholder = create_placeholder(PILImage.new('RGB', (400, 300), (30, 60, 200)))
+        self.assertTrue(placeholder.startswith('data:image/jpeg;base64,'))
+        self.assertLess(len(placeholder), 1000)
+        with self.decode(placeholder) as img:
+            self.assertEqual((img.format, img.size), ('JPEG', PLACEHOLDER_SIZE))
+            red, green, blue = img.convert('RGB').getpixel((8, 6))
+            self.assertTrue(blue > 150 and red < 80)
+
+    def test_placeholder_from_rgba(self):
+        with self.decode(create_placeholder(PILImage.new('RGBA', (64, 64), (0, 0, 0, 0)))) as img:
+            self.assertEqual(img.mode, 'RGB')
+
+    def test_upload_sets_placeholder(self):
+        image_id = self.upload(color=(30, 60, 200))
+        placeholder = Image.objects.get(id=image_id).placeholder
+        with self.decode(placeholder) as img:
+            self.assertEqual(img.size, PLACEHOLDER_SIZE)
+        result = self.client.get('/api/images/?fields=compact').data['results'][0]
+        self.assertEqual(result['placeholder'], placeholder)
+
+    @mock.patch.object(regenerate_thumbnails, 'ProcessPoolExecutor', InlineExecutor)
+    def test_backfill_from_existing_thumbnail(self):
+        missing = self.upload()
+        present = self.upload()
+        Image.objects.filter(id=missing).update(placeholder=None)
+        before = Image.objects.get(id=missing).thumbnail_path.name
+
+        out = io.StringIO()
+        call_command(
+            'regenerate_thumbnails', '--workers', '1',
+            '--checkpoint', os.path.join(self.media_root, 'regenerate.json'), stdout=out
+        )
+        self.assertIn('成功: 1', out.getvalue())
+        self.assertIn('跳过: 1', out.getvalue())
+        image = Image.objects.get(id=missing)
+        # 只补生成占位图，不重新生成缩略图
+        self.assertEqual(image.thumbnail_path.name, before)
+        self.assertTrue(default_storage.exists(before))
+        with self.decode(image.placeholder) as img:
+            self.assertEqual(img.size, PLACEHOLDER_SIZE)
+        self.assertIsNotNone(Image.objects.get(id=present).placeholder)
+
+
+class ProxyCacheTests(MediaTestCase):
+    """编辑预览代理图缓存：LRU 容量上限，按编辑哈希与原图修改时间区分"""
+
+    def test_lru_bound(self):
+        cache = editing.ProxyCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        # 最近最少使用的 b 被淘汰
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+        self.assertEqual(len(cache.entries), 2)
+
+    def test_proxy_keyed_on_edit_hash_and_mtime(self):
+        image_id = self.upload(size=(800, 600))
+        cache = editing.ProxyCache(4)
+        with mock.patch.object(editing, 'proxy_cache', cache), \
+                mock.patch.object(cache, 'put', wraps=cache.put) as rendered:
+            proxy, _ = editing.get_proxy(Image.objects.get(id=image_id))
+            self.assertIs(editing.get_proxy(Image.objects.get(id=image_id))[0], proxy)
+            self.assertEqual(rendered.call_count, 1)
+
+            # 编辑后编辑哈希变化，重新生成代理图；撤销后回到之前的缓存
+            self.client.post(f'/api/images/{image_id}/edit/', {'operations': {'rotate': 90}}, format='json')
+            edited, _ = editing.get_proxy(Image.objects.get(id=image_id))
+            self.assertEqual(rendered.call_count, 2)
+            self.assertEqual(edited.size, proxy.size[::-1])
+            self.client.post(f'/api/images/{image_id}/undo/')
+            self.assertIs(editing.get_proxy(Image.objects.get(id=image_id))[0], proxy)
+            self.assertEqual(rendered.call_count, 2)
+
+            # 原图被原地替换（修改时间变化）时重新生成
+            image = Image.objects.get(id=image_id)
+            path = default_storage.path(image.file_path.name)
+            with open(path, 'wb') as f:
+                f.write(make_jpeg(size=(800, 600), color=(30, 30, 200)).read())
+            mtime = os.stat(path).st_mtime + 10
+            os.utime(path, (mtime, mtime))
+            replaced, _ = editing.get_proxy(image)
+            self.assertEqual(rendered.call_count, 3)
+            self.assertIsNot(replaced, proxy)
+
+
+class ApplyAdjustmentsTests(TestCase):
+    """合并的色调调整与依次执行 ImageEnhance 的结果一致（误差在 ±1 以内）"""
+
+    @staticmethod
+    def enhance(img, brightness, contrast, saturation):
+        img = ImageEnhance.Brightness(img).enhance(brightness)
+        img = ImageEnhance.Contrast(img).enhance(contrast)
+        if img.mode == 'RGB':
+            img = ImageEnhance.Color(img).enhance(saturation)
+        return img
+
+    def assert_close(self, img, brightness, contrast, saturation):
+        expected = np.asarray(self.enhance(img, brightness, contrast, saturation), dtype=np.int16)
+        actual = np.asarray(editing.apply_adjustments(img, brightness, contrast, saturation), dtype=np.int16)
+        self.assertEqual(actual.shape, expected.shape)
+        self.assertLessEqual(np.abs(actual - expected).max(), 1)
+
+    def test_matches_image_enhance(self):
+        rng = np.random.default_rng(0)
+        images = {
+            'RGB': PILImage.fromarray(rng.integers(0, 256, (300, 257, 3), dtype=np.uint8)),
+            'L': PILImage.fromarray(rng.integers(0, 256, (300, 257), dtype=np.uint8)),
+        }
+        # 条带较小时同样一致（对比度的平均灰度按条带累计）
+        with mock.patch.object(editing, 'STRIP_PIXELS', 257 * 7):
+            for mode, img in images.items():
+                for values in (
+                    (1.3, 1.0, 1.0), (1.0, 0.6, 1.0), (1.0, 1.0, 1.5), (0.7, 1.4, 0.3),
+                    (2.0, 2.0, 2.0), (0.0, 1.0, 1.0), (1.0, 0.0, 0.0), (1.0, 1.0, 1.0),
+                ):
+                    with self.subTest(mode=mode, values=values):
+                        self.assert_close(img, *values)
+
+
+class ImageLimitTests(MediaTestCase):
+    """像素上限：超大图片上传返回 400，上限通过参数传递，不修改 PIL 的全局设置"""
+
+    def test_oversized_upload_is_rejected(self):
+        with self.settings(IMAGE_MAX_PIXELS=100_000):
+            response = self.client.post(
+                '/api/images/upload/', {'file': make_jpeg(size=(800, 600))}, format='multipart'
+            )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('像素数超出限制', response.data['error'])
+        self.assertFalse(Image.objects.exists())
+
+    def test_bounded_draft_checks_limit(self):
+        img = PILImage.open(make_jpeg(size=(800, 600)))
+        with self.assertRaises(ImageTooLarge):
+            bounded_draft(img, max_pixels=100_000)
+        with self.settings(IMAGE_MAX_PIXELS=100_000), self.assertRaises(ImageTooLarge):
+            bounded_draft(img)
+        self.assertIs(bounded_draft(img, (400, 300), max_pixels=800 * 600), img)
+        self.assertEqual(img.size, (400, 300))
+
+    def test_pil_global_limit_is_untouched(self):
+        self.assertEqual(PILImage.MAX_IMAGE_PIXELS, 1024 * 1024 * 1024 // 4 // 3)
+
+
+class MigrationTestCase(TransactionTestCase):
+    """
+    数据迁移测试基类：先迁移到 migrate_from 并用当时的模型准备数据，
+    再执行到 migrate_to 检查结果，结束后恢复到最新状态
+    """
+    migrate_from = None
+    migrate_to = None
+
+    def migrate(self, target):
+        executor = MigrationExecutor(connection)
+        executor.migrate([('api', target)])
+        return executor.loader.project_state([('api', target)]).apps
+
+    def setUp(self):
+        self.old_apps = self.migrate(self.migrate_from)
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def run_migration(self):
+        return self.migrate(self.migrate_to)
+
+
+class ConvertExifTagsMigrationTests(MigrationTestCase):
+    """0006：上传时生成的EXIF标签转换为分面字段，用户手动添加的同名标签保留"""
+    migrate_from = '0005_image_exif_facets'
+    migrate_to = '0006_convert_exif_tags'
+
+    def setUp(self):
+        super().setUp()
+        User = self.old_apps.get_model('api', 'User')
+        Image = self.old_apps.get_model('api', 'Image')
+        Tag = self.old_apps.get_model('api', 'Tag')
+        ImageTag = self.old_apps.get_model('api', 'ImageTag')
+
+        user = User.objects.create(username='tester1', email='tester1@example.com')
+        self.tagged = Image.objects.create(user=user, file_path='images/a.jpg', width=4000, height=3000)
+        self.plain = Image.objects.create(user=user, file_path='images/b.jpg', width=480, height=640)
+
+        def link(image, name, source='exif'):
+            tag, _ = Tag.objects.get_or_create(name=name, defaults={'source': source})
+            ImageTag.objects.create(image=image, tag=tag)
+
+        # 上传流程按固定顺序写入：日期、地区、镜头厂商、镜头型号、分辨率
+        for name in ('2020.05.01', '日本', 'Canon', 'EF 50mm', '4000x3000'):
+            link(self.tagged, name)
+        for name in ('2021.01.02', '480x640'):
+            link(self.plain, name)
+        # 之后用户手动添加的标签（与EXIF标签同名时共用同一个 Tag）
+        link(self.tagged, '中国')
+        link(self.tagged, '风景', source='user')
+        link(self.plain, 'EF 50mm')
+
+    def test_upload_tags_become_facets(self):
+        Image = self.run_migration().get_model('api', 'Image')
+        image = Image.objects.get(id=self.tagged.id)
+        self.assertEqual(image.capture_date, date(2020, 5, 1))
+        self.assertEqual(image.region, '日本')
+        self.assertEqual((image.lens_make, image.lens_model), ('Canon', 'EF 50mm'))
+        self.assertEqual(image.orientation, 'landscape')
+
+    def test_hand_added_tags_are_kept_and_not_mapped(self):
+        apps = self.run_migration()
+        Image = apps.get_model('api', 'Image')
+        ImageTag = apps.get_model('api', 'ImageTag')
+
+        def tag_names(image_id):
+            return sorted(ImageTag.objects.filter(image_id=image_id).values_list('tag__name', flat=True))
+
+        self.assertEqual(tag_names(self.tagged.id), ['中国', '风景'])
+        self.assertEqual(tag_names(self.plain.id), ['EF 50mm'])
+        plain = Image.objects.get(id=self.plain.id)
+        self.assertIsNone(plain.lens_model)
+        self.assertEqual(plain.orientation, 'portrait')
+
+    def test_unreferenced_exif_tags_are_removed(self):
+        Tag = self.run_migration().get_model('api', 'Tag')
+        self.assertEqual(
+            sorted(Tag.objects.values_list('name', flat=True)), ['EF 50mm', '中国', '风景']
+        )
+
+
+class BackfillCoordinatesMigrationTests(MigrationTestCase):
+    """0008：根据 location 字符串回填数值坐标和 geohash"""
+    migrate_from = '0007_image_coordinates'
+    migrate_to = '0008_backfill_coordinates'
+
+    def setUp(self):
+        super().setUp()
+        User = self.old_apps.get_model('api', 'User')
+        Image = self.old_apps.get_model('api', 'Image')
+        user = User.objects.create(username='tester1', email='tester1@example.com')
+        self.located = Image.objects.create(user=user, file_path='images/a.jpg', location='57.64911, 10.40744')
+        self.invalid = Image.objects.create(user=user, file_path='images/b.jpg', location='位置未知')
+        self.out_of_range = Image.objects.create(user=user, file_path='images/c.jpg', location='91, 10')
+
+    def test_backfill(self):
+        Image = self.run_migration().get_model('api', 'Image')
+        image = Image.objects.get(id=self.located.id)
+        self.assertAlmostEqual(float(image.latitude), 57.64911)
+        self.assertAlmostEqual(float(image.longitude), 10.40744)
+        self.assertEqual(image.geohash, 'u4pruydqqvj8')
+        for image_id in (self.invalid.id, self.out_of_range.id):
+            image = Image.objects.get(id=image_id)
+            self.assertIsNone(image.latitude)
+            self.assertIsNone(image.geohash)
+
+
+class ThumbnailSpecMigrationTests(MigrationTestCase):
+    """0013：已有缩略图标记为之前固定的规格（512x384 中心裁剪，JPEG 质量85）"""
+    migrate_from = '0012_image_placeholder'
+    migrate_to = '0013_image_thumbnail_spec'
+
+    def setUp(self):
+        super().setUp()
+        User = self.old_apps.get_model('api', 'User')
+        Image = self.old_apps.get_model('api', 'Image')
+        user = User.objects.create(username='tester1', email='tester1@example.com')
+        self.with_thumbnail = Image.objects.create(
+            user=user, file_path='images/a.jpg', thumbnail_path='thumbnails/thumb_a.jpg'
+        )
+        self.without_thumbnail = Image.objects.create(user=user, file_path='images/b.jpg')
+
+    def test_existing_thumbnails_get_legacy_spec(self):
+        Image = self.run_migration().get_model('api', 'Image')
+        legacy = spec_hash(build_thumbnail_spec((512, 384), 'center', 'JPEG', 85))
+        self.assertEqual(Image.objects.get(id=self.with_thumbnail.id).thumbnail_spec, legacy)
+        self.assertIsNone(Image.objects.get(id=self.without_thumbnail.id).thumbnail_spec)
+        # 默认设置下与当前规格一致，不需要重新生成
+        self.assertEqual(legacy, thumbnail_spec_hash())
+
+    @override_settings(THUMBNAIL_SPEC={'size': (256, 256), 'crop': 'fit', 'format': 'WEBP', 'quality': 80})
+    def test_legacy_spec_does_not_follow_settings(self):
+        Image = self.run_migration().get_model('api', 'Image')
+        self.assertNotEqual(Image.objects.get(id=self.with_thumbnail.id).thumbnail_spec, thumbnail_spec_hash())
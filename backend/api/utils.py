@@ -3,12 +3,42 @@
 处理EXIF信息提取、缩略图生成等
 """
 import os
+import re
+import math
+import base64
+import hashlib
+import json
+import PIL
 from PIL import Image as PILImage
-from PIL import ImageOps
 import piexif
 from datetime import datetime
 from io import BytesIO
 from django.core.files.base import ContentFile
+from django.conf import settings
+
+from .geo import geohash_encode
+from .geocoder import reverse_geocode
+from .similarity import CHUNK_FIELDS, split_hash, to_signed
+from .colors import extract_dominant_colors, palette_mask, to_hex
+from .imaging import bounded_draft, display_size, flatten, measure, open_image, resize, transpose
+from .storage import read_file
+
+
+# 占位图尺寸（与缩略图同为4:3）
+PLACEHOLDER_SIZE = (16, 12)
+
+# 缩略图格式对应的文件扩展名
+THUMBNAIL_EXTENSIONS = {'JPEG': '.jpg', 'WEBP': '.webp'}
+
+# 缩略图文件名中内容指纹的长度
+FINGERPRINT_LENGTH = 12
+# 文件名中的指纹（存储为避免重名追加的随机后缀位于指纹之后）
+FINGERPRINT_PATTERN = re.compile(r'\.([0-9a-f]{%d})(?:_[0-9A-Za-z]+)?\.[^.]+$' % FINGERPRINT_LENGTH)
+
+# save_thumbnail 会更新的字段（批量写回数据库时使用）
+THUMBNAIL_FIELDS = (
+    ['thumbnail_path', 'thumbnail_spec', 'placeholder', 'phash'] + CHUNK_FIELDS + ['dominant_colors', 'color_mask']
+)
 
 
 def extract_exif_data(image_path):
@@ -17,28 +47,49 @@ def extract_exif_data(image_path):
     返回: {
         'shot_at': datetime,
         'location': str,
+        'latitude': float,
+        'longitude': float,
         'width': int,
         'height': int,
-        'tags': list
+        'capture_date': date,
+        'camera_make': str,
+        'camera_model': str,
+        'lens_make': str,
+        'lens_model': str,
+        'region': str,
+        'country_code': str,
+        'admin_region': str,
+        'orientation': str
     }
     """
     exif_data = {
         'shot_at': None,
         'location': None,
+        'latitude': None,
+        'longitude': None,
         'width': None,
         'height': None,
-        'tags': []
+        'capture_date': None,
+        'camera_make': None,
+        'camera_model': None,
+        'lens_make': None,
+        'lens_model': None,
+        'region': None,
+        'country_code': None,
+        'admin_region': None,
+        'orientation': None
     }
     
     try:
-        img = PILImage.open(image_path)
+        # 只读取文件头，不解码像素
+        img = open_image(image_path)
         
         # 获取图片尺寸
         exif_data['width'] = img.width
         exif_data['height'] = img.height
         
-        # 自动旋转图片（根据EXIF的Orientation标签）
-        img = ImageOps.exif_transpose(img)
+        # 按显示方向（根据EXIF的Orientation标签旋转后）判断横竖构图
+        exif_data['orientation'] = get_orientation(*display_size(img))
         
         # 提取EXIF信息
         exif_dict = {}
@@ -58,15 +109,13 @@ def extract_exif_data(image_path):
             except:
                 pass
         
-        # 添加日期标签（如果有拍摄时间就用拍摄时间，否则用当前时间）
+        # 拍摄日期（如果有拍摄时间就用拍摄时间，否则用当前时间）
         if shot_datetime:
-            exif_data['tags'].append(shot_datetime.strftime('%Y.%m.%d'))
+            exif_data['capture_date'] = shot_datetime.date()
         else:
-            # 如果没有拍摄时间，使用当前上传时间
-            exif_data['tags'].append(datetime.now().strftime('%Y.%m.%d'))
+            exif_data['capture_date'] = datetime.now().date()
         
         # 提取GPS位置信息
-        has_location = False
         if 'GPS' in exif_dict:
             gps_info = exif_dict['GPS']
             if piexif.GPSIFD.GPSLatitude in gps_info and piexif.GPSIFD.GPSLongitude in gps_info:
@@ -85,44 +134,18 @@ def extract_exif_data(image_path):
                         lon = -lon
                 
                 exif_data['location'] = f"{lat:.6f}, {lon:.6f}"
-                
-                # 添加地理位置标签
-                # 根据坐标范围判断大致区域
-                if 18 <= lat <= 54 and 73 <= lon <= 135:
-                    exif_data['tags'].append("中国")
-                elif 24 <= lat <= 46 and 122 <= lon <= 146:
-                    exif_data['tags'].append("日本")
-                elif 33 <= lat <= 43 and 124 <= lon <= 132:
-                    exif_data['tags'].append("韩国")
-                elif 25 <= lat <= 49 and -125 <= lon <= -66:
-                    exif_data['tags'].append("美国")
-                elif 41 <= lat <= 51 and -5 <= lon <= 10:
-                    exif_data['tags'].append("欧洲")
-                else:
-                    # 其他地区显示坐标
-                    exif_data['tags'].append(f"位置: {lat:.2f}°, {lon:.2f}°")
-                has_location = True
+                exif_data['latitude'] = round(lat, 6)
+                exif_data['longitude'] = round(lon, 6)
+                set_region(exif_data, reverse_geocode(lat, lon))
         
-        # # 如果没有GPS信息，添加"未知位置"标签
-        # if not has_location:
-        #     exif_data['tags'].append("未知位置")
+        # 提取相机和镜头信息
+        if '0th' in exif_dict:
+            exif_data['camera_make'] = read_exif_text(exif_dict['0th'], piexif.ImageIFD.Make)
+            exif_data['camera_model'] = read_exif_text(exif_dict['0th'], piexif.ImageIFD.Model)
         
-        # 提取相机信息作为标签
         if 'Exif' in exif_dict:
-            # 相机型号
-            if piexif.ExifIFD.LensMake in exif_dict['Exif']:
-                camera_make = exif_dict['Exif'][piexif.ExifIFD.LensMake].decode('utf-8', errors='ignore').strip()
-                if camera_make:
-                    exif_data['tags'].append(camera_make)
-            
-            if piexif.ExifIFD.LensModel in exif_dict['Exif']:
-                camera_model = exif_dict['Exif'][piexif.ExifIFD.LensModel].decode('utf-8', errors='ignore').strip()
-                if camera_model:
-                    exif_data['tags'].append(camera_model)
-        
-        # 添加分辨率标签（格式：4000x3000）
-        if exif_data['width'] and exif_data['height']:
-            exif_data['tags'].append(f"{exif_data['width']}x{exif_data['height']}")
+            exif_data['lens_make'] = read_exif_text(exif_dict['Exif'], piexif.ExifIFD.LensMake)
+            exif_data['lens_model'] = read_exif_text(exif_dict['Exif'], piexif.ExifIFD.LensModel)
         
     except Exception as e:
         print(f"提取EXIF信息失败: {str(e)}")
@@ -130,6 +153,69 @@ def extract_exif_data(image_path):
     return exif_data
 
 
+def apply_exif_data(image, exif_data):
+    """
+    将 extract_exif_data 的结果写入图片模型字段（不保存）
+    """
+    for field in (
+        'width', 'height', 'shot_at', 'location', 'capture_date',
+        'camera_make', 'camera_model', 'lens_make', 'lens_model',
+        'region', 'country_code', 'admin_region', 'orientation'
+    ):
+        setattr(image, field, exif_data[field])
+    
+    set_coordinates(image, exif_data['latitude'], exif_data['longitude'])
+
+
+def set_coordinates(image, lat, lon):
+    """设置图片坐标并同步 geohash（不保存）"""
+    if lat is None or lon is None:
+        image.latitude = image.longitude = image.geohash = None
+        return
+    image.latitude = round(lat, 6)
+    image.longitude = round(lon, 6)
+    image.geohash = geohash_encode(lat, lon)
+
+
+def set_region(target, geocoded):
+    """
+    写入逆地理编码结果（国家中文名、国家代码、省/州）
+    target 可以是 dict 或 Image 对象
+    """
+    values = {
+        'region': geocoded['country'] if geocoded else None,
+        'country_code': geocoded['country_code'] if geocoded else None,
+        'admin_region': geocoded['admin'] if geocoded else None,
+    }
+    for key, value in values.items():
+        if isinstance(target, dict):
+            target[key] = value
+        else:
+            setattr(target, key, value)
+
+
+def read_exif_text(ifd, tag):
+    """读取EXIF文本字段，去除空白和结尾的空字符"""
+    value = ifd.get(tag)
+    if not value:
+        return None
+    if isinstance(value, bytes):
+        value = value.decode('utf-8', errors='ignore')
+    value = value.strip().strip('\x00').strip()
+    return value[:100] or None
+
+
+def get_orientation(width, height):
+    """根据宽高判断构图方向"""
+    if not width or not height:
+        return None
+    if width > height:
+        return 'landscape'
+    if width < height:
+        return 'portrait'
+    return 'square'
+
+
 def convert_to_degrees(value):
     """
     将GPS坐标转换为度数
@@ -140,117 +226,195 @@ def convert_to_degrees(value):
     return d + (m / 60.0) + (s / 3600.0)
 
 
-def create_thumbnail(image_file, target_size=(512, 384), aspect_ratio=(4, 3)):
+def create_placeholder(img, size=PLACEHOLDER_SIZE):
+    """
+    生成内联占位图（极小的 JPEG，约300字节），列表接口直接返回，前端先模糊显示
+    返回: data URI 字符串
+    """
+    small = img.convert('RGB').resize(size, PILImage.Resampling.BOX)
+    output = BytesIO()
+    small.save(output, format='JPEG', quality=40, optimize=True)
+    return 'data:image/jpeg;base64,' + base64.b64encode(output.getvalue()).decode('ascii')
+
+
+def build_thumbnail_spec(size, crop, format, quality):
+    """缩略图规格描述，任何一项变化都会使已生成的缩略图过期"""
+    return {
+        'size': list(size),
+        'crop': crop,
+        'format': format,
+        'quality': quality,
+        'placeholder': list(PLACEHOLDER_SIZE),
+        'pillow': PIL.__version__,
+    }
+
+
+def get_thumbnail_spec():
+    """根据 settings.THUMBNAIL_SPEC 获取当前缩略图规格"""
+    spec = settings.THUMBNAIL_SPEC
+    return build_thumbnail_spec(spec['size'], spec['crop'], spec['format'], spec['quality'])
+
+
+def spec_hash(spec):
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode('utf-8')).hexdigest()[:12]
+
+
+def thumbnail_spec_hash():
+    """当前缩略图规格的哈希值（记录在 Image.thumbnail_spec 上）"""
+    return spec_hash(get_thumbnail_spec())
+
+
+def create_thumbnail(image_file, spec=None):
     """
-    创建缩略图 - 中心裁剪为4:3比例后缩放到指定大小(512x384)
-    返回: ContentFile对象
+    创建缩略图 - 按规格（默认 settings.THUMBNAIL_SPEC）生成
+    crop 为 center 时中心裁剪为目标宽高比后缩放到指定大小，为 fit 时保持原比例缩放到指定大小以内
+    返回: ContentFile对象（附带 placeholder 占位图和 spec_hash 规格哈希）
     """
+    spec = spec or get_thumbnail_spec()
+    try:
+        with measure('create_thumbnail'):
+            img = open_image(image_file)
+            
+            # 缩放解码到不小于缩略图所需的尺寸
+            target_width, target_height = spec['size']
+            width, height = display_size(img)
+            ratios = (target_width / width, target_height / height)
+            scale = min(ratios) if spec['crop'] == 'fit' else max(ratios)
+            bounded_draft(img, (math.ceil(img.width * scale), math.ceil(img.height * scale)))
+            
+            # 自动旋转图片
+            img = transpose(img)
+            
+            return render_thumbnail(img, spec)
+    
+    except Exception as e:
+        print(f"生成缩略图失败: {str(e)}")
+        return None
+
+
+def render_thumbnail(img, spec=None):
+    """根据已解码（且已按EXIF方向旋转）的图片生成缩略图，参见 create_thumbnail"""
+    spec = spec or get_thumbnail_spec()
+    target_size = tuple(spec['size'])
     try:
-        img = PILImage.open(image_file)
-        
-        # 自动旋转图片
-        img = ImageOps.exif_transpose(img)
-        
         # 转换RGBA为RGB（如果需要）
-        if img.mode in ('RGBA', 'LA', 'P'):
-            background = PILImage.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        
-        # 计算目标宽高比
-        target_ratio = aspect_ratio[0] / aspect_ratio[1]  # 4:3 = 1.333...
-        current_ratio = img.width / img.height
+        img = flatten(img)
         
-        # 中心裁剪为4:3比例
-        if current_ratio > target_ratio:
-            # 图片太宽，裁剪左右
-            new_width = int(img.height * target_ratio)
-            left = (img.width - new_width) // 2
-            img = img.crop((left, 0, left + new_width, img.height))
-        elif current_ratio < target_ratio:
-            # 图片太高，裁剪上下
-            new_height = int(img.width / target_ratio)
-            top = (img.height - new_height) // 2
-            img = img.crop((0, top, img.width, top + new_height))
-        
-        # 缩放到目标尺寸
-        img = img.resize(target_size, PILImage.Resampling.LANCZOS)
+        if spec['crop'] == 'fit':
+            # 保持原比例缩放
+            img.thumbnail(target_size, PILImage.Resampling.LANCZOS)
+        else:
+            # 计算目标宽高比
+            target_ratio = target_size[0] / target_size[1]  # 512x384 = 4:3
+            current_ratio = img.width / img.height
+            
+            # 中心裁剪为目标比例
+            if current_ratio > target_ratio:
+                # 图片太宽，裁剪左右
+                new_width = int(img.height * target_ratio)
+                left = (img.width - new_width) // 2
+                img = img.crop((left, 0, left + new_width, img.height))
+            elif current_ratio < target_ratio:
+                # 图片太高，裁剪上下
+                new_height = int(img.width / target_ratio)
+                top = (img.height - new_height) // 2
+                img = img.crop((0, top, img.width, top + new_height))
+            
+            # 缩放到目标尺寸
+            img = resize(img, target_size)
         
         # 保存到内存
         thumb_io = BytesIO()
-        img.save(thumb_io, format='JPEG', quality=85)
+        img.save(thumb_io, format=spec['format'], quality=spec['quality'])
         thumb_io.seek(0)
         
-        return ContentFile(thumb_io.read())
+        thumbnail = ContentFile(thumb_io.read())
+        # 复用已缩放的缩略图生成占位图，避免再次解码原图
+        thumbnail.placeholder = create_placeholder(img)
+        thumbnail.spec_hash = spec_hash(spec)
+        thumbnail.extension = THUMBNAIL_EXTENSIONS.get(spec['format'], '.jpg')
+        return thumbnail
     
     except Exception as e:
         print(f"生成缩略图失败: {str(e)}")
         return None
 
 
-def edit_image(image_path, operations):
+def compute_dhash(image_file, hash_size=8):
     """
-    编辑图片
-    operations: {
-        'crop': {'left': int, 'top': int, 'right': int, 'bottom': int},
-        'brightness': float,  # 0.5-1.5
-        'contrast': float,    # 0.5-1.5
-        'saturation': float,  # 0.0-2.0
-    }
+    计算64位差异哈希（dHash），建议传入缩略图以减少解码开销
+    返回: 无符号整数，失败时返回 None
     """
     try:
-        img = PILImage.open(image_path)
-        
-        # 裁剪
-        if 'crop' in operations:
-            crop_data = operations['crop']
-            img = img.crop((
-                crop_data['left'],
-                crop_data['top'],
-                crop_data['right'],
-                crop_data['bottom']
-            ))
-        
-        # 亮度调整
-        if 'brightness' in operations:
-            from PIL import ImageEnhance
-            enhancer = ImageEnhance.Brightness(img)
-            img = enhancer.enhance(operations['brightness'])
-        
-        # 对比度调整
-        if 'contrast' in operations:
-            from PIL import ImageEnhance
-            enhancer = ImageEnhance.Contrast(img)
-            img = enhancer.enhance(operations['contrast'])
-        
-        # 饱和度调整
-        if 'saturation' in operations:
-            from PIL import ImageEnhance
-            enhancer = ImageEnhance.Color(img)
-            img = enhancer.enhance(operations['saturation'])
-        
-        # 处理RGBA模式：转换为RGB
-        if img.mode in ('RGBA', 'LA', 'P'):
-            # 创建白色背景
-            background = PILImage.new('RGB', img.size, (255, 255, 255))
-            if img.mode == 'P':
-                img = img.convert('RGBA')
-            background.paste(img, mask=img.split()[-1] if img.mode in ('RGBA', 'LA') else None)
-            img = background
-        elif img.mode not in ('RGB', 'L'):
-            # 其他模式也转换为RGB
-            img = img.convert('RGB')
-        
-        # 保存到内存
-        output = BytesIO()
-        img.save(output, format='JPEG', quality=90)
-        output.seek(0)
+        img = PILImage.open(image_file)
+        img = img.convert('L').resize((hash_size + 1, hash_size), PILImage.Resampling.LANCZOS)
+        pixels = list(img.getdata())
         
-        return ContentFile(output.read())
+        value = 0
+        for row in range(hash_size):
+            offset = row * (hash_size + 1)
+            for col in range(hash_size):
+                value = (value << 1) | (1 if pixels[offset + col] < pixels[offset + col + 1] else 0)
+        return value
     
     except Exception as e:
-        print(f"编辑图片失败: {str(e)}")
+        print(f"计算感知哈希失败: {str(e)}")
         return None
 
+
+def set_phash(image, value):
+    """设置图片感知哈希及其分段（不保存）"""
+    if value is None:
+        image.phash = None
+        for field in CHUNK_FIELDS:
+            setattr(image, field, None)
+        return
+    image.phash = to_signed(value)
+    for field, chunk in zip(CHUNK_FIELDS, split_hash(value)):
+        setattr(image, field, chunk)
+
+
+def set_dominant_colors(image, colors):
+    """设置图片主色及调色板掩码（不保存）"""
+    if colors is None:
+        image.dominant_colors = None
+        image.color_mask = None
+        return
+    image.dominant_colors = ','.join(to_hex(rgb) for rgb, _ in colors)
+    image.color_mask = palette_mask(colors)
+
+
+def save_thumbnail(image, name, thumbnail):
+    """
+    保存缩略图并更新由缩略图派生的字段（不保存图片记录）
+    文件名中带有内容指纹（thumb_xxx.<指纹>.jpg），内容变化时地址随之变化，可以长期缓存
+    """
+    # 文件扩展名与缩略图格式保持一致
+    fingerprint = hashlib.sha1(thumbnail.read()).hexdigest()[:FINGERPRINT_LENGTH]
+    thumbnail.seek(0)
+    extension = getattr(thumbnail, 'extension', os.path.splitext(name)[1])
+    name = f'{os.path.splitext(name)[0]}.{fingerprint}{extension}'
+    image.thumbnail_path.save(name, thumbnail, save=False)
+    image.placeholder = getattr(thumbnail, 'placeholder', None)
+    image.thumbnail_spec = getattr(thumbnail, 'spec_hash', None)
+    # 直接使用内存中的缩略图内容，不再从存储读回
+    thumbnail.seek(0)
+    analyze_thumbnail(image, thumbnail.read())
+
+
+def thumbnail_fingerprint(name):
+    """缩略图文件名中的内容指纹，早期生成的缩略图没有指纹时返回 None"""
+    match = FINGERPRINT_PATTERN.search(name or '')
+    return match.group(1) if match else None
+
+
+def analyze_thumbnail(image, content=None):
+    """
+    根据缩略图计算感知哈希与主色（不保存）
+    content: 缩略图内容，为空时从存储读取
+    """
+    if content is None:
+        content = read_file(image.thumbnail_path.name)
+    set_phash(image, compute_dhash(BytesIO(content)))
+    set_dominant_colors(image, extract_dominant_colors(BytesIO(content)))
+
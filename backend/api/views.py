@@ -1,22 +1,69 @@
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
+from rest_framework.pagination import CursorPagination
 from rest_framework.permissions import IsAuthenticated, AllowAny
+from rest_framework.exceptions import ValidationError
 from django.contrib.auth import login, logout
-from django.db.models import Q, Count, Sum
+from django.db.models import Q, Count, Sum, Exists, OuterRef, F, Window, Avg, Max
+from django.db.models.functions import RowNumber, ExtractYear, Substr, Cast, Radians, Sin, Cos, ASin, Sqrt, Power, Least
+from django.db.models import FloatField, Value
+from django.core.cache import cache
+from django.conf import settings
 from django.shortcuts import get_object_or_404
+from django.http import HttpResponse
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.utils.decorators import method_decorator
+from django.db import connections, transaction
+from concurrent.futures import ProcessPoolExecutor
 import os
+import math
 from datetime import datetime
+from io import BytesIO
 
 from .models import User, Image, Tag, ImageTag, Favorite, Album, AlbumImage
 from .serializers import (
     UserRegisterSerializer, UserLoginSerializer, UserSerializer, UserUpdateSerializer,
-    ImageSerializer, ImageUploadSerializer, TagSerializer, AlbumSerializer, AlbumDetailSerializer
+    ImageSerializer, ImageUploadSerializer, TagSerializer, AlbumSerializer, AlbumDetailSerializer,
+    AlbumImageSerializer, DynamicFieldsMixin, thumbnail_url_path
+)
+from .utils import (
+    extract_exif_data, apply_exif_data, create_thumbnail, save_thumbnail, thumbnail_fingerprint
 )
-from .utils import extract_exif_data, create_thumbnail, edit_image
 from .ai_service import analyze_image_with_ai, ai_search_images
+from .caching import bump_library_version, make_library_cache_key
+from .editing import (
+    BATCH_EDIT_FIELDS, PREVIEW_FORMATS, RENDITIONS, applied_edits, batch_edit_image, build_thumbnail,
+    delete_renditions, edited_size, get_rendition, normalize_operations, original_size, render_preview,
+    set_edit_state
+)
+from .imaging import ImageTooLarge, check_upload
+from .media import serve_file
+from .storage import cache_file, delete_file, local_path, read_file
+from .visual import index_image, load_index, remove_vector, compute_descriptor
+from .colors import parse_color_filter, superset_masks
+from .similarity import MAX_RADIUS, candidate_q, find_similar, find_duplicate_groups, group_max_distance
+from .geo import (
+    cell_intersects_bbox, geohash_cover, geohash_bounds, parse_bbox, parse_location, radius_bbox, split_bbox,
+    zoom_to_precision, EARTH_RADIUS_KM, MAX_ZOOM, MIN_ZOOM
+)
+
+
+# 筛选面板分辨率分档（按像素数，单位：像素）
+RESOLUTION_BUCKETS = [
+    ('lt_1mp', '100万像素以下', 0, 1000000),
+    ('1_4mp', '100万-400万像素', 1000000, 4000000),
+    ('4_12mp', '400万-1200万像素', 4000000, 12000000),
+    ('12_24mp', '1200万-2400万像素', 12000000, 24000000),
+    ('gte_24mp', '2400万像素以上', 24000000, None),
+]
+
+# 按字段值分组计数的分面：(返回键, 图片字段)
+FIELD_FACETS = [
+    ('cameras', 'camera_model'),
+    ('lenses', 'lens_model'),
+    ('regions', 'region'),
+]
 
 
 @api_view(['POST'])
@@ -98,7 +145,114 @@ def upload_avatar_view(request):
     })
 
 
-class ImageViewSet(viewsets.ModelViewSet):
+def optimize_image_queryset(queryset, fields, user, serializer_class=ImageSerializer):
+    """
+    按输出字段优化图片查询集
+    只查询需要的列，一次性加载用户/标签，并用子查询注解当前用户的收藏状态
+    """
+    if fields is not None:
+        queryset = queryset.only(*serializer_class.resolve_columns(fields))
+    if (fields is None or 'user' in fields) and 'user' in serializer_class.Meta.fields:
+        queryset = queryset.select_related('user')
+    if fields is None or 'tags' in fields:
+        queryset = queryset.prefetch_related('tags')
+    if fields is None or 'is_favorited' in fields:
+        queryset = queryset.annotate(favorited_flag=Exists(
+            Favorite.objects.filter(user=user, image=OuterRef('pk'))
+        ))
+    return queryset
+
+
+def bbox_filter(queryset, min_lat, min_lon, max_lat, max_lon):
+    """
+    边界框过滤：先用 geohash 前缀缩小到索引范围，再用精确的经纬度范围判断
+    跨越180度经线的边界框会被拆分
+    """
+    prefixes = geohash_cover(min_lat, min_lon, max_lat, max_lon)
+    if prefixes:
+        prefix_q = Q()
+        for prefix in prefixes:
+            prefix_q |= Q(geohash__startswith=prefix)
+        queryset = queryset.filter(prefix_q)
+    
+    box_q = Q()
+    for box_min_lat, box_min_lon, box_max_lat, box_max_lon in split_bbox(min_lat, min_lon, max_lat, max_lon):
+        box_q |= Q(
+            latitude__gte=box_min_lat, latitude__lte=box_max_lat,
+            longitude__gte=box_min_lon, longitude__lte=box_max_lon
+        )
+    return queryset.filter(box_q)
+
+
+def distance_km_expression(lat, lon):
+    """到指定点的球面距离（公里，haversine 公式）的数据库表达式"""
+    lat_rad = Radians(Cast('latitude', FloatField()))
+    lon_rad = Radians(Cast('longitude', FloatField()))
+    origin_lat = Value(math.radians(lat), output_field=FloatField())
+    origin_lon = Value(math.radians(lon), output_field=FloatField())
+    a = (
+        Power(Sin((lat_rad - origin_lat) / 2), 2)
+        + Cos(origin_lat) * Cos(lat_rad) * Power(Sin((lon_rad - origin_lon) / 2), 2)
+    )
+    return 2 * EARTH_RADIUS_KM * ASin(Least(Sqrt(a), Value(1.0, output_field=FloatField())))
+
+
+class AlbumImageCursorPagination(CursorPagination):
+    """相册内图片游标分页（按加入相册时间倒序）"""
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = ('-added_at', '-id')
+    
+    def get_ordering(self, request, queryset, view):
+        # 固定排序，不受相册视图集 OrderingFilter 的影响
+        return self.ordering
+
+
+class FavoriteCursorPagination(AlbumImageCursorPagination):
+    """收藏图片游标分页（按收藏时间倒序）"""
+    page_size = 20
+    ordering = ('-favorited_at', '-id')
+
+
+class SparseFieldsMixin:
+    """
+    稀疏字段集视图混入类
+    支持查询参数 fields（逗号分隔的字段名或预设名，如 compact）和 expand（追加嵌套对象字段），
+    同时裁剪序列化输出和数据库查询的列
+    """
+    sparse_actions = ('list', 'retrieve', 'favorites', 'similar', 'duplicates', 'visual_similar', 'batch_edit')
+    
+    def get_requested_fields(self):
+        """解析本次请求需要输出的字段，None 表示输出全部字段"""
+        if not hasattr(self, '_requested_fields'):
+            self._requested_fields = None
+            serializer_class = self.get_serializer_class()
+            if self.action in self.sparse_actions and issubclass(serializer_class, DynamicFieldsMixin):
+                params = self.request.query_params
+                self._requested_fields = serializer_class.resolve_fields(
+                    params.get('fields'), params.get('expand')
+                )
+        return self._requested_fields
+    
+    def wants_field(self, field_name):
+        fields = self.get_requested_fields()
+        return fields is None or field_name in fields
+    
+    def trim_queryset(self, queryset):
+        """只查询输出字段需要的列"""
+        fields = self.get_requested_fields()
+        if fields is not None:
+            queryset = queryset.only(*self.get_serializer_class().resolve_columns(fields))
+        return queryset
+    
+    def get_serializer(self, *args, **kwargs):
+        if issubclass(self.get_serializer_class(), DynamicFieldsMixin):
+            kwargs.setdefault('fields', self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
+
+
+class ImageViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """图片视图集"""
     queryset = Image.objects.all()
     serializer_class = ImageSerializer
@@ -108,14 +262,8 @@ class ImageViewSet(viewsets.ModelViewSet):
     ordering_fields = ['uploaded_at', 'shot_at', 'width', 'height', 'title']
     ordering = ['-uploaded_at']
     
-    def get_queryset(self):
-        """自定义查询集"""
-        queryset = Image.objects.all()
-        
-        # 只显示当前用户的图片
-        if not self.request.user.is_staff:
-            queryset = queryset.filter(user=self.request.user)
-        
+    def filter_images(self, queryset):
+        """按查询参数过滤图片（图库列表与收藏列表共用）"""
         # 按标签过滤
         tag_ids = self.request.query_params.get('tags', None)
         if tag_ids:
@@ -158,6 +306,79 @@ class ImageViewSet(viewsets.ModelViewSet):
         if max_height:
             queryset = queryset.filter(height__lte=int(max_height))
         
+        # 按地理范围过滤：bbox=min_lon,min_lat,max_lon,max_lat
+        bbox = self.request.query_params.get('bbox', None)
+        if bbox:
+            try:
+                queryset = bbox_filter(queryset, *parse_bbox(bbox))
+            except ValueError as e:
+                raise ValidationError({'error': str(e)})
+        
+        # 按距离过滤：near=lat,lon&radius_km=10
+        near = self.request.query_params.get('near', None)
+        radius_km = self.request.query_params.get('radius_km', None)
+        if near and radius_km:
+            point = parse_location(near)
+            if point is None:
+                raise ValidationError({'error': 'near 格式应为 lat,lon'})
+            lat, lon = point
+            try:
+                radius_km = float(radius_km)
+            except ValueError:
+                radius_km = math.nan
+            if not 0 < radius_km <= math.pi * EARTH_RADIUS_KM:
+                raise ValidationError({'error': 'radius_km 无效'})
+            queryset = bbox_filter(queryset, *radius_bbox(lat, lon, radius_km))
+            queryset = queryset.annotate(
+                distance_km=distance_km_expression(lat, lon)
+            ).filter(distance_km__lte=radius_km)
+        
+        # 按EXIF分面字段过滤
+        for param, field in (
+            ('camera_make', 'camera_make'),
+            ('camera_model', 'camera_model'),
+            ('lens', 'lens_model'),
+            ('region', 'region'),
+            ('country', 'country_code'),
+            ('admin_region', 'admin_region'),
+            ('orientation', 'orientation'),
+        ):
+            value = self.request.query_params.get(param, None)
+            if value:
+                queryset = queryset.filter(**{field: value})
+        
+        # 按主色过滤：color=blue,red（同时包含所列颜色）
+        color = self.request.query_params.get('color', None)
+        if color:
+            mask = parse_color_filter(color)
+            if mask:
+                queryset = queryset.filter(color_mask__in=superset_masks(mask))
+            else:
+                queryset = queryset.none()
+        
+        capture_from = self.request.query_params.get('capture_from', None)
+        capture_to = self.request.query_params.get('capture_to', None)
+        if capture_from:
+            queryset = queryset.filter(capture_date__gte=capture_from)
+        if capture_to:
+            queryset = queryset.filter(capture_date__lte=capture_to)
+        
+        return queryset
+    
+    def get_queryset(self):
+        """自定义查询集"""
+        queryset = Image.objects.all()
+        
+        # 只显示当前用户的图片
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        
+        queryset = self.filter_images(queryset)
+        
+        # 只读接口：按输出字段裁剪查询列，并一次性加载关联数据
+        if self.action in self.sparse_actions:
+            queryset = optimize_image_queryset(queryset, self.get_requested_fields(), self.request.user)
+        
         return queryset
     
     @action(detail=False, methods=['post'])
@@ -173,45 +394,44 @@ class ImageViewSet(viewsets.ModelViewSet):
         title = request.data.get('title', '')
         description = request.data.get('description', '')
         
+        # 根据文件头检查尺寸，避免超大图片在处理时耗尽内存
+        try:
+            check_upload(file)
+        except ImageTooLarge as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
         # 创建图片对象
         image = Image(
             user=request.user,
             title=title or file.name,
             description=description,
-            file_path=file
+            file_path=file,
+            file_size=file.size
         )
         image.save()
         
         # 提取EXIF信息
         try:
-            exif_data = extract_exif_data(image.file_path.path)
+            cache_file(image.file_path.name, file)
+            path = local_path(image.file_path.name)
+            exif_data = extract_exif_data(path)
             
             # 更新图片信息
-            image.width = exif_data['width']
-            image.height = exif_data['height']
-            image.shot_at = exif_data['shot_at']
-            image.location = exif_data['location']
+            apply_exif_data(image, exif_data)
             
             # 生成缩略图
-            thumbnail = create_thumbnail(image.file_path.path)
+            thumbnail = create_thumbnail(path)
             if thumbnail:
                 thumbnail_name = f"thumb_{os.path.basename(image.file_path.name)}"
-                image.thumbnail_path.save(thumbnail_name, thumbnail, save=False)
+                save_thumbnail(image, thumbnail_name, thumbnail)
             
             image.save()
-            
-            # 创建EXIF标签
-            for tag_name in exif_data['tags']:
-                if tag_name:
-                    tag, created = Tag.objects.get_or_create(
-                        name=tag_name,
-                        defaults={'source': 'exif'}
-                    )
-                    image.tags.add(tag)
+            index_image(image)
         
         except Exception as e:
             print(f"处理图片信息失败: {str(e)}")
         
+        bump_library_version(request.user.id)
         serializer = self.get_serializer(image, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
@@ -240,6 +460,7 @@ class ImageViewSet(viewsets.ModelViewSet):
             try:
                 # 获取对应的元数据
                 metadata = metadata_list[idx] if idx < len(metadata_list) else {}
+                check_upload(file)
                 title = metadata.get('title', file.name)
                 description = metadata.get('description', '')
                 tag_names = metadata.get('tags', [])
@@ -249,36 +470,28 @@ class ImageViewSet(viewsets.ModelViewSet):
                     user=request.user,
                     title=title,
                     description=description,
-                    file_path=file
+                    file_path=file,
+                    file_size=file.size
                 )
                 image.save()
                 
                 # 提取EXIF信息
                 try:
-                    exif_data = extract_exif_data(image.file_path.path)
+                    cache_file(image.file_path.name, file)
+                    path = local_path(image.file_path.name)
+                    exif_data = extract_exif_data(path)
                     
                     # 更新图片信息
-                    image.width = exif_data['width']
-                    image.height = exif_data['height']
-                    image.shot_at = exif_data['shot_at']
-                    image.location = exif_data['location']
+                    apply_exif_data(image, exif_data)
                     
                     # 生成缩略图
-                    thumbnail = create_thumbnail(image.file_path.path)
+                    thumbnail = create_thumbnail(path)
                     if thumbnail:
                         thumbnail_name = f"thumb_{os.path.basename(image.file_path.name)}"
-                        image.thumbnail_path.save(thumbnail_name, thumbnail, save=False)
+                        save_thumbnail(image, thumbnail_name, thumbnail)
                     
                     image.save()
-                    
-                    # 创建EXIF标签
-                    for tag_name in exif_data['tags']:
-                        if tag_name:
-                            tag, created = Tag.objects.get_or_create(
-                                name=tag_name,
-                                defaults={'source': 'exif'}
-                            )
-                            image.tags.add(tag)
+                    index_image(image)
                 
                 except Exception as e:
                     print(f"处理图片EXIF信息失败: {str(e)}")
@@ -300,6 +513,9 @@ class ImageViewSet(viewsets.ModelViewSet):
                     'error': str(e)
                 })
         
+        if uploaded_images:
+            bump_library_version(request.user.id)
+        
         # 序列化返回
         serializer = self.get_serializer(uploaded_images, many=True, context={'request': request})
         
@@ -313,7 +529,7 @@ class ImageViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def edit(self, request, pk=None):
-        """编辑图片"""
+        """编辑图片：追加一个编辑步骤，原图保持不变"""
         image = self.get_object()
         
         # 检查权限
@@ -323,36 +539,240 @@ class ImageViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        operations = request.data.get('operations', {})
+        stack = applied_edits(image)
+        try:
+            current_size = edited_size(original_size(local_path(image.file_path.name)), stack)
+            operations = normalize_operations(request.data.get('operations', {}), current_size, allow_noop=True)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except OSError:
+            return Response({'error': '编辑图片失败'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # 执行编辑操作
-        edited_file = edit_image(image.file_path.path, operations)
-        if edited_file:
-            # 保存编辑后的图片
-            filename = os.path.basename(image.file_path.name)
-            image.file_path.save(filename, edited_file, save=False)
-            
-            # 重新生成缩略图
-            thumbnail = create_thumbnail(image.file_path.path)
-            if thumbnail:
-                thumbnail_name = f"thumb_{filename}"
-                image.thumbnail_path.save(thumbnail_name, thumbnail, save=False)
-            
-            # 更新尺寸信息
-            from PIL import Image as PILImage
-            img = PILImage.open(image.file_path.path)
-            image.width = img.width
-            image.height = img.height
-            
-            image.save()
-            
+        # 不改变图片的操作（滑块回到初始值后保存）不追加步骤，直接返回当前图片
+        if not operations:
             serializer = self.get_serializer(image, context={'request': request})
             return Response(serializer.data)
         
-        return Response(
-            {'error': '编辑图片失败'},
-            status=status.HTTP_400_BAD_REQUEST
+        # 追加编辑步骤（丢弃已撤销的步骤），原图保持不变
+        stack = stack + [operations]
+        return self.save_edit_state(image, stack, len(stack))
+    
+    @action(detail=False, methods=['post'])
+    def batch_edit(self, request):
+        """批量编辑：对多张图片追加同一个编辑步骤，多进程并行生成缩略图，按读取时的编辑状态批量写回"""
+        image_ids = request.data.get('image_ids', [])
+        operations = request.data.get('operations', {})
+        if not isinstance(image_ids, list) or not image_ids:
+            return Response({'error': '请选择要编辑的图片'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(image_ids) > settings.BATCH_EDIT_MAX_IMAGES:
+            return Response(
+                {'error': f'一次最多编辑 {settings.BATCH_EDIT_MAX_IMAGES} 张图片'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            image_ids = list(dict.fromkeys(int(image_id) for image_id in image_ids))
+        except (TypeError, ValueError):
+            return Response({'error': '图片ID无效'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # 先校验操作本身，裁剪范围在每张图片上单独检查
+            normalize_operations(operations, (math.inf, math.inf))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        queryset = Image.objects.filter(id__in=image_ids)
+        if not request.user.is_staff:
+            queryset = queryset.filter(user=request.user)
+        images = list(queryset.only(
+            'id', 'user_id', 'file_path', 'thumbnail_path', 'edit_stack', 'edit_index', 'edit_hash'
+        ))
+        found = {image.id for image in images}
+        errors = [{'id': image_id, 'error': '图片不存在或没有权限'} for image_id in image_ids if image_id not in found]
+        
+        # 读取时的缩略图与编辑状态，写回时用于检测并发修改
+        versions = {image.id: (image.thumbnail_path.name, image.edit_hash) for image in images}
+        edited = []
+        stale_files = []
+        if images:
+            # 子进程不使用父进程的数据库连接
+            connections.close_all()
+            workers = max(1, min(settings.BATCH_EDIT_WORKERS, len(images)))
+            results = []
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                jobs = [(image, operations) for image in images]
+                for image_id, result, payload in executor.map(batch_edit_image, jobs):
+                    if result == 'error':
+                        errors.append({'id': image_id, 'error': payload})
+                    else:
+                        results.append(payload)
+            
+            # 一个事务内锁定这些记录并一次读取当前状态，只写回未被其他请求修改的图片（编辑、撤销等会更换缩略图）
+            conflicts = []
+            with transaction.atomic():
+                current = {
+                    image_id: (thumbnail_name, edit_hash)
+                    for image_id, thumbnail_name, edit_hash in Image.objects.select_for_update().filter(
+                        id__in=[image.id for image, stale in results]
+                    ).values_list('id', 'thumbnail_path', 'edit_hash')
+                }
+                for image, stale in results:
+                    if current.get(image.id) != versions[image.id]:
+                        conflicts.append(image)
+                        continue
+                    edited.append(image)
+                    if stale:
+                        stale_files.append(stale)
+                Image.objects.bulk_update(edited, BATCH_EDIT_FIELDS)
+            # 放弃被修改图片的本次结果
+            for image in conflicts:
+                delete_file(image.thumbnail_path.name)
+                errors.append({'id': image.id, 'error': '图片已被修改，请重试'})
+        
+        # 数据库已指向新缩略图，删除旧文件并更新视觉特征
+        for name in stale_files:
+            delete_file(name)
+        for image in edited:
+            index_image(image)
+        for user_id in {image.user_id for image in edited}:
+            bump_library_version(user_id)
+        
+        order = {image.id: position for position, image in enumerate(edited)}
+        queryset = optimize_image_queryset(
+            Image.objects.filter(id__in=order), self.get_requested_fields(), request.user
+        )
+        serializer = self.get_serializer(
+            sorted(queryset, key=lambda image: order[image.id]), many=True, context={'request': request}
+        )
+        return Response({
+            'message': f'成功编辑 {len(edited)} 张图片',
+            'edited': len(edited),
+            'failed': len(errors),
+            'images': serializer.data,
+            'errors': errors
+        })
+    
+    @action(detail=True, methods=['post'])
+    def edit_preview(self, request, pk=None):
+        """编辑预览：在缓存的代理图上执行 operations 并直接返回图片（output=jpeg|webp），不保存"""
+        image = self.get_object()
+        output_format = request.query_params.get('output', 'jpeg')
+        if output_format not in PREVIEW_FORMATS:
+            return Response({'error': '不支持的格式'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            size = (image.width, image.height)
+            if not all(size):
+                size = edited_size(original_size(local_path(image.file_path.name)), applied_edits(image))
+            operations = normalize_operations(request.data.get('operations', {}), size, allow_noop=True)
+            data, content_type = render_preview(image, operations, output_format)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except OSError:
+            return Response({'error': '生成预览失败'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        response = HttpResponse(data, content_type=content_type)
+        response['Cache-Control'] = 'no-store'
+        return response
+    
+    @action(detail=True, methods=['post'])
+    def undo(self, request, pk=None):
+        """撤销最近一步编辑"""
+        image = self.get_object()
+        if image.user != request.user and not request.user.is_staff:
+            return Response({'error': '您没有权限编辑此图片'}, status=status.HTTP_403_FORBIDDEN)
+        if image.edit_index <= 0:
+            return Response({'error': '没有可撤销的编辑'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.save_edit_state(image, image.edit_stack, image.edit_index - 1)
+    
+    @action(detail=True, methods=['post'])
+    def redo(self, request, pk=None):
+        """重做已撤销的编辑"""
+        image = self.get_object()
+        if image.user != request.user and not request.user.is_staff:
+            return Response({'error': '您没有权限编辑此图片'}, status=status.HTTP_403_FORBIDDEN)
+        if image.edit_index >= len(image.edit_stack):
+            return Response({'error': '没有可重做的编辑'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.save_edit_state(image, image.edit_stack, image.edit_index + 1)
+    
+    @action(detail=True, methods=['post'])
+    def revert(self, request, pk=None):
+        """恢复原图（保留编辑步骤，可通过重做恢复）"""
+        image = self.get_object()
+        if image.user != request.user and not request.user.is_staff:
+            return Response({'error': '您没有权限编辑此图片'}, status=status.HTTP_403_FORBIDDEN)
+        if image.edit_index == 0:
+            return Response({'error': '图片未经编辑'}, status=status.HTTP_400_BAD_REQUEST)
+        return self.save_edit_state(image, image.edit_stack, 0)
+    
+    def save_edit_state(self, image, stack, index):
+        """切换到指定的编辑状态：更新尺寸与缩略图，编辑结果在访问时再渲染"""
+        try:
+            set_edit_state(image, stack, index)
+        except (ValueError, OSError) as e:
+            return Response({'error': str(e) or '编辑图片失败'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # 重新生成缩略图
+        old_thumbnail = image.thumbnail_path.name
+        thumbnail = build_thumbnail(image)
+        if not thumbnail:
+            return Response(
+                {'error': '编辑图片失败'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        save_thumbnail(image, f"thumb_{os.path.basename(image.file_path.name)}", thumbnail)
+        image.save()
+        if old_thumbnail and old_thumbnail != image.thumbnail_path.name:
+            delete_file(old_thumbnail)
+        
+        index_image(image)
+        bump_library_version(image.user_id)
+        
+        serializer = self.get_serializer(image, context={'request': self.request})
+        return Response(serializer.data)
+    
+    def get_media_image(self):
+        """媒体文件接口：一次主键查询完成权限检查，只查询需要的列"""
+        queryset = Image.objects.only(
+            'id', 'user_id', 'file_path', 'thumbnail_path', 'edit_stack', 'edit_index', 'edit_hash'
         )
+        if not self.request.user.is_staff:
+            queryset = queryset.filter(user=self.request.user)
+        return get_object_or_404(queryset, pk=self.kwargs['pk'])
+    
+    @action(detail=True, methods=['get'])
+    def original(self, request, pk=None):
+        """原图文件（编辑不会修改原图，可以长期缓存）"""
+        image = self.get_media_image()
+        return serve_file(request, image.file_path.name, immutable=True)
+    
+    @action(detail=True, methods=['get'])
+    def thumbnail(self, request, pk=None):
+        """
+        缩略图文件
+        地址中的版本与文件名中的内容指纹一致时内容不会变化，可以长期缓存；
+        没有版本参数或早期生成的缩略图（文件名不含指纹）由客户端按 ETag 重新验证
+        """
+        image = self.get_media_image()
+        if not image.thumbnail_path:
+            return Response({'error': '缩略图不存在'}, status=status.HTTP_404_NOT_FOUND)
+        fingerprint = thumbnail_fingerprint(image.thumbnail_path.name)
+        immutable = fingerprint is not None and request.query_params.get('v') == fingerprint
+        return serve_file(request, image.thumbnail_path.name, immutable=immutable)
+    
+    @action(detail=True, methods=['get'])
+    def rendition(self, request, pk=None):
+        """编辑后的图片（size=full|large），首次访问时从原图渲染并缓存"""
+        image = self.get_media_image()
+        size = request.query_params.get('size', 'full')
+        if size not in RENDITIONS:
+            return Response({'error': '不支持的尺寸'}, status=status.HTTP_400_BAD_REQUEST)
+        if not image.edit_hash:
+            return serve_file(request, image.file_path.name, immutable=True)
+        try:
+            name = get_rendition(image, size)
+        except ImageTooLarge as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        # 地址中的版本与当前编辑状态一致时内容不会变化
+        return serve_file(request, name, immutable=request.query_params.get('v') == image.edit_hash)
     
     @action(detail=True, methods=['post'])
     def add_tags(self, request, pk=None):
@@ -379,6 +799,7 @@ class ImageViewSet(viewsets.ModelViewSet):
                     tag = Tag.objects.create(name=tag_name, source=tag_source)
                 image.tags.add(tag)
                 added_tags.append(tag)
+        bump_library_version(image.user_id)
         
         serializer = self.get_serializer(image, context={'request': request})
         return Response({
@@ -401,6 +822,7 @@ class ImageViewSet(viewsets.ModelViewSet):
         tag_ids = request.data.get('tag_ids', [])
         tags = Tag.objects.filter(id__in=tag_ids)
         image.tags.remove(*tags)
+        bump_library_version(image.user_id)
         
         serializer = self.get_serializer(image, context={'request': request})
         return Response({
@@ -432,30 +854,312 @@ class ImageViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def favorites(self, request):
-        """获取用户收藏的图片列表"""
-        favorites = Favorite.objects.filter(user=request.user).select_related('image')
-        images = [f.image for f in favorites]
+        """获取用户收藏的图片列表（按收藏时间游标分页，支持与图库相同的过滤参数）"""
+        queryset = Image.objects.filter(favorite__user=request.user).annotate(
+            favorited_at=F('favorite__created_at')
+        )
+        queryset = self.filter_images(queryset)
+        queryset = optimize_image_queryset(queryset, self.get_requested_fields(), request.user)
         
-        # 应用分页
-        page = self.paginate_queryset(images)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True, context={'request': request})
-            return self.get_paginated_response(serializer.data)
+        paginator = FavoriteCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = self.get_serializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """
+        获取当前筛选条件下的分面统计（标签、拍摄年份、分辨率、方向、相机、镜头、地区）
+        接受与图片列表相同的过滤参数；cached=1 时使用缓存结果
+        """
+        use_cache = request.query_params.get('cached') in ('1', 'true')
+        cache_key = None
+        if use_cache:
+            params = {k: v for k, v in request.query_params.items() if k != 'cached'}
+            cache_key = make_library_cache_key('image_facets', request.user.id, params)
+            data = cache.get(cache_key)
+            if data is not None:
+                return Response(data)
         
-        serializer = self.get_serializer(images, many=True, context={'request': request})
-        return Response(serializer.data)
+        queryset = Image.objects.all()
+        if not request.user.is_staff:
+            queryset = queryset.filter(user=request.user)
+        queryset = self.filter_images(queryset)
+        image_ids = queryset.values('id')
+        
+        # 总数、分辨率分档和方向：一次条件聚合
+        aggregates = {
+            'total': Count('id'),
+            'landscape': Count('id', filter=Q(width__gt=F('height'))),
+            'portrait': Count('id', filter=Q(width__lt=F('height'))),
+            'square': Count('id', filter=Q(width=F('height'))),
+        }
+        for key, _, low, high in RESOLUTION_BUCKETS:
+            condition = Q(pixels__gte=low)
+            if high is not None:
+                condition &= Q(pixels__lt=high)
+            aggregates[f'resolution_{key}'] = Count('id', filter=condition)
+        counts = Image.objects.filter(id__in=image_ids).annotate(
+            pixels=F('width') * F('height')
+        ).aggregate(**aggregates)
+        
+        # 标签计数：一次分组查询
+        tag_rows = ImageTag.objects.filter(image_id__in=image_ids).values(
+            'tag_id', 'tag__name', 'tag__source'
+        ).annotate(count=Count('image_id')).order_by('-count', 'tag__name')
+        
+        # 相机、镜头、地区：各一次分组查询
+        facet_rows = {}
+        for facet, field in FIELD_FACETS:
+            facet_rows[facet] = Image.objects.filter(
+                id__in=image_ids, **{f'{field}__isnull': False}
+            ).values(field).annotate(count=Count('id')).order_by('-count', field)
+        
+        # 拍摄年份直方图：一次分组查询
+        year_rows = Image.objects.filter(id__in=image_ids, shot_at__isnull=False).annotate(
+            year=ExtractYear('shot_at')
+        ).values('year').annotate(count=Count('id')).order_by('year')
+        
+        data = {
+            'total': counts['total'],
+            'tags': [
+                {'id': row['tag_id'], 'name': row['tag__name'], 'source': row['tag__source'], 'count': row['count']}
+                for row in tag_rows
+            ],
+            'shot_years': [{'year': row['year'], 'count': row['count']} for row in year_rows],
+            'resolutions': [
+                {
+                    'key': key, 'label': label,
+                    'min_pixels': low, 'max_pixels': high,
+                    'count': counts[f'resolution_{key}']
+                }
+                for key, label, low, high in RESOLUTION_BUCKETS
+            ],
+            'orientations': {
+                'landscape': counts['landscape'],
+                'portrait': counts['portrait'],
+                'square': counts['square'],
+            },
+        }
+        for facet, field in FIELD_FACETS:
+            data[facet] = [{'value': row[field], 'count': row['count']} for row in facet_rows[facet]]
+        
+        if cache_key:
+            cache.set(cache_key, data, settings.FACETS_CACHE_TIMEOUT)
+        return Response(data)
+    
+    @action(detail=False, methods=['get'])
+    def geo_clusters(self, request):
+        """
+        地图聚合：按缩放级别对应精度的 geohash 格子分组统计带坐标的图片
+        参数: bbox=min_lon,min_lat,max_lon,max_lat（可选）, zoom=地图缩放级别
+        结果按 (图库版本, 精度, 瓦片) 缓存，瓦片为覆盖 bbox 的较粗一级 geohash 前缀
+        """
+        try:
+            zoom = int(request.query_params.get('zoom', 3))
+        except ValueError:
+            return Response({'error': 'zoom 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        zoom = max(MIN_ZOOM, min(zoom, MAX_ZOOM))
+        precision = zoom_to_precision(zoom)
+        
+        tiles = ['']
+        box = None
+        bbox = request.query_params.get('bbox', None)
+        if bbox:
+            try:
+                box = parse_bbox(bbox)
+                tiles = geohash_cover(*box) or ['']
+            except ValueError as e:
+                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        # 瓦片必须比聚合格子粗，同一格子只属于一个瓦片
+        tiles = sorted({tile[:precision - 1] for tile in tiles})
+        tile_length = len(tiles[0])
+        
+        clusters_by_tile = {}
+        missing_tiles = []
+        cache_keys = {}
+        for tile in tiles:
+            cache_keys[tile] = make_library_cache_key(
+                'geo_clusters', request.user.id, {'precision': precision, 'tile': tile}
+            )
+            cached = cache.get(cache_keys[tile])
+            if cached is None:
+                missing_tiles.append(tile)
+            else:
+                clusters_by_tile[tile] = cached
+        
+        if missing_tiles:
+            queryset = Image.objects.filter(user=request.user, geohash__isnull=False)
+            if missing_tiles != ['']:
+                tile_q = Q()
+                for tile in missing_tiles:
+                    tile_q |= Q(geohash__startswith=tile)
+                queryset = queryset.filter(tile_q)
+            
+            # 一次分组查询得到每个格子的数量、中心点和代表图片
+            rows = list(queryset.annotate(cell=Substr('geohash', 1, precision)).values('cell').annotate(
+                count=Count('id'),
+                latitude=Avg('latitude'),
+                longitude=Avg('longitude'),
+                image_id=Max('id'),
+            ).order_by('cell'))
+            thumbnails = {
+                image.id: thumbnail_url_path(image)
+                for image in Image.objects.filter(id__in=[row['image_id'] for row in rows]).only('id', 'thumbnail_path')
+            }
+            
+            for tile in missing_tiles:
+                clusters_by_tile[tile] = []
+            for row in rows:
+                min_lat, min_lon, max_lat, max_lon = geohash_bounds(row['cell'])
+                clusters_by_tile[row['cell'][:tile_length]].append({
+                    'geohash': row['cell'],
+                    'count': row['count'],
+                    'latitude': float(row['latitude']),
+                    'longitude': float(row['longitude']),
+                    'bounds': [min_lon, min_lat, max_lon, max_lat],
+                    'image_id': row['image_id'],
+                    'thumbnail': thumbnails.get(row['image_id']),
+                })
+            for tile in missing_tiles:
+                cache.set(cache_keys[tile], clusters_by_tile[tile], settings.GEO_CLUSTER_CACHE_TIMEOUT)
+        
+        # 缓存按整个瓦片保存，返回前去掉与 bbox 不相交的格子
+        clusters = []
+        for tile in tiles:
+            for cluster in clusters_by_tile[tile]:
+                if box and not cell_intersects_bbox(cluster['geohash'], *box):
+                    continue
+                cluster = dict(cluster)
+                thumbnail = cluster.pop('thumbnail')
+                cluster['thumbnail_url'] = request.build_absolute_uri(thumbnail) if thumbnail else None
+                clusters.append(cluster)
+        
+        return Response({
+            'zoom': zoom,
+            'precision': precision,
+            'count': sum(cluster['count'] for cluster in clusters),
+            'clusters': clusters,
+        })
+    
+    def get_radius(self, default):
+        """解析汉明距离参数，限制在可保证召回的范围内"""
+        try:
+            radius = int(self.request.query_params.get('radius', default))
+        except ValueError:
+            raise ValidationError({'error': 'radius 必须是整数'})
+        return max(0, min(radius, MAX_RADIUS))
+    
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """查找与该图片感知哈希相近的图片（radius 为汉明距离，默认5）"""
+        image = self.get_object()
+        if image.phash is None:
+            return Response(
+                {'error': '该图片尚未计算感知哈希'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        radius = self.get_radius(5)
+        
+        # 分段索引取候选，再精确计算汉明距离
+        candidates = Image.objects.filter(user=image.user).filter(
+            candidate_q(image.phash, radius)
+        ).exclude(id=image.id).values_list('id', 'phash')
+        matches = find_similar(image.phash, candidates, radius)
+        
+        queryset = optimize_image_queryset(
+            Image.objects.filter(id__in=[image_id for image_id, _ in matches]),
+            self.get_requested_fields(), request.user
+        )
+        images = {item.id: item for item in queryset}
+        results = []
+        for image_id, distance in matches:
+            data = self.get_serializer(images[image_id]).data
+            data['distance'] = distance
+            results.append(data)
+        
+        return Response({'radius': radius, 'count': len(results), 'results': results})
+    
+    @action(detail=False, methods=['get'])
+    def duplicates(self, request):
+        """近似重复图片报告：按汉明距离（radius，默认4）聚类"""
+        radius = self.get_radius(4)
+        items = list(
+            Image.objects.filter(user=request.user, phash__isnull=False).values_list('id', 'phash')
+        )
+        groups = find_duplicate_groups(items, radius)
+        hashes = dict(items)
+        
+        grouped_ids = [image_id for group in groups for image_id in group]
+        queryset = optimize_image_queryset(
+            Image.objects.filter(id__in=grouped_ids), self.get_requested_fields(), request.user
+        )
+        images = {item.id: item for item in queryset}
+        
+        groups.sort(key=len, reverse=True)
+        return Response({
+            'radius': radius,
+            'group_count': len(groups),
+            'image_count': len(grouped_ids),
+            'groups': [
+                {
+                    'max_distance': group_max_distance(group, hashes),
+                    'images': self.get_serializer([images[image_id] for image_id in group], many=True).data,
+                }
+                for group in groups
+            ],
+        })
+    
+    @action(detail=True, methods=['get'])
+    def visual_similar(self, request, pk=None):
+        """以图搜图：按视觉特征向量的余弦相似度返回最相近的 k 张图片（默认20）"""
+        image = self.get_object()
+        try:
+            k = max(1, min(int(request.query_params.get('k', 20)), 100))
+        except ValueError:
+            return Response({'error': 'k 必须是整数'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        index = load_index(image.user_id)
+        vector = index.get_vector(image.id)
+        if vector is None and image.thumbnail_path:
+            vector = compute_descriptor(BytesIO(read_file(image.thumbnail_path.name)))
+        if vector is None:
+            return Response(
+                {'error': '该图片尚未计算视觉特征'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        matches = index.search(vector, k, exclude={image.id})
+        queryset = optimize_image_queryset(
+            Image.objects.filter(user=image.user, id__in=[image_id for image_id, _ in matches]),
+            self.get_requested_fields(), request.user
+        )
+        images = {item.id: item for item in queryset}
+        results = []
+        for image_id, score in matches:
+            # 索引中可能残留已删除的图片
+            if image_id not in images:
+                continue
+            data = self.get_serializer(images[image_id]).data
+            data['score'] = round(score, 4)
+            results.append(data)
+        
+        return Response({'count': len(results), 'results': results})
+    
+    def perform_update(self, serializer):
+        serializer.save()
+        bump_library_version(serializer.instance.user_id)
     
     def perform_destroy(self, instance):
         """删除图片时同时删除文件"""
-        # 删除物理文件
-        if instance.file_path:
-            if os.path.isfile(instance.file_path.path):
-                os.remove(instance.file_path.path)
-        if instance.thumbnail_path:
-            if os.path.isfile(instance.thumbnail_path.path):
-                os.remove(instance.thumbnail_path.path)
+        # 删除存储中的文件
+        delete_file(instance.file_path.name)
+        delete_file(instance.thumbnail_path.name)
         
+        delete_renditions(instance)
+        remove_vector(instance.user_id, instance.id)
         instance.delete()
+        bump_library_version(instance.user_id)
 
 
 class TagViewSet(viewsets.ModelViewSet):
@@ -530,11 +1234,11 @@ def ai_analyze_image(request):
         temp_image.save()
         
         # 调用AI分析
-        result = analyze_image_with_ai(temp_image.file_path.path)
+        cache_file(temp_image.file_path.name, image_file)
+        result = analyze_image_with_ai(local_path(temp_image.file_path.name))
         
         # 删除临时图片
-        if os.path.isfile(temp_image.file_path.path):
-            os.remove(temp_image.file_path.path)
+        delete_file(temp_image.file_path.name)
         temp_image.delete()
         
         return Response(result)
@@ -594,7 +1298,7 @@ def ai_search_images_view(request):
         )
 
 
-class AlbumViewSet(viewsets.ModelViewSet):
+class AlbumViewSet(SparseFieldsMixin, viewsets.ModelViewSet):
     """相册视图集"""
     queryset = Album.objects.all()
     serializer_class = AlbumSerializer
@@ -604,9 +1308,70 @@ class AlbumViewSet(viewsets.ModelViewSet):
     ordering_fields = ['created_at', 'updated_at', 'name']
     ordering = ['-created_at']
     
+    # 每个相册的预览图数量
+    preview_size = 4
+    
     def get_queryset(self):
         """只显示当前用户的相册"""
-        return Album.objects.filter(user=self.request.user)
+        queryset = Album.objects.filter(user=self.request.user)
+        if self.action in self.sparse_actions:
+            queryset = self.trim_queryset(queryset)
+            if self.wants_field('user'):
+                queryset = queryset.select_related('user')
+            if self.wants_field('image_count'):
+                queryset = queryset.annotate(images_total=Count('images'))
+        return queryset
+    
+    def list(self, request, *args, **kwargs):
+        """相册列表：预览图按页批量加载"""
+        queryset = self.filter_queryset(self.get_queryset())
+        
+        page = self.paginate_queryset(queryset)
+        albums = list(page if page is not None else queryset)
+        if self.wants_field('preview_images'):
+            self.attach_preview_images(albums)
+        
+        serializer = self.get_serializer(albums, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
+    
+    def attach_preview_images(self, albums):
+        """
+        用一条窗口函数查询取出本页所有相册的预览图
+        ROW_NUMBER() OVER (PARTITION BY album ORDER BY uploaded_at DESC) <= preview_size
+        """
+        for album in albums:
+            album.preview_list = []
+        if not albums:
+            return
+        
+        preview_fields = self.get_serializer_context().get('preview_fields')
+        queryset = Image.objects.filter(
+            albumimage__album__in=[album.id for album in albums]
+        ).annotate(
+            preview_album_id=F('albumimage__album_id'),
+            preview_rank=Window(
+                RowNumber(),
+                partition_by=F('albumimage__album_id'),
+                order_by=[F('uploaded_at').desc(), F('id').desc()]
+            )
+        ).filter(preview_rank__lte=self.preview_size).order_by('preview_album_id', 'preview_rank')
+        queryset = optimize_image_queryset(
+            queryset, preview_fields, self.request.user, AlbumImageSerializer
+        )
+        
+        albums_by_id = {album.id: album for album in albums}
+        for image in queryset:
+            albums_by_id[image.preview_album_id].preview_list.append(image)
+    
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        # compact 模式下预览图也只输出精简字段
+        fields_param = self.request.query_params.get('fields', '') if self.request else ''
+        if 'compact' in fields_param.split(','):
+            context['preview_fields'] = AlbumImageSerializer.FIELD_PRESETS['compact']
+        return context
     
     def get_serializer_class(self):
         """根据action选择序列化器"""
@@ -618,6 +1383,25 @@ class AlbumViewSet(viewsets.ModelViewSet):
         """创建相册时自动设置用户"""
         serializer.save(user=self.request.user)
     
+    @action(detail=True, methods=['get'])
+    def images(self, request, pk=None):
+        """分页获取相册中的图片"""
+        album = self.get_object()
+        params = request.query_params
+        fields = AlbumImageSerializer.resolve_fields(params.get('fields'), params.get('expand'))
+        
+        queryset = Image.objects.filter(albumimage__album=album).annotate(
+            added_at=F('albumimage__added_at')
+        )
+        queryset = optimize_image_queryset(queryset, fields, request.user, AlbumImageSerializer)
+        
+        paginator = AlbumImageCursorPagination()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        serializer = AlbumImageSerializer(
+            page, many=True, fields=fields, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+    
     @action(detail=True, methods=['post'])
     def add_images(self, request, pk=None):
         """向相册批量添加图片"""
@@ -630,14 +1414,24 @@ class AlbumViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # 只能添加当前用户的图片
-        images = Image.objects.filter(id__in=image_ids, user=request.user)
-        album.images.add(*images)
+        # 只能添加当前用户的图片，已在相册中的图片跳过
+        valid_ids = set(
+            Image.objects.filter(id__in=image_ids, user=request.user).values_list('id', flat=True)
+        )
+        existing_ids = set(
+            AlbumImage.objects.filter(album=album, image_id__in=valid_ids).values_list('image_id', flat=True)
+        )
+        added_ids = sorted(valid_ids - existing_ids)
+        AlbumImage.objects.bulk_create(
+            [AlbumImage(album=album, image_id=image_id) for image_id in added_ids],
+            ignore_conflicts=True
+        )
         
-        serializer = self.get_serializer(album)
         return Response({
-            'message': f'已添加 {len(images)} 张图片',
-            'album': serializer.data
+            'message': f'已添加 {len(added_ids)} 张图片',
+            'added': len(added_ids),
+            'added_ids': added_ids,
+            'image_count': AlbumImage.objects.filter(album=album).count()
         })
     
     @action(detail=True, methods=['post'])
@@ -652,13 +1446,12 @@ class AlbumViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        images = Image.objects.filter(id__in=image_ids)
-        album.images.remove(*images)
+        removed, _ = AlbumImage.objects.filter(album=album, image_id__in=image_ids).delete()
         
-        serializer = self.get_serializer(album)
         return Response({
-            'message': f'已移除 {len(image_ids)} 张图片',
-            'album': serializer.data
+            'message': f'已移除 {removed} 张图片',
+            'removed': removed,
+            'image_count': AlbumImage.objects.filter(album=album).count()
         })
 
 
@@ -681,13 +1474,7 @@ def user_statistics_view(request):
     total_albums = Album.objects.filter(user=user).count()
     
     # 总占用空间（字节）
-    total_size = 0
-    for image in user_images:
-        try:
-            if image.file_path and os.path.isfile(image.file_path.path):
-                total_size += os.path.getsize(image.file_path.path)
-        except:
-            pass
+    total_size = user_images.aggregate(total=Sum('file_size'))['total'] or 0
     
     # 使用 Python 代码统计年份和月份，避免 SQLite 时区问题
     yearly_counts = defaultdict(int)
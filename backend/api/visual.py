@@ -0,0 +1,306 @@
+"""
+视觉相似检索
+根据缩略图计算紧凑的视觉特征向量（颜色直方图 + 灰度缩略 + 边缘特征），
+每个用户的特征向量以 float16 矩阵存放在内存映射文件中，并用 id 映射文件记录每行对应的图片。
+新增图片时两个文件都只在末尾追加一行，更新、删除时原地改写对应行，写入开销与图库大小无关。
+
+文件布局（VISUAL_INDEX_ROOT 目录下）:
+    user_<id>.f16  特征矩阵，行数不少于 id 映射（末尾可能残留未完成的写入）
+    user_<id>.ids  int64 图片ID（无文件头），文件长度决定有效行数；0 表示该行已删除（重建索引时压缩）
+"""
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+
+import numpy as np
+from PIL import Image as PILImage
+from django.conf import settings
+
+from .storage import read_file
+
+try:
+    import fcntl
+except ImportError:  # Windows 开发环境不加文件锁
+    fcntl = None
+
+
+# 特征计算使用的缩放尺寸
+SAMPLE_SIZE = 64
+# HSV 颜色直方图分箱
+HUE_BINS, SAT_BINS, VAL_BINS = 12, 4, 2
+# 灰度缩略网格
+GRAY_GRID = 8
+# 边缘方向分箱与边缘能量网格
+EDGE_ORIENTATIONS = 8
+EDGE_GRID = 4
+
+COLOR_DIM = HUE_BINS * SAT_BINS * VAL_BINS
+GRAY_DIM = GRAY_GRID * GRAY_GRID
+EDGE_DIM = EDGE_ORIENTATIONS + EDGE_GRID * EDGE_GRID
+DIMENSIONS = COLOR_DIM + GRAY_DIM + EDGE_DIM
+
+DTYPE = np.float16
+ROW_BYTES = DIMENSIONS * np.dtype(DTYPE).itemsize
+ID_DTYPE = np.int64
+ID_BYTES = np.dtype(ID_DTYPE).itemsize
+# 检索时每次转换为 float32 计算的行数
+SEARCH_CHUNK_ROWS = 8192
+
+
+def _normalize(vector):
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def compute_descriptor(image_file):
+    """
+    计算图片的视觉特征向量（单位长度，向量点积即余弦相似度）
+    建议传入缩略图以减少解码开销
+    返回: float32 数组，失败时返回 None
+    """
+    try:
+        img = PILImage.open(image_file)
+        img.draft('RGB', (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+        img = img.convert('RGB').resize((SAMPLE_SIZE, SAMPLE_SIZE), PILImage.Resampling.BILINEAR)
+
+        # 颜色直方图（HSV 空间），取平方根后归一化以降低大面积单色的权重
+        hsv = np.asarray(img.convert('HSV'), dtype=np.uint16)
+        bins = (
+            (hsv[..., 0] * HUE_BINS >> 8) * (SAT_BINS * VAL_BINS)
+            + (hsv[..., 1] * SAT_BINS >> 8) * VAL_BINS
+            + (hsv[..., 2] * VAL_BINS >> 8)
+        )
+        color = np.sqrt(np.bincount(bins.ravel(), minlength=COLOR_DIM).astype(np.float32))
+
+        # 灰度缩略：去均值后只保留明暗结构
+        gray = np.asarray(img.convert('L'), dtype=np.float32)
+        cell = SAMPLE_SIZE // GRAY_GRID
+        layout = gray.reshape(GRAY_GRID, cell, GRAY_GRID, cell).mean(axis=(1, 3)).ravel()
+        layout -= layout.mean()
+
+        # 边缘：梯度方向直方图与分块梯度能量
+        gx = np.zeros_like(gray)
+        gy = np.zeros_like(gray)
+        gx[:, 1:-1] = gray[:, 2:] - gray[:, :-2]
+        gy[1:-1, :] = gray[2:, :] - gray[:-2, :]
+        magnitude = np.hypot(gx, gy)
+        orientation = ((np.arctan2(gy, gx) % np.pi) / np.pi * EDGE_ORIENTATIONS).astype(np.int64)
+        orientation = np.minimum(orientation, EDGE_ORIENTATIONS - 1)
+        edge_hist = np.bincount(orientation.ravel(), weights=magnitude.ravel(), minlength=EDGE_ORIENTATIONS)
+        cell = SAMPLE_SIZE // EDGE_GRID
+        edge_grid = magnitude.reshape(EDGE_GRID, cell, EDGE_GRID, cell).sum(axis=(1, 3)).ravel()
+        edge = np.concatenate([_normalize(edge_hist.astype(np.float32)), _normalize(edge_grid)])
+
+        vector = np.concatenate([_normalize(color), _normalize(layout), _normalize(edge)])
+        return _normalize(vector).astype(np.float32)
+
+    except Exception as e:
+        print(f"计算视觉特征失败: {str(e)}")
+        return None
+
+
+def _paths(user_id):
+    root = str(settings.VISUAL_INDEX_ROOT)
+    base = os.path.join(root, f'user_{user_id}')
+    return base + '.f16', base + '.ids', base + '.lock'
+
+
+class _Lock:
+    """同一用户索引文件的跨进程锁（写入时独占，读取时共享）"""
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self.file = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.file = open(self.path, 'a')
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+
+
+def _save_ids(path, ids):
+    """原子写入 id 映射文件"""
+    tmp_path = path + '.tmp'
+    np.asarray(ids, dtype=ID_DTYPE).tofile(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _read_ids(path):
+    """读取 id 映射（忽略末尾未写完整的半行）"""
+    try:
+        with open(path, 'rb') as f:
+            count = os.fstat(f.fileno()).st_size // ID_BYTES
+            return np.fromfile(f, dtype=ID_DTYPE, count=count)
+    except FileNotFoundError:
+        return np.zeros(0, dtype=ID_DTYPE)
+
+
+def _write_id(path, row, image_id):
+    """原地改写 id 映射中的一行"""
+    with open(path, 'r+b') as f:
+        f.seek(row * ID_BYTES)
+        f.write(np.asarray([image_id], dtype=ID_DTYPE).tobytes())
+
+
+class VisualIndex:
+    """单个用户的只读特征矩阵视图"""
+
+    def __init__(self, ids, matrix):
+        self.ids = ids
+        self.matrix = matrix
+        self.rows = {int(image_id): row for row, image_id in enumerate(ids) if image_id > 0}
+
+    def get_vector(self, image_id):
+        row = self.rows.get(image_id)
+        if row is None:
+            return None
+        return np.asarray(self.matrix[row], dtype=np.float32)
+
+    def search(self, vector, k, exclude=()):
+        """
+        向量化计算与所有行的余弦相似度并取前 k 个
+        返回: [(image_id, score), ...]，按相似度降序
+        """
+        count = len(self.ids)
+        if not count or k <= 0:
+            return []
+        query = np.asarray(vector, dtype=np.float32)
+        scores = np.empty(count, dtype=np.float32)
+        for start in range(0, count, SEARCH_CHUNK_ROWS):
+            block = np.asarray(self.matrix[start:start + SEARCH_CHUNK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+
+        invalid = self.ids <= 0
+        if exclude:
+            invalid |= np.isin(self.ids, list(exclude))
+        scores[invalid] = -np.inf
+
+        k = min(k, int(count - invalid.sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+        return [(int(self.ids[row]), float(scores[row])) for row in top]
+
+
+class IndexCache:
+    """进程内 LRU 缓存：最近检索过的用户索引（id 映射及行号字典常驻内存，矩阵为内存映射）"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+
+index_cache = IndexCache(getattr(settings, 'VISUAL_INDEX_CACHE_SIZE', 32))
+
+
+def load_index(user_id):
+    """
+    加载用户的特征索引（进程内缓存，id 映射文件变化后自动重新加载）
+    特征矩阵以只读内存映射方式打开，多个进程共享操作系统页缓存；
+    重新加载时持有共享锁，不会读到重建索引时已替换的矩阵与尚未替换的 id 映射。
+    映射建立后文件再被替换也不影响已打开的旧文件，缓存的索引始终前后一致
+    """
+    matrix_path, ids_path, lock_path = _paths(user_id)
+    try:
+        stat = os.stat(ids_path)
+    except FileNotFoundError:
+        return VisualIndex(np.zeros(0, dtype=ID_DTYPE), np.zeros((0, DIMENSIONS), dtype=DTYPE))
+
+    # 追加和原地改写都会改变修改时间，重建索引会替换文件（inode 变化）
+    version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+    cached = index_cache.get(user_id)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    with _Lock(lock_path, shared=True):
+        stat = os.stat(ids_path)
+        version = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        ids = _read_ids(ids_path)
+        if len(ids):
+            matrix = np.memmap(matrix_path, dtype=DTYPE, mode='r', shape=(len(ids), DIMENSIONS))
+        else:
+            matrix = np.zeros((0, DIMENSIONS), dtype=DTYPE)
+    index = VisualIndex(ids, matrix)
+    index_cache.put(user_id, (version, index))
+    return index
+
+
+def write_index(user_id, ids, matrix):
+    """整体写入用户的特征索引（重建索引时使用）"""
+    matrix_path, ids_path, lock_path = _paths(user_id)
+    matrix = np.ascontiguousarray(matrix, dtype=DTYPE).reshape(len(ids), DIMENSIONS)
+    with _Lock(lock_path):
+        tmp_path = matrix_path + '.tmp'
+        matrix.tofile(tmp_path)
+        os.replace(tmp_path, matrix_path)
+        _save_ids(ids_path, ids)
+
+
+def update_vector(user_id, image_id, vector):
+    """写入或更新单张图片的特征向量"""
+    matrix_path, ids_path, lock_path = _paths(user_id)
+    row_data = np.asarray(vector, dtype=DTYPE).tobytes()
+    with _Lock(lock_path):
+        ids = _read_ids(ids_path)
+        rows = np.flatnonzero(ids == image_id)
+        if len(rows):
+            with open(matrix_path, 'r+b') as f:
+                f.seek(int(rows[0]) * ROW_BYTES)
+                f.write(row_data)
+            return
+
+        # 追加新行：先写矩阵再写 id，id 写入后该行才对读取方可见；
+        # 写入前截断上次未完成写入残留的数据，保证矩阵与 id 映射对齐
+        with open(matrix_path, 'ab') as f:
+            f.truncate(len(ids) * ROW_BYTES)
+            f.write(row_data)
+        with open(ids_path, 'ab') as f:
+            f.truncate(len(ids) * ID_BYTES)
+            f.write(np.asarray([image_id], dtype=ID_DTYPE).tobytes())
+
+
+def remove_vector(user_id, image_id):
+    """将图片对应的行标记为删除"""
+    _, ids_path, lock_path = _paths(user_id)
+    if not os.path.exists(ids_path):
+        return
+    with _Lock(lock_path):
+        for row in np.flatnonzero(_read_ids(ids_path) == image_id):
+            _write_id(ids_path, int(row), 0)
+
+
+def index_image(image):
+    """根据缩略图计算并写入图片的特征向量"""
+    if not image.thumbnail_path:
+        return
+    try:
+        vector = compute_descriptor(BytesIO(read_file(image.thumbnail_path.name)))
+        if vector is not None:
+            update_vector(image.user_id, image.id, vector)
+    except Exception as e:
+        print(f"更新视觉特征索引失败: {str(e)}")
@@ -167,6 +167,59 @@ STATIC_ROOT = BASE_DIR / 'staticfiles'
 # Media files
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
+# 图片文件经后端鉴权后交给 nginx 发送的内部路径前缀（对应 nginx 的 internal location），
+# 为空时由 Django 直接返回文件（本地开发）；使用对象存储时不生效
+MEDIA_ACCEL_REDIRECT = os.environ.get('MEDIA_ACCEL_REDIRECT', '')
+
+# 媒体文件存储：local 为本地磁盘（MEDIA_ROOT），s3 为 S3 兼容的对象存储（需要 django-storages 和 boto3），
+# 使用对象存储时后端节点不保存状态，可以水平扩展
+MEDIA_STORAGE = os.environ.get('MEDIA_STORAGE', 'local')
+if MEDIA_STORAGE == 's3':
+    from boto3.s3.transfer import TransferConfig
+
+    STORAGES = {
+        'default': {
+            'BACKEND': 'storages.backends.s3.S3Storage',
+            'OPTIONS': {
+                'bucket_name': os.environ.get('S3_BUCKET', 'media'),
+                'endpoint_url': os.environ.get('S3_ENDPOINT_URL') or None,
+                'access_key': os.environ.get('S3_ACCESS_KEY'),
+                'secret_key': os.environ.get('S3_SECRET_KEY'),
+                'region_name': os.environ.get('S3_REGION', 'us-east-1'),
+                # MinIO 等自建服务使用路径风格的地址
+                'addressing_style': os.environ.get('S3_ADDRESSING_STYLE', 'path'),
+                # 文件名由随机键生成不会重复，保存时不检查重名
+                'file_overwrite': True,
+                # 头像地址（只有头像使用存储的 url()，需要在存储中公开读取 avatars/）
+                'custom_domain': os.environ.get('S3_PUBLIC_DOMAIN') or None,
+                'url_protocol': os.environ.get('S3_PUBLIC_PROTOCOL', 'http:'),
+                # 大文件分片并行上传
+                'transfer_config': TransferConfig(
+                    multipart_threshold=8 * 1024 * 1024,
+                    multipart_chunksize=8 * 1024 * 1024,
+                    max_concurrency=int(os.environ.get('S3_UPLOAD_CONCURRENCY', 4)),
+                ),
+            },
+        },
+        'staticfiles': {
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+        },
+    }
+else:
+    STORAGES = {
+        'default': {
+            'BACKEND': 'django.core.files.storage.FileSystemStorage',
+            # 文件名由随机键生成不会重复，保存时不检查重名
+            'OPTIONS': {'allow_overwrite': True},
+        },
+        'staticfiles': {
+            'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+        },
+    }
+
+# 对象存储时原图等文件在本机的缓存目录与容量上限（按最近访问淘汰）
+MEDIA_CACHE_DIR = os.environ.get('MEDIA_CACHE_DIR') or BASE_DIR / 'media_cache'
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get('MEDIA_CACHE_MAX_BYTES', 2 * 1024 ** 3))
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
@@ -194,5 +247,73 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 20,
 }
 
+# 缓存：图库版本号与分面、地图聚合结果需要在所有进程（gunicorn 工作进程、多个后端实例、
+# 后台缩略图任务）之间共享，配置了 REDIS_URL 时使用 Redis，否则使用数据库缓存表（由迁移创建）
+REDIS_URL = os.environ.get('REDIS_URL', '')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+            'LOCATION': 'django_cache',
+        }
+    }
+
+# 筛选面板分面统计缓存时间（秒），缓存同时按用户图库版本失效
+FACETS_CACHE_TIMEOUT = 300
+
+# 地图聚合结果缓存时间（秒）
+GEO_CLUSTER_CACHE_TIMEOUT = 600
+
+# 离线逆地理编码：可选的省/州级边界数据（与 api/data/countries.json.gz 同格式），为空时只识别国家
+REVERSE_GEOCODER_ADMIN_DATA = os.environ.get('REVERSE_GEOCODER_ADMIN_DATA') or None
+
+# 缩略图规格：每张缩略图记录生成时的规格哈希（还包括占位图尺寸和 Pillow 版本），
+# 修改后旧缩略图继续提供访问，由后台任务 regenerate_thumbnails --outdated 逐步重新生成
+THUMBNAIL_SPEC = {
+    'size': (512, 384),
+    'crop': 'center',  # center: 中心裁剪为目标宽高比; fit: 保持原比例缩放到尺寸以内
+    'format': 'JPEG',  # JPEG 或 WEBP
+    'quality': 85,
+}
+
+# 图片解码内存限制：超过像素上限的图片拒绝上传；单张图片解码占用超过预算时
+# 使用缩放解码（JPEG），无法缩放解码的格式拒绝处理。工作进程内存可按 预算 x 并发数 估算
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 100_000_000))
+IMAGE_DECODE_BUDGET = int(os.environ.get('IMAGE_DECODE_BUDGET', 256 * 1024 * 1024))
+
+# 图片处理各阶段的耗时与内存日志（IMAGE_PIPELINE_LOG_LEVEL=INFO 时输出），用于估算工作进程所需内存
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'api.imaging': {
+            'handlers': ['console'],
+            'level': os.environ.get('IMAGE_PIPELINE_LOG_LEVEL', 'WARNING'),
+        },
+    },
+}
+
+# 批量编辑：单次请求最多编辑的图片数，以及并行生成缩略图的进程数
+BATCH_EDIT_MAX_IMAGES = 200
+BATCH_EDIT_WORKERS = int(os.environ.get('BATCH_EDIT_WORKERS', 4))
+
+# 编辑预览：每个进程缓存的代理图数量（每张约 1024x768，占用约2-3MB内存）
+EDIT_PREVIEW_CACHE_SIZE = 16
+
+# 视觉相似检索特征索引目录（每个用户一个内存映射矩阵文件，不应放在公开的媒体目录下）
+VISUAL_INDEX_ROOT = os.environ.get('VISUAL_INDEX_ROOT') or BASE_DIR / 'visual_index'
+# 视觉相似检索：每个进程缓存的用户索引数量（每个索引常驻内存的是 id 映射和行号字典，矩阵为内存映射）
+VISUAL_INDEX_CACHE_SIZE = 32
+
 # Google Gemini API settings
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '')
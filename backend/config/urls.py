@@ -14,6 +14,8 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+import os
+
 from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
@@ -49,7 +51,7 @@ urlpatterns = [
     path('api/', include(router.urls)),
 ]
 
-# 开发环境下提供media文件访问
+# 开发环境下提供头像文件访问（图片与缩略图只能通过 /api/images/{id}/original|thumbnail|rendition/ 鉴权访问）
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(settings.MEDIA_URL + 'avatars/', document_root=os.path.join(settings.MEDIA_ROOT, 'avatars'))
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
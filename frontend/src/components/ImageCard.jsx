@@ -41,6 +41,9 @@ export default function ImageCard({ image, onFavorite, onDelete, onEdit, onCrop,
           height: 240,
           overflow: 'hidden',
           bgcolor: 'grey.200',
+          // 缩略图加载前先显示内联占位图
+          backgroundImage: image.placeholder ? `url(${image.placeholder})` : undefined,
+          backgroundSize: 'cover',
         }}
         onClick={onClick}
       >
@@ -29,6 +29,7 @@ export default function ImageEditor({ open, onClose, image, onSave, defaultMode
   const imgRef = useRef(null);
   const [imgLoaded, setImgLoaded] = useState(false);
   const [imgDimensions, setImgDimensions] = useState({ width: 0, height: 0 });
+  const [previewUrl, setPreviewUrl] = useState(null);
 
   useEffect(() => {
     if (open && image) {
@@ -43,12 +44,46 @@ export default function ImageEditor({ open, onClose, image, onSave, defaultMode
       setCropStart(null);
       setCropEnd(null);
       setClickCount(0);
+      setPreviewUrl(null);
     }
   }, [open, image, defaultMode]);
 
+  // 调整色调时请求服务端预览（防抖），预览与保存后的效果一致
+  useEffect(() => {
+    if (!open || !image || mode !== 'adjust') return undefined;
+    const { brightness, contrast, saturation } = operations;
+    if (brightness === 1.0 && contrast === 1.0 && saturation === 1.0) {
+      setPreviewUrl(null);
+      return undefined;
+    }
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await imageAPI.editPreview(image.id, operations);
+        if (!cancelled) {
+          setPreviewUrl(URL.createObjectURL(response.data));
+        }
+      } catch (error) {
+        console.error('预览失败', error);
+      }
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [open, image, mode, operations]);
+
+  // 释放上一张预览图
+  useEffect(() => () => {
+    if (previewUrl) URL.revokeObjectURL(previewUrl);
+  }, [previewUrl]);
+
+  const showPreview = mode === 'adjust' && previewUrl;
+
   const handleImageLoad = () => {
     setImgLoaded(true);
-    if (imgRef.current) {
+    // 裁剪坐标以原尺寸图片为准，预览图加载时不更新尺寸
+    if (imgRef.current && !showPreview) {
       setImgDimensions({
         width: imgRef.current.naturalWidth,
         height: imgRef.current.naturalHeight,
@@ -96,6 +131,20 @@ export default function ImageEditor({ open, onClose, image, onSave, defaultMode
     }
   };
 
+  // 撤销上次保存的编辑 / 恢复原图（服务端保留编辑步骤，原图不会被修改）
+  const handleHistory = (request) => async () => {
+    try {
+      setEditing(true);
+      await request(image.id);
+      onSave();
+    } catch (error) {
+      console.error('操作失败', error);
+      alert('操作失败，请重试');
+    } finally {
+      setEditing(false);
+    }
+  };
+
   const handleReset = () => {
     setOperations({
       brightness: 1.0,
@@ -241,14 +290,15 @@ export default function ImageEditor({ open, onClose, image, onSave, defaultMode
           >
             <img
               ref={imgRef}
-              src={image.file_url}
+              src={showPreview ? previewUrl : image.file_url}
               alt={image.title}
               onLoad={handleImageLoad}
               style={{
                 maxWidth: '100%',
                 maxHeight: '100%',
                 objectFit: 'contain',
-                filter: mode === 'adjust' 
+                // 服务端预览返回前先用 CSS 滤镜近似显示
+                filter: mode === 'adjust' && !showPreview
                   ? `brightness(${operations.brightness}) contrast(${operations.contrast}) saturate(${operations.saturation})`
                   : 'none',
                 userSelect: 'none',
@@ -349,6 +399,12 @@ export default function ImageEditor({ open, onClose, image, onSave, defaultMode
         </Box>
       </DialogContent>
       <DialogActions>
+        {image?.edit_index > 0 && (
+          <>
+            <Button onClick={handleHistory(imageAPI.undoEdit)} disabled={editing}>撤销上次编辑</Button>
+            <Button onClick={handleHistory(imageAPI.revertEdit)} disabled={editing}>恢复原图</Button>
+          </>
+        )}
         <Button onClick={handleReset}>重置</Button>
         <Button onClick={onClose}>取消</Button>
         <Button onClick={handleSave} variant="contained" disabled={editing}>
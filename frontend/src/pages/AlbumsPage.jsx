@@ -57,6 +57,7 @@ export default function AlbumsPage() {
   const [openDetailDialog, setOpenDetailDialog] = useState(false);
   const [detailAlbum, setDetailAlbum] = useState(null);
   const [detailImages, setDetailImages] = useState([]);
+  const [detailCursor, setDetailCursor] = useState(null);
 
   useEffect(() => {
     loadAlbums();
@@ -179,10 +180,16 @@ export default function AlbumsPage() {
     setDialogMode('remove');
     setSelectedImages([]);
     
-    // 加载相册中的图片
+    // 加载相册中的图片（逐页拉取）
     try {
-      const response = await albumAPI.get(album.id);
-      setAlbumImages(response.data.images || []);
+      let images = [];
+      let cursor = null;
+      do {
+        const response = await albumAPI.images(album.id, { cursor, fields: 'compact', expand: 'title' });
+        images = images.concat(response.data.results);
+        cursor = getNextCursor(response.data.next);
+      } while (cursor);
+      setAlbumImages(images);
     } catch (error) {
       console.error('加载相册图片失败:', error);
       showSnackbar('加载相册图片失败', 'error');
@@ -191,6 +198,9 @@ export default function AlbumsPage() {
     setOpenImageDialog(true);
   };
 
+  // 从分页接口的 next 链接中取出游标
+  const getNextCursor = (next) => (next ? new URL(next).searchParams.get('cursor') : null);
+
   const handleCloseImageDialog = () => {
     setOpenImageDialog(false);
     setSelectedAlbum(null);
@@ -211,16 +221,27 @@ export default function AlbumsPage() {
     setDetailAlbum(album);
     setOpenDetailDialog(true);
     
-    // 加载相册完整详情（包含所有图片）
+    // 加载相册图片第一页
     try {
-      const response = await albumAPI.get(album.id);
-      const albumDetail = response.data;
-      console.log(albumDetail);
-      setDetailImages(albumDetail.images || []);
+      const response = await albumAPI.images(album.id);
+      setDetailImages(response.data.results);
+      setDetailCursor(getNextCursor(response.data.next));
     } catch (error) {
       console.error('加载相册详情失败:', error);
       showSnackbar('加载相册详情失败', 'error');
       setDetailImages([]);
+      setDetailCursor(null);
+    }
+  };
+
+  const handleLoadMoreDetail = async () => {
+    try {
+      const response = await albumAPI.images(detailAlbum.id, { cursor: detailCursor });
+      setDetailImages(prev => [...prev, ...response.data.results]);
+      setDetailCursor(getNextCursor(response.data.next));
+    } catch (error) {
+      console.error('加载相册图片失败:', error);
+      showSnackbar('加载相册图片失败', 'error');
     }
   };
 
@@ -228,6 +249,7 @@ export default function AlbumsPage() {
     setOpenDetailDialog(false);
     setDetailAlbum(null);
     setDetailImages([]);
+    setDetailCursor(null);
   };
 
   const handleImportImages = async () => {
@@ -697,6 +719,9 @@ export default function AlbumsPage() {
                   </CardContent>
                 </Card>
               ))}
+              {detailCursor && (
+                <Button onClick={handleLoadMoreDetail}>加载更多</Button>
+              )}
             </Box>
           ) : (
             <Box
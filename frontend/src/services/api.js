@@ -110,12 +110,24 @@ export const imageAPI = {
   update: (id, data) => api.patch(`/images/${id}/`, data),
   delete: (id) => api.delete(`/images/${id}/`),
   edit: (id, operations) => api.post(`/images/${id}/edit/`, { operations }),
+  batchEdit: (imageIds, operations) =>
+    api.post('/images/batch_edit/', { image_ids: imageIds, operations }),
+  editPreview: (id, operations) =>
+    api.post(`/images/${id}/edit_preview/`, { operations }, { responseType: 'blob' }),
+  undoEdit: (id) => api.post(`/images/${id}/undo/`),
+  redoEdit: (id) => api.post(`/images/${id}/redo/`),
+  revertEdit: (id) => api.post(`/images/${id}/revert/`),
   updateTags: (id, data) => api.patch(`/images/${id}/`, data),
   addTags: (id, tags, source = 'user') => api.post(`/images/${id}/add_tags/`, { tags, source }),
   removeTags: (id, tag_ids) => api.post(`/images/${id}/remove_tags/`, { tag_ids }),
   favorite: (id) => api.post(`/images/${id}/favorite/`),
   unfavorite: (id) => api.post(`/images/${id}/unfavorite/`),
   getFavorites: (params) => api.get('/images/favorites/', { params }),
+  facets: (params) => api.get('/images/facets/', { params }),
+  geoClusters: (params) => api.get('/images/geo_clusters/', { params }),
+  similar: (id, params) => api.get(`/images/${id}/similar/`, { params }),
+  duplicates: (params) => api.get('/images/duplicates/', { params }),
+  visualSimilar: (id, params) => api.get(`/images/${id}/visual_similar/`, { params }),
 };
 
 // AI相关API
@@ -148,6 +160,7 @@ export const albumAPI = {
   create: (data) => api.post('/albums/', data),
   update: (id, data) => api.patch(`/albums/${id}/`, data),
   delete: (id) => api.delete(`/albums/${id}/`),
+  images: (id, params) => api.get(`/albums/${id}/images/`, { params }),
   addImages: (id, image_ids) => api.post(`/albums/${id}/add_images/`, { image_ids }),
   removeImages: (id, image_ids) => api.post(`/albums/${id}/remove_images/`, { image_ids }),
 };
@@ -0,0 +1,135 @@
+"""
+生成离线逆地理编码使用的国家边界数据 backend/api/data/countries.json.gz
+
+数据来源: Natural Earth 1:110m Admin 0 – Countries（公有领域）
+1:110m 数据缺少城市国家和微型国家（新加坡、摩纳哥、梵蒂冈等），这些国家以近似矩形补充，
+并排在最前面，点面判断时先于周边国家匹配
+中文名称: pycountry 附带的 ISO 3166-1 zh_CN 翻译
+
+依赖（仅生成数据时需要）: pip install pyshp pycountry
+使用方法: python script/build_boundaries.py <naturalearth_lowres.shp> [输出路径]
+"""
+import gettext
+import gzip
+import json
+import os
+import sys
+
+import pycountry
+import shapefile
+
+
+# Natural Earth 中 iso_a3 为 -99 的国家
+ISO_OVERRIDES = {
+    'France': 'FRA',
+    'Norway': 'NOR',
+    'Kosovo': 'XKX',
+    'N. Cyprus': 'CYN',
+    'Somaliland': 'SOL',
+}
+
+# 无 ISO 代码或翻译不理想时使用的中文名
+NAME_ZH_OVERRIDES = {
+    'XKX': '科索沃',
+    'CYN': '北塞浦路斯',
+    'SOL': '索马里兰',
+    'ESH': '西撒哈拉',
+    'TWN': '中国台湾',
+    'KOR': '韩国',
+    'PRK': '朝鲜',
+    'BOL': '玻利维亚',
+    'VEN': '委内瑞拉',
+    'IRN': '伊朗',
+    'SYR': '叙利亚',
+    'LAO': '老挝',
+    'MDA': '摩尔多瓦',
+    'KHM': '柬埔寨',
+    'GTM': '危地马拉',
+    'FLK': '福克兰群岛',
+    'BGD': '孟加拉国',
+    'KGZ': '吉尔吉斯斯坦',
+    'COG': '刚果（布）',
+    'COD': '刚果（金）',
+}
+
+# 1:110m 数据中缺失（被周边国家多边形覆盖或吸附到邻国）的小国: 代码 -> (英文名, 中文名, [(min_lon, min_lat, max_lon, max_lat), ...])
+SMALL_STATES = {
+    'SGP': ('Singapore', '新加坡', [(103.60, 1.20, 104.05, 1.445)]),
+    'MCO': ('Monaco', '摩纳哥', [(7.409, 43.724, 7.440, 43.752)]),
+    'VAT': ('Vatican', '梵蒂冈', [(12.4457, 41.9002, 12.4585, 41.9075)]),
+    'SMR': ('San Marino', '圣马力诺', [(12.40, 43.89, 12.52, 43.99)]),
+    'LIE': ('Liechtenstein', '列支敦士登', [(9.49, 47.05, 9.64, 47.27)]),
+    'AND': ('Andorra', '安道尔', [(1.41, 42.43, 1.79, 42.66)]),
+    'MLT': ('Malta', '马耳他', [(14.18, 35.78, 14.58, 36.09)]),
+    'BHR': ('Bahrain', '巴林', [(50.37, 25.78, 50.67, 26.33)]),
+}
+
+COORD_DIGITS = 4
+
+
+def signed_area(ring):
+    area = 0.0
+    for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+        area += x1 * y2 - x2 * y1
+    return area / 2
+
+
+def split_polygons(shape):
+    """
+    将 shapefile 的多个环拆分为多边形列表：外环（顺时针）后跟其内环
+    """
+    points = shape.points
+    parts = list(shape.parts) + [len(points)]
+    polygons = []
+    for start, end in zip(parts, parts[1:]):
+        ring = [[round(x, COORD_DIGITS), round(y, COORD_DIGITS)] for x, y in points[start:end]]
+        if signed_area(ring) <= 0 or not polygons:
+            polygons.append([ring])
+        else:
+            polygons[-1].append(ring)
+    return polygons
+
+
+def rectangle(min_lon, min_lat, max_lon, max_lat):
+    """矩形外环（顺时针）"""
+    return [[[min_lon, min_lat], [min_lon, max_lat], [max_lon, max_lat], [max_lon, min_lat]]]
+
+
+def main():
+    source = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) > 2 else os.path.join(
+        os.path.dirname(__file__), '..', 'backend', 'api', 'data', 'countries.json.gz'
+    )
+    translation = gettext.translation('iso3166-1', pycountry.LOCALES_DIR, languages=['zh_CN'])
+
+    features = [
+        {'code': code, 'name': name, 'name_zh': name_zh, 'polygons': [rectangle(*bbox) for bbox in boxes]}
+        for code, (name, name_zh, boxes) in SMALL_STATES.items()
+    ]
+    reader = shapefile.Reader(source)
+    for shape_record in reader.iterShapeRecords():
+        record = shape_record.record.as_dict()
+        code = record['iso_a3']
+        if code == '-99':
+            code = ISO_OVERRIDES[record['name']]
+        if code in SMALL_STATES:
+            continue
+        country = pycountry.countries.get(alpha_3=code)
+        name_zh = NAME_ZH_OVERRIDES.get(code) or (
+            translation.gettext(country.name) if country else record['name']
+        )
+        features.append({
+            'code': code,
+            'name': record['name'],
+            'name_zh': name_zh,
+            'polygons': split_polygons(shape_record.shape),
+        })
+
+    with gzip.open(output, 'wt', encoding='utf-8') as f:
+        json.dump({'source': 'Natural Earth 1:110m Admin 0', 'features': features}, f,
+                  ensure_ascii=False, separators=(',', ':'))
+    print(f'写入 {len(features)} 个国家到 {output}')
+
+
+if __name__ == '__main__':
+    main()